@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -48,6 +51,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "trips.middleware.TimingMiddleware",
+    "trips.middleware.CompressionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -60,9 +65,14 @@ MIDDLEWARE = [
 
 # Allow React frontend to connect (adjust for prod!)
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
 
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny'],
+    'DEFAULT_RENDERER_CLASSES': [
+        'trips.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 ROOT_URLCONF = 'backend.urls'
@@ -88,10 +98,25 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite tuned for a single node: WAL lets readers run alongside the writer,
+# synchronous=NORMAL is durable across app crashes under WAL, and IMMEDIATE
+# transactions take the write lock up front instead of failing on upgrade.
+# init_command and transaction_mode need Django 5.1+.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA temp_store=MEMORY;'
+                'PRAGMA cache_size=-20000;'
+                'PRAGMA mmap_size=134217728;'
+            ),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -136,3 +161,176 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Route cache (trips.routing): coordinates are rounded to PRECISION decimals
+# before keying, entries live for TTL seconds, MEMORY_ENTRIES are kept
+# in-process and MAX_ENTRIES in the database.
+ROUTE_CACHE = {
+    "PRECISION": 5,
+    "TTL": 7 * 24 * 3600,
+    "MEMORY_ENTRIES": 256,
+    "MAX_ENTRIES": 10000,
+}
+
+# OSRM table-service cells (trips.routing.fetch_table), cached per
+# origin/destination pair like ROUTE_CACHE. A table request carries at most
+# MAX_COORDINATES coordinates (osrm-routed's --max-table-size, 100 by
+# default); larger tables are split into blocks fetched concurrently.
+TABLE_CACHE = {
+    "TTL": 24 * 3600,
+    "MEMORY_ENTRIES": 20000,
+    "MAX_ENTRIES": 200000,
+    "MAX_COORDINATES": 100,
+}
+
+# Upstream routing/geocoding services. Point these at a self-hosted OSRM or
+# a local stand-in to keep load off the public servers.
+OSRM_BASE_URL = os.environ.get("OSRM_BASE_URL", "http://router.project-osrm.org")
+NOMINATIM_BASE_URL = os.environ.get("NOMINATIM_BASE_URL", "https://nominatim.openstreetmap.org")
+
+# Spatial index over stored routes (trips.spatial): routes are indexed by
+# CELL_DEGREES grid cells. Run manage.py rebuild_spatial_index after
+# changing it. Near/corridor radii are capped at MAX_RADIUS_MILES and
+# results at MAX_RESULTS.
+SPATIAL_INDEX = {
+    "CELL_DEGREES": 0.1,
+    "MAX_RADIUS_MILES": 250,
+    "MAX_RESULTS": 1000,
+}
+
+# Truck stops (trips.pois): PATH is a CSV or Parquet file of facilities
+# (name, lat, lon, optional parking/diesel yes/no columns). When set, a
+# rest, restart or fuel stop moves back to the last fitting facility
+# within MAX_DETOUR_MILES of the route and WINDOW_HOURS of driving before
+# the HOS limit or fuel marker.
+TRUCK_STOPS = {
+    "PATH": os.environ.get("TRUCK_STOPS_PATH") or None,
+    "MAX_DETOUR_MILES": 1.0,
+    "WINDOW_HOURS": 1.5,
+}
+
+# Mid-trip re-planning (/api/trips/<id>/replan/): a driver within
+# REJOIN_MILES of the stored route keeps it; farther off, the rest of the
+# trip is routed again from their position.
+REPLAN = {
+    "REJOIN_MILES": 2.0,
+}
+
+# Response compression (trips.middleware.CompressionMiddleware): brotli or
+# gzip, as the client accepts, for bodies of at least MIN_SIZE bytes. The
+# levels favour speed: on a 50k-point plan, gzip 4 is 5x faster than gzip
+# 6 for 1% more bytes (see manage.py bench_render). Under ASGI, bodies of
+# OFFLOAD_SIZE bytes or more are compressed off the event loop.
+COMPRESSION = {
+    "MIN_SIZE": 1024,
+    "OFFLOAD_SIZE": 64 * 1024,
+    "BROTLI_QUALITY": 4,
+    "GZIP_LEVEL": 4,
+}
+
+# Write-behind TripPlan inserts (trips.writebehind): plan-trip returns once
+# the plan is queued; a background thread bulk-inserts up to BATCH_SIZE at a
+# time. A full queue (QUEUE_SIZE) blocks requests for ENQUEUE_TIMEOUT
+# seconds, then answers 503. Ids are reserved ID_BLOCK at a time. Plans
+# that fail to insert even on their own are appended to DEAD_LETTER.
+WRITE_BEHIND = {
+    "ENABLED": os.environ.get("WRITE_BEHIND", "0") == "1",
+    "QUEUE_SIZE": 1000,
+    "BATCH_SIZE": 100,
+    "ENQUEUE_TIMEOUT": 2.0,
+    "SHUTDOWN_TIMEOUT": 30.0,
+    "ID_BLOCK": 100,
+    "DEAD_LETTER": os.environ.get("WRITE_BEHIND_DEAD_LETTER", str(BASE_DIR / "write_behind_dead_letter.jsonl")),
+}
+
+# Shared HTTP client settings (trips.upstream): BUDGET is the total seconds a
+# call may spend across all retries, the breaker opens after
+# BREAKER_THRESHOLD consecutive failures for BREAKER_RESET seconds.
+UPSTREAM = {
+    "BUDGET": 5.0,
+    "CONNECT_TIMEOUT": 2.0,
+    "RETRIES": 2,
+    "BACKOFF": 0.2,
+    "POOL_SIZE": 20,
+    "ASYNC_POOL_SIZE": 200,
+    "BREAKER_THRESHOLD": 5,
+    "BREAKER_RESET": 30.0,
+}
+
+# Geocode cache (trips.routing): keyed on the normalized address. Addresses
+# Nominatim cannot resolve are remembered for NEGATIVE_TTL seconds. Upstream
+# lookups are spaced to RATE_LIMIT per second (Nominatim's policy is 1/s).
+GEOCODE_CACHE = {
+    "TTL": 30 * 24 * 3600,
+    "NEGATIVE_TTL": 24 * 3600,
+    "MEMORY_ENTRIES": 1024,
+    "MAX_ENTRIES": 50000,
+    "RATE_LIMIT": 1.0,
+    "MAX_BATCH": 100,
+    "BATCH_WORKERS": 4,
+}
+
+# Batch planning (trips.batch): at most MAX_TRIPS per request; batches of
+# PROCESS_THRESHOLD or more trips build their timelines in a pool of
+# PROCESSES worker processes (None: one per CPU).
+BATCH_PLANNING = {
+    "MAX_TRIPS": 500,
+    "ROUTE_WORKERS": 32,
+    "PROCESSES": None,
+    "PROCESS_THRESHOLD": 8,
+    "CHUNKSIZE": 4,
+}
+
+# Stage timing (Server-Timing header, /metrics) and sampled stack profiles:
+# PROFILE_SAMPLE_RATE of requests are profiled into PROFILE_DIR as folded stacks
+METRICS = {
+    "ENABLED": os.environ.get("METRICS_ENABLED", "1") == "1",
+    "PROFILE_SAMPLE_RATE": float(os.environ.get("PROFILE_SAMPLE_RATE", "0")),
+    "PROFILE_INTERVAL": 0.005,
+    "PROFILE_DIR": os.environ.get("PROFILE_DIR", str(BASE_DIR / "profiles")),
+}
+
+# plan-trip idempotency: identical requests (or a reused Idempotency-Key)
+# inside WINDOW seconds get the saved plan back instead of a new one
+IDEMPOTENCY = {
+    "WINDOW": 600,
+    "MEMORY_ENTRIES": 1024,
+    "MAX_ENTRIES": 50000,
+}
+
+# Trip history (/api/trips/): keyset page sizes
+TRIP_HISTORY = {
+    "PAGE_SIZE": 20,
+    "MAX_PAGE_SIZE": 100,
+}
+
+# Daily log PDFs: content-addressed file cache, rendered in the batch process pool.
+# After a failed background render the same PDFs answer 500 for RETRY_FAILED_AFTER
+# seconds instead of starting another render. Renders prune the cache to files
+# younger than MAX_AGE seconds and MAX_BYTES in total (None turns a limit off).
+PDF_EXPORT = {
+    "DIR": os.environ.get("PDF_CACHE_DIR", str(BASE_DIR / "pdf_cache")),
+    "BACKGROUND": True,
+    "RETRY_FAILED_AFTER": 60,
+    "MAX_AGE": 30 * 24 * 3600,
+    "MAX_BYTES": 512 * 1024 * 1024,
+}
+
+# What-if sweeps (/api/plan-trip/sweep/): grid size cap per request
+SWEEP = {
+    "MAX_CELLS": 5000,
+}
+
+# Dispatcher assignment matrix (/api/dispatch/matrix/): request size caps.
+# Each truck/load pair costs one HOS simulation (~0.1 ms).
+DISPATCH = {
+    "MAX_TRUCKS": 500,
+    "MAX_LOADS": 50,
+    "MAX_PAIRS": 10000,
+}
+
+# Fleet HOS analytics (/api/analytics/...): longest ?from=..?to= range one
+# request may cover. Reports sum DriverDay/TruckWeek rollups of the range.
+ANALYTICS = {
+    "MAX_DAYS": 366,
+}
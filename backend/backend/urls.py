@@ -15,11 +15,14 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.urls import path, include
 
+from trips.metrics import exposition
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("trips.urls")),
     path("", lambda request: JsonResponse({"status": "ok"})),  # healthcheck
+    path("metrics", lambda request: HttpResponse(exposition(), content_type="text/plain; version=0.0.4"), name="metrics"),
 ]
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class TripsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'trips'
+
+    def ready(self):
+        # Connects the pre_delete receiver that keeps the rollups in step with deletes
+        from . import rollups  # noqa: F401
@@ -0,0 +1,109 @@
+"""Plan many trips in one request.
+
+Routes are fetched once per distinct leg across the batch; the CPU-bound
+timeline/log stages run in a process pool and the TripPlans and their
+normalized rows are written with one bulk_create per table.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+from django.conf import settings
+from .planning import build_plan, finalize_response, parse_plan_request, storable_trip, waypoints
+from .records import save_trips
+from .routing import fetch_routes
+from .upstream import UpstreamError
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+    import django
+    django.setup()
+
+
+def _build_plan_safely(args):
+    """Worker task: build the plan and its unsaved TripPlan; never raises.
+
+    The full response is only shipped back when the caller asked for detail.
+    """
+    plan, route_data, detail = args
+    try:
+        response_data = build_plan(plan, route_data)
+        return storable_trip(plan, response_data), response_data if detail else None, None
+    except Exception as e:
+        return None, None, str(e)
+
+
+def get_pool():
+    """Process pool shared by every batch request in this process (spawned lazily)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = settings.BATCH_PLANNING.get("PROCESSES") or os.cpu_count() or 1
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"), initializer=_init_worker)
+        return _pool
+
+
+def reset_pool(pool):
+    """Drop a broken ``pool`` (a worker died) so the next get_pool() starts a new one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def plan_batch(payloads, detail=False):
+    """Plan every payload; return one result dict per payload, in order.
+
+    A failing trip yields {"index", "error"} and does not affect the others.
+    """
+    conf = settings.BATCH_PLANNING
+    results = [None] * len(payloads)
+    plans = {}
+    for i, payload in enumerate(payloads):
+        try:
+            plans[i] = parse_plan_request(payload)
+        except Exception as e:
+            results[i] = {"index": i, "error": str(e)}
+
+    order = list(plans)
+    routes = fetch_routes([waypoints(plans[i]) for i in order], max_workers=conf.get("ROUTE_WORKERS", 16))
+    jobs = []
+    for i, route_data in zip(order, routes):
+        if isinstance(route_data, Exception):
+            status_hint = "upstream" if isinstance(route_data, UpstreamError) else "route"
+            results[i] = {"index": i, "error": str(route_data), "stage": status_hint}
+        else:
+            jobs.append((i, (plans[i], route_data, detail)))
+
+    if len(jobs) >= conf.get("PROCESS_THRESHOLD", 8):
+        pool = get_pool()
+        try:
+            built = list(pool.map(_build_plan_safely, [args for _, args in jobs], chunksize=conf.get("CHUNKSIZE", 4)))
+        except BrokenProcessPool:
+            reset_pool(pool)
+            raise
+    else:
+        built = [_build_plan_safely(args) for _, args in jobs]
+
+    planned = []
+    for (i, _), (trip, response_data, error) in zip(jobs, built):
+        if error is not None:
+            results[i] = {"index": i, "error": error, "stage": "plan"}
+        else:
+            planned.append((i, trip, response_data))
+
+    trips = save_trips([trip for _, trip, _ in planned])
+
+    for (i, _, response_data), trip in zip(planned, trips):
+        if detail:
+            results[i] = {"index": i, **finalize_response(plans[i], response_data, trip)}
+        else:
+            results[i] = {"index": i, "trip_id": trip.id, "summary": trip.plan_data["summary"]}
+    return results
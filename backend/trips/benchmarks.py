@@ -0,0 +1,165 @@
+"""Planning pipeline benchmarks on synthetic OSRM routes.
+
+Each scenario is a synthetic route with a fixed point count. The stages
+(build_timeline, split_into_logs, save_plan, shape_route and the whole
+plan-trip view) are timed over ``repeat`` runs, then run once more under
+tracemalloc for the peak and retained memory. Results are plain dicts so
+they can be written as JSON and compared against a stored baseline
+(see the bench_plan command).
+"""
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+from unittest import mock
+
+import django
+import numpy as np
+
+from .models import TripPlan
+from .planning import build_plan, build_timeline, finalize_response, parse_plan_request, save_plan, split_into_logs
+from .synthetic import haversine_miles, synthetic_route
+
+# name -> (waypoints [lat, lon], route points, detour factor, hours already on the cycle)
+SCENARIOS = {
+    "local": ([[40.7128, -74.0060], [40.7357, -74.1724], [40.2206, -74.7597]], 100, 1.2, 0),
+    "regional": ([[41.8781, -87.6298], [39.7684, -86.1581], [38.2527, -85.7585]], 5000, 1.2, 20),
+    "cross-country": ([[47.6062, -122.3321], [41.8781, -87.6298], [25.7617, -80.1918]], 50000, 1.2, 40),
+    # A looping multi-stop run: the detour stretches it to ~12k road miles, about four weeks of driving
+    "multi-week": ([[40.7128, -74.0060], [34.0522, -118.2437], [25.7617, -80.1918]], 500000, 2.5, 60),
+}
+STAGES = ("build_timeline", "split_into_logs", "build_plan", "save_plan", "shape_route", "plan_trip")
+METRICS = ("median_ms", "peak_kib", "retained_kib")
+
+# Default regression thresholds: relative change, and the absolute change below which it is noise
+THRESHOLD = 0.2
+MIN_DELTA = {"median_ms": 1.0, "peak_kib": 256.0, "retained_kib": 256.0}
+
+
+def scenario_route(name, seed=0):
+    """(plan-trip payload, OSRM route fixture) for a scenario."""
+    coords, n_points, detour, cycle_used = SCENARIOS[name]
+    miles = sum(haversine_miles(a, b) for a, b in zip(coords, coords[1:])) * detour
+    route = synthetic_route(coords, points_per_mile=n_points / miles, min_points=2, detour=detour, seed=seed)
+    payload = {
+        "current_location": {"lat": coords[0][0], "lng": coords[0][1], "address": "Origin"},
+        "pickup_location": {"lat": coords[1][0], "lng": coords[1][1], "address": "Pickup"},
+        "dropoff_location": {"lat": coords[2][0], "lng": coords[2][1], "address": "Dropoff"},
+        "current_cycle_used": cycle_used,
+        "start_date": "2025-01-06T06:00:00",
+        "driver_name": "Benchmark",
+    }
+    return payload, route
+
+
+def measure(fn, repeat):
+    """Time ``fn`` ``repeat`` times, then once under tracemalloc.
+
+    ``fn(i)`` gets the run number; its setup cost belongs in the caller.
+    """
+    timings = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        fn(i)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        result = fn(repeat)
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return {
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "min_ms": round(min(timings) * 1000, 3),
+        "peak_kib": round((peak - before) / 1024, 1),
+        "retained_kib": round((after - before) / 1024, 1),
+    }
+
+
+def run_scenario(name, repeat=5, stages=STAGES, client=None):
+    """Benchmark one scenario; the TripPlan rows it saves are deleted again."""
+    payload, route = scenario_route(name)
+    plan = parse_plan_request(payload)
+    args = (plan["pickup_coords"], plan["dropoff_coords"], plan["current_loc"], plan["pickup_loc"], plan["dropoff_loc"])
+    timeline = build_timeline(plan["start_time"], route, plan["current_cycle"], *args)[0]
+    response = build_plan(plan, route)
+    last_id = TripPlan.objects.order_by("-id").values_list("id", flat=True).first() or 0
+
+    def plan_trip(i):
+        # A new start time per run, so the idempotency memo never replays
+        start = plan["start_time"] + timedelta(minutes=i)
+        with mock.patch("trips.views.fetch_route", return_value=route):
+            resp = client.post("/api/plan-trip/", {**payload, "start_date": start.isoformat()}, content_type="application/json")
+        if resp.status_code != 200:
+            raise RuntimeError(f"plan-trip returned {resp.status_code}: {resp.content[:200]!r}")
+        return resp.content
+
+    runs = {
+        "build_timeline": lambda i: build_timeline(plan["start_time"], route, plan["current_cycle"], *args),
+        "split_into_logs": lambda i: split_into_logs(timeline, plan["current_loc"], plan["pickup_loc"], plan["dropoff_loc"]),
+        "build_plan": lambda i: build_plan(plan, route),
+        "save_plan": lambda i: save_plan(plan, response),
+        "shape_route": lambda i: finalize_response(plan, {**response, "route": dict(response["route"])}, mock.Mock(id=0)),
+        "plan_trip": plan_trip,
+    }
+    if client is None:
+        stages = [stage for stage in stages if stage != "plan_trip"]
+
+    try:
+        results = {stage: measure(runs[stage], repeat) for stage in stages}
+    finally:
+        TripPlan.objects.filter(id__gt=last_id).delete()
+    return {
+        "points": len(route["routes"][0]["geometry"]["coordinates"]),
+        "miles": round(response["summary"]["total_distance_miles"], 1),
+        "days": len(response["logs"]),
+        "segments": len(timeline),
+        "stages": results,
+    }
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+def compare(results, baseline, threshold=THRESHOLD, min_delta=None):
+    """Regressions of ``results`` against ``baseline`` (both run outputs).
+
+    A metric regresses when it grew by more than ``threshold`` (relative)
+    and by more than its ``min_delta`` (absolute), so sub-millisecond noise
+    on small stages is not flagged. Returns a list of dicts, worst first.
+    """
+    min_delta = {**MIN_DELTA, **(min_delta or {})}
+    regressions = []
+    for scenario, current in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(scenario)
+        if base is None:
+            continue
+        for stage, values in current["stages"].items():
+            base_values = base["stages"].get(stage)
+            if base_values is None:
+                continue
+            for metric in METRICS:
+                old, new = base_values.get(metric), values.get(metric)
+                if old is None or new is None:
+                    continue
+                if new - old > min_delta[metric] and new > old * (1 + threshold):
+                    regressions.append({
+                        "scenario": scenario,
+                        "stage": stage,
+                        "metric": metric,
+                        "baseline": old,
+                        "current": new,
+                        "change": round(new / old - 1, 3) if old else None,
+                    })
+    return sorted(regressions, key=lambda r: -(r["change"] or float("inf")))
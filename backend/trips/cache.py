@@ -0,0 +1,236 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.db import DatabaseError
+from django.utils.timezone import now
+
+logger = logging.getLogger(__name__)
+
+MISS = object()
+
+# namespace -> TieredCache, for monitoring
+caches = {}
+
+
+def make_key(*parts):
+    """Build a stable cache key from JSON-serialisable parts."""
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TieredCache:
+    """Two-tier cache: an in-process LRU in front of the CacheEntry table.
+
+    Both tiers honour the same TTL. The memory tier is bounded by
+    ``memory_size`` entries, the persistent tier by ``max_entries`` per
+    namespace (least recently used rows are pruned first).
+    """
+
+    # Keys per query in get_many/set_many
+    BATCH_SIZE = 500
+
+    def __init__(self, namespace, ttl, memory_size=256, max_entries=10000, prune_every=100, persistent=True):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self.persistent = persistent
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+        caches[namespace] = self
+
+    # -------- public API --------
+
+    def get(self, key):
+        """Return the cached value for ``key`` or ``MISS``."""
+        current = now()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > current:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+        value, expires_at = self._db_get(key, current)
+        if value is MISS:
+            self._count("misses")
+            return MISS
+
+        self._count("db_hits")
+        self._remember(key, value, expires_at)
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = now() + timedelta(seconds=self.ttl if ttl is None else ttl)
+        self._remember(key, value, expires_at)
+        self._count("sets")
+        self._db_set(key, value, expires_at)
+
+    def get_many(self, keys):
+        """{key: value} for the ``keys`` found; the database tier is read in one query per chunk."""
+        current = now()
+        found, pending = {}, []
+        with self._lock:
+            for key in keys:
+                entry = self._memory.get(key)
+                if entry is not None and entry[1] > current:
+                    self._memory.move_to_end(key)
+                    found[key] = entry[0]
+                else:
+                    self._memory.pop(key, None)
+                    pending.append(key)
+            self.counters["memory_hits"] += len(found)
+
+        rows = self._db_get_many(pending, current)
+        for key, (value, expires_at) in rows.items():
+            self._remember(key, value, expires_at)
+            found[key] = value
+        self._count("db_hits", len(rows))
+        self._count("misses", len(pending) - len(rows))
+        return found
+
+    def set_many(self, items, ttl=None):
+        """set() for a {key: value} dict, written to the database tier in one bulk upsert."""
+        if not items:
+            return
+        expires_at = now() + timedelta(seconds=self.ttl if ttl is None else ttl)
+        for key, value in items.items():
+            self._remember(key, value, expires_at)
+        self._count("sets", len(items))
+        self._db_set_many(items, expires_at)
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+        if self.persistent:
+            from .models import CacheEntry
+            try:
+                CacheEntry.objects.filter(namespace=self.namespace, key=key).delete()
+            except DatabaseError:
+                logger.warning("cache %s: delete failed", self.namespace, exc_info=True)
+
+    def clear(self, memory_only=False):
+        with self._lock:
+            self._memory.clear()
+        if self.persistent and not memory_only:
+            from .models import CacheEntry
+            CacheEntry.objects.filter(namespace=self.namespace).delete()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            counters["memory_entries"] = len(self._memory)
+        lookups = counters["memory_hits"] + counters["db_hits"] + counters["misses"]
+        counters["hit_ratio"] = round((lookups - counters["misses"]) / lookups, 4) if lookups else 0.0
+        return counters
+
+    # -------- internals --------
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def _db_get(self, key, current):
+        if not self.persistent:
+            return MISS, None
+        from .models import CacheEntry
+        try:
+            entry = CacheEntry.objects.filter(namespace=self.namespace, key=key, expires_at__gt=current).first()
+            if entry is None:
+                return MISS, None
+            # Touch on promotion only, so repeated memory hits never write.
+            CacheEntry.objects.filter(pk=entry.pk).update(last_used=current)
+            return entry.value, entry.expires_at
+        except DatabaseError:
+            logger.warning("cache %s: read failed", self.namespace, exc_info=True)
+            return MISS, None
+
+    def _db_set(self, key, value, expires_at):
+        if not self.persistent:
+            return
+        from .models import CacheEntry
+        try:
+            CacheEntry.objects.update_or_create(
+                namespace=self.namespace,
+                key=key,
+                defaults={"value": value, "expires_at": expires_at, "last_used": now()},
+            )
+            with self._lock:
+                self._writes += 1
+                prune = self._writes % self.prune_every == 0
+            if prune:
+                self.prune()
+        except DatabaseError:
+            logger.warning("cache %s: write failed", self.namespace, exc_info=True)
+
+    def _db_get_many(self, keys, current):
+        if not self.persistent or not keys:
+            return {}
+        from .models import CacheEntry
+        rows = {}
+        try:
+            for i in range(0, len(keys), self.BATCH_SIZE):
+                entries = CacheEntry.objects.filter(
+                    namespace=self.namespace, key__in=keys[i:i + self.BATCH_SIZE], expires_at__gt=current
+                ).values_list("pk", "key", "value", "expires_at")
+                pks = []
+                for pk, key, value, expires_at in entries:
+                    pks.append(pk)
+                    rows[key] = (value, expires_at)
+                if pks:
+                    CacheEntry.objects.filter(pk__in=pks).update(last_used=current)
+        except DatabaseError:
+            logger.warning("cache %s: read failed", self.namespace, exc_info=True)
+        return rows
+
+    def _db_set_many(self, items, expires_at):
+        if not self.persistent:
+            return
+        from .models import CacheEntry
+        current = now()
+        try:
+            CacheEntry.objects.bulk_create(
+                [CacheEntry(namespace=self.namespace, key=key, value=value, expires_at=expires_at, last_used=current) for key, value in items.items()],
+                batch_size=self.BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=["namespace", "key"],
+                update_fields=["value", "expires_at", "last_used"],
+            )
+            with self._lock:
+                prune = (self._writes + len(items)) // self.prune_every > self._writes // self.prune_every
+                self._writes += len(items)
+            if prune:
+                self.prune()
+        except DatabaseError:
+            logger.warning("cache %s: write failed", self.namespace, exc_info=True)
+
+    def prune(self):
+        """Drop expired rows, then the least recently used rows over ``max_entries``."""
+        from .models import CacheEntry
+        rows = CacheEntry.objects.filter(namespace=self.namespace)
+        removed, _ = rows.filter(expires_at__lte=now()).delete()
+        overflow = rows.count() - self.max_entries
+        if overflow > 0:
+            stale = list(rows.order_by("last_used").values_list("pk", flat=True)[:overflow])
+            removed += CacheEntry.objects.filter(pk__in=stale).delete()[0]
+        if removed:
+            self._count("evictions", removed)
+        return removed
@@ -0,0 +1,207 @@
+"""Dispatcher assignment matrix: which truck should take which load.
+
+Instead of a full plan per truck/load pair, one OSRM table request (see
+routing.fetch_table) gives every truck -> pickup and pickup -> dropoff
+duration and distance, and the HOS engine is run on those two numbers per
+pair: no geometry, stops or logs. Pairs are checked against the load's
+pickup_by/deliver_by times and ranked by delivery ETA; only the pairing
+the dispatcher picks needs a detailed plan (/api/plan-trip/).
+"""
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from . import hos
+from .metrics import span
+from .planning import DEFAULT_START_TIME, FUEL_INTERVAL_MILES
+from .routing import fetch_table
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # optional: without scipy, pairs are assigned greedily by ETA
+    linear_sum_assignment = None
+
+METERS_PER_MILE = 1609.34
+INFEASIBLE = 1e9
+
+
+def _coords(location, name):
+    if not isinstance(location, dict):
+        raise ValueError(f"{name} must be an object with lat and lng")
+    return [float(location["lat"]), float(location["lng"])]
+
+
+def _time(value):
+    """An ISO time as naive UTC (the plan-trip convention), or None."""
+    if not value:
+        return None
+    value = datetime.fromisoformat(value)
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo is not None else value
+
+
+def parse_dispatch_request(data, max_trucks, max_loads, max_pairs):
+    """Pull trucks, loads and the start time out of a dispatch payload.
+
+    Trucks are {id, position: {lat, lng}, current_cycle_used}; loads are
+    {id, pickup_location, dropoff_location, pickup_by?, deliver_by?}, with
+    locations as in a plan-trip payload. Ids default to list positions.
+    """
+    trucks, loads = data.get("trucks"), data.get("loads")
+    if not isinstance(trucks, list) or not 0 < len(trucks) <= max_trucks:
+        raise ValueError(f"trucks must be a list of 1 to {max_trucks} trucks")
+    if not isinstance(loads, list) or not 0 < len(loads) <= max_loads:
+        raise ValueError(f"loads must be a list of 1 to {max_loads} loads")
+    if len(trucks) * len(loads) > max_pairs:
+        raise ValueError(f"At most {max_pairs} truck/load pairs per request")
+
+    parsed_trucks = []
+    for i, truck in enumerate(trucks):
+        cycle = float(truck.get("current_cycle_used", 0))
+        if not 0 <= cycle <= hos.RULES.cycle_limit:
+            raise ValueError(f"current_cycle_used must be between 0 and {hos.RULES.cycle_limit:g}")
+        parsed_trucks.append({"id": truck.get("id", i), "position": _coords(truck.get("position"), "position"), "cycle_used": cycle})
+
+    parsed_loads = [{
+        "id": load.get("id", i),
+        "pickup": _coords(load.get("pickup_location"), "pickup_location"),
+        "dropoff": _coords(load.get("dropoff_location"), "dropoff_location"),
+        "pickup_by": _time(load.get("pickup_by")),
+        "deliver_by": _time(load.get("deliver_by")),
+    } for i, load in enumerate(loads)]
+
+    return {
+        "trucks": parsed_trucks,
+        "loads": parsed_loads,
+        "start_time": _time(data.get("start_date")) or DEFAULT_START_TIME,
+    }
+
+
+def estimate(deadhead_hours, deadhead_miles, loaded_hours, loaded_miles, cycle_used, rules=hos.RULES):
+    """HOS schedule of one pair: drive to the pickup, load, drive to the dropoff, unload.
+
+    Fuel markers fall every 1000 miles of the whole drive, at the average
+    speed of the leg they are on. Returns (hours to the pickup, hours to
+    the end of unloading, rests, restart taken).
+    """
+    drive_hours = deadhead_hours + loaded_hours
+    total_miles = deadhead_miles + loaded_miles
+    fuel_at = np.interp(
+        np.arange(FUEL_INTERVAL_MILES, total_miles, FUEL_INTERVAL_MILES),
+        [0.0, deadhead_miles, total_miles], [0.0, deadhead_hours, drive_hours],
+    ).tolist()
+
+    empty, at_pickup = hos.simulate(deadhead_hours, hos.HOSState(cycle_used=cycle_used), fuel_at, rules, pickup=False, dropoff=False)
+    loaded, final = hos.simulate(drive_hours, at_pickup, fuel_at, rules, pickup=True, dropoff=True)
+    kinds = [event.kind for event in empty + loaded]
+    return at_pickup.clock, final.clock, kinds.count("rest"), "restart" in kinds
+
+
+def _assign(cost):
+    """(truck, load) index pairs of a one-to-one assignment minimizing total cost over feasible pairs."""
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(cost)
+        pairs = zip(rows.tolist(), cols.tolist())
+    else:
+        pairs, trucks, loads = [], set(), set()
+        for flat in np.argsort(cost, axis=None, kind="stable"):
+            i, j = np.unravel_index(flat, cost.shape)
+            if i not in trucks and j not in loads:
+                pairs.append((int(i), int(j)))
+                trucks.add(i)
+                loads.add(j)
+    return sorted(((i, j) for i, j in pairs if cost[i, j] < INFEASIBLE), key=lambda pair: pair[1])
+
+
+def dispatch_matrix(request):
+    """Ranked truck/load matrix for a parsed dispatch request (see parse_dispatch_request).
+
+    ``matrix[t][j]`` is truck t taking load j (cells ruled out before
+    simulating carry no ETA); ``ranking`` lists, per load, the ids of the
+    trucks that can take it in ETA order, and ``assignment`` pairs trucks
+    and loads one-to-one for the least total hours.
+    """
+    trucks, loads, start = request["trucks"], request["loads"], request["start_time"]
+    n_trucks, n_loads = len(trucks), len(loads)
+
+    # One table: trucks and pickups to pickups and dropoffs, of which only
+    # truck -> pickup and each load's pickup -> dropoff are needed
+    with span("fetch_table"):
+        sources = [truck["position"] for truck in trucks] + [load["pickup"] for load in loads]
+        destinations = [load["pickup"] for load in loads] + [load["dropoff"] for load in loads]
+        needed = np.zeros((len(sources), len(destinations)), dtype=bool)
+        needed[:n_trucks, :n_loads] = True
+        loaded_cells = (n_trucks + np.arange(n_loads), n_loads + np.arange(n_loads))
+        needed[loaded_cells] = True
+        durations, distances = fetch_table(sources, destinations, needed)
+
+    deadhead_hours, deadhead_miles = durations[:n_trucks, :n_loads] / 3600, distances[:n_trucks, :n_loads] / METERS_PER_MILE
+    loaded_hours, loaded_miles = durations[loaded_cells] / 3600, distances[loaded_cells] / METERS_PER_MILE
+    routable = ~(np.isnan(deadhead_hours) | np.isnan(deadhead_miles) | np.isnan(loaded_hours) | np.isnan(loaded_miles))
+
+    # Pairs that miss a deadline even driving straight through (no breaks
+    # or rests) are ruled out without simulating them
+    def hours_until(name):
+        return np.array([(load[name] - start).total_seconds() / 3600 if load[name] else np.inf for load in loads])
+
+    late = np.full((n_trucks, n_loads), None, dtype=object)
+    late[deadhead_hours + hos.RULES.pickup_length + loaded_hours + hos.RULES.dropoff_length > hours_until("deliver_by")] = "misses deliver_by"
+    late[deadhead_hours > hours_until("pickup_by")] = "misses pickup_by"
+
+    with span("dispatch_estimate"):
+        # Plain floats for the per-pair loop
+        dh_hours, dh_miles, ld_hours, ld_miles = deadhead_hours.tolist(), deadhead_miles.tolist(), loaded_hours.tolist(), loaded_miles.tolist()
+        matrix, cost = [], np.full((n_trucks, n_loads), INFEASIBLE)
+        for t, truck in enumerate(trucks):
+            row = []
+            for j, load in enumerate(loads):
+                cell = {"truck": truck["id"], "load": load["id"]}
+                row.append(cell)
+                if not routable[t, j]:
+                    cell.update(feasible=False, reason="no route")
+                    continue
+                cell.update(deadhead_miles=round(dh_miles[t][j], 1), deadhead_hours=round(dh_hours[t][j], 2))
+                if late[t, j] is not None:
+                    cell.update(feasible=False, reason=late[t, j])
+                    continue
+                to_pickup, trip_hours, rests, restart = estimate(dh_hours[t][j], dh_miles[t][j], ld_hours[j], ld_miles[j], truck["cycle_used"])
+                pickup_at, eta = start + timedelta(hours=to_pickup), start + timedelta(hours=trip_hours)
+                reason = None
+                if load["pickup_by"] is not None and pickup_at > load["pickup_by"]:
+                    reason = "misses pickup_by"
+                elif load["deliver_by"] is not None and eta > load["deliver_by"]:
+                    reason = "misses deliver_by"
+                cell.update(
+                    feasible=reason is None,
+                    pickup_eta=pickup_at.isoformat(),
+                    eta=eta.isoformat(),
+                    trip_hours=round(trip_hours, 2),
+                    rests=rests,
+                    restart=restart,
+                )
+                if reason is None:
+                    cost[t, j] = trip_hours
+                else:
+                    cell["reason"] = reason
+            matrix.append(row)
+
+    ranking = []
+    for j, load in enumerate(loads):
+        feasible = np.flatnonzero(cost[:, j] < INFEASIBLE)
+        order = feasible[np.lexsort((deadhead_miles[feasible, j], cost[feasible, j]))]
+        ranking.append({"load": load["id"], "trucks": [trucks[t]["id"] for t in order.tolist()]})
+
+    return {
+        "start_time": start.isoformat(),
+        "trucks": [truck["id"] for truck in trucks],
+        "loads": [load["id"] for load in loads],
+        "matrix": matrix,
+        "ranking": ranking,
+        "assignment": [
+            {"truck": trucks[t]["id"], "load": loads[j]["id"], "eta": matrix[t][j]["eta"], "trip_hours": matrix[t][j]["trip_hours"]}
+            for t, j in _assign(cost)
+        ],
+        "loaded": [
+            {"load": load["id"], "miles": round(float(loaded_miles[j]), 1), "driving_hours": round(float(loaded_hours[j]), 2)}
+            for j, load in enumerate(loads)
+        ],
+    }
@@ -0,0 +1,126 @@
+"""Compact per-day duty-status grids for daily logs.
+
+A day's log is also kept as 96 fifteen-minute slots, one byte each: the
+code (index in STATUSES) of the status covering most of the slot, or
+NO_STATUS outside the trip. It is built at minute resolution from the
+day's segments, clipped at midnight, and only serves display: the day's
+totals are summed from the exact segment durations (segment_totals).
+Logs carry the slots base64-encoded ("grid") and TripDay rows as bytes,
+so the PDF grid and the stored rows are read off an array instead of
+re-parsing HH:MM blocks.
+"""
+import base64
+from datetime import datetime, time, timedelta
+
+import numpy as np
+
+from .hos import DRIVING, OFF_DUTY, ON_DUTY, SLEEPER
+
+MINUTES = 24 * 60
+SLOT_MINUTES = 15
+SLOTS = MINUTES // SLOT_MINUTES
+
+# Status code -> status, in log-sheet row order
+STATUSES = (OFF_DUTY, SLEEPER, DRIVING, ON_DUTY)
+CODES = {status: code for code, status in enumerate(STATUSES)}
+NO_STATUS = 255
+
+# Status code -> key in a log's "totals"
+TOTAL_KEYS = ("off_duty", "sleeper", "driving", "on_duty")
+
+
+def clip(segment):
+    """Yield ``segment`` split at each midnight it crosses (one piece per calendar day)."""
+    start, end = segment["start"], segment["end"]
+    while True:
+        midnight = datetime.combine(start.date() + timedelta(days=1), time(), tzinfo=start.tzinfo)
+        if end <= midnight:
+            yield segment if start is segment["start"] else {**segment, "start": start}
+            return
+        yield {**segment, "start": start, "end": midnight}
+        start = midnight
+
+
+def segment_spans(log_date, segments):
+    """(start minute, end minute, status) of segments on ``log_date`` (already clipped to it)."""
+    for segment in segments:
+        start, end = segment["start"], segment["end"]
+        end_minute = end.hour * 60 + end.minute if end.date() == log_date else MINUTES
+        yield start.hour * 60 + start.minute, end_minute, segment["status"]
+
+
+def _minute(hhmm):
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def block_spans(blocks):
+    """(start minute, end minute, status) of a stored log's HH:MM blocks.
+
+    A block whose end is not after its start runs to midnight (00:00 to
+    00:00 is a whole day); blocks are contiguous, so for a sub-minute block
+    the next block takes over again in minute_codes.
+    """
+    for block in blocks:
+        start, end = _minute(block["start"]), _minute(block["end"])
+        yield start, MINUTES if end <= start else end, block["status"]
+
+
+def minute_codes(spans):
+    """Status code of each minute of a day (NO_STATUS where no span covers it)."""
+    minutes = np.full(MINUTES, NO_STATUS, dtype=np.uint8)
+    for start, end, status in spans:
+        if status in CODES:
+            minutes[max(start, 0):end] = CODES[status]
+    return minutes
+
+
+# Slot of each minute of the day
+_MINUTE_SLOT = np.arange(MINUTES) // SLOT_MINUTES
+
+
+def _counts(minutes):
+    """Minutes of each status (rows) in each slot (columns)."""
+    covered = minutes != NO_STATUS
+    flat = minutes[covered].astype(np.intp) * SLOTS + _MINUTE_SLOT[covered]
+    return np.bincount(flat, minlength=len(STATUSES) * SLOTS).reshape(len(STATUSES), SLOTS)
+
+
+def to_slots(minutes):
+    """Reduce a day's minute codes to SLOTS slots, each the status covering most of it."""
+    counts = _counts(minutes)
+    slots = counts.argmax(axis=0).astype(np.uint8)
+    slots[counts.max(axis=0) == 0] = NO_STATUS
+    return slots
+
+
+def segment_totals(segments):
+    """A log's "totals": hours per status summed from its (clipped) segments' exact durations."""
+    hours = [0.0] * len(STATUSES)
+    for segment in segments:
+        if segment["status"] in CODES:
+            hours[CODES[segment["status"]]] += (segment["end"] - segment["start"]).total_seconds() / 3600
+    return {key: round(value, 2) for key, value in zip(TOTAL_KEYS, hours)}
+
+
+def encode(slots):
+    return base64.b64encode(slots.tobytes()).decode("ascii")
+
+
+def decode(grid):
+    """Slots from encode() output or raw bytes."""
+    raw = base64.b64decode(grid) if isinstance(grid, str) else bytes(grid)
+    return np.frombuffer(raw, dtype=np.uint8)
+
+
+def log_slots(log):
+    """The slots of a stored log: its "grid", or rebuilt from the HH:MM blocks of logs saved without one."""
+    if log.get("grid"):
+        return decode(log["grid"])
+    return to_slots(minute_codes(block_spans(log.get("timeBlocks", []))))
+
+
+def hour_statuses(slots):
+    """{status: hours 0-23 the status occupies at least one slot of}."""
+    per_hour = slots.reshape(24, SLOTS // 24)
+    return {status: np.flatnonzero((per_hour == code).any(axis=1)).tolist() for status, code in CODES.items()}
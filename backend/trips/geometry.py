@@ -0,0 +1,241 @@
+"""Route geometry simplification and encoding.
+
+Points are [lat, lon] pairs throughout, matching route.points in plan
+responses. Tolerances are in metres.
+"""
+import heapq
+import math
+
+import numpy as np
+
+METERS_PER_DEG_LAT = 110540.0
+METERS_PER_DEG_LON = 111320.0
+
+
+def _project(points):
+    """Equirectangular projection to metres around the route's mean latitude."""
+    arr = np.asarray(points, dtype=np.float64)
+    scale_x = METERS_PER_DEG_LON * math.cos(math.radians(float(arr[:, 0].mean())))
+    return np.column_stack((arr[:, 1] * scale_x, arr[:, 0] * METERS_PER_DEG_LAT))
+
+
+def simplify_dp(points, tolerance):
+    """Douglas–Peucker: keep points farther than ``tolerance`` from the simplified line."""
+    n = len(points)
+    if n < 3 or tolerance <= 0:
+        return [list(p) for p in points]
+    xy = _project(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = xy[start], xy[end]
+        seg = b - a
+        rel = xy[start + 1:end] - a
+        seg_len2 = float(seg @ seg)
+        if seg_len2 == 0.0:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(rel[:, 0] * seg[1] - rel[:, 1] * seg[0]) / math.sqrt(seg_len2)
+        i = int(dist.argmax())
+        if dist[i] > tolerance:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return [list(points[i]) for i in np.flatnonzero(keep)]
+
+
+def simplify_vw(points, tolerance):
+    """Visvalingam–Whyatt: drop points whose effective triangle area is below ``tolerance``²."""
+    n = len(points)
+    if n < 3 or tolerance <= 0:
+        return [list(p) for p in points]
+    xy = _project(points).tolist()
+    threshold = tolerance * tolerance
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+    removed = [False] * n
+
+    def area(i):
+        (ax, ay), (bx, by), (cx, cy) = xy[prev[i]], xy[i], xy[nxt[i]]
+        return abs((bx - ax) * (cy - ay) - (cx - ax) * (by - ay)) / 2.0
+
+    heap = [(area(i), i) for i in range(1, n - 1)]
+    heapq.heapify(heap)
+    current = {i: a for a, i in heap}
+    floor = 0.0
+    while heap:
+        a, i = heapq.heappop(heap)
+        if removed[i] or current.get(i) != a:
+            continue
+        # Effective area never decreases, so small neighbours can't sneak past a removed point.
+        floor = max(floor, a)
+        if floor >= threshold:
+            break
+        removed[i] = True
+        p, q = prev[i], nxt[i]
+        nxt[p], prev[q] = q, p
+        for j in (p, q):
+            if 0 < j < n - 1:
+                current[j] = max(area(j), floor)
+                heapq.heappush(heap, (current[j], j))
+    return [list(points[i]) for i in range(n) if not removed[i]]
+
+
+def clip_to_bbox(points, bbox):
+    """Split points into the runs that fall inside bbox, keeping one point either side."""
+    min_lat, min_lng, max_lat, max_lng = bbox
+    parts, current, last_kept = [], [], -2
+    inside = [min_lat <= lat <= max_lat and min_lng <= lng <= max_lng for lat, lng in points]
+    for i, point in enumerate(points):
+        keep = inside[i] or (i > 0 and inside[i - 1]) or (i + 1 < len(points) and inside[i + 1])
+        if not keep:
+            continue
+        if last_kept != i - 1 and current:
+            parts.append(current)
+            current = []
+        current.append(point)
+        last_kept = i
+    if current:
+        parts.append(current)
+    return parts
+
+
+SIMPLIFIERS = {"dp": simplify_dp, "vw": simplify_vw}
+
+
+_POLYLINE_BLOCK = 1 << 16  # values per vectorized pass; bounds the (n, 7) temporaries
+
+
+def encode_polyline(points, precision=5):
+    """Google encoded-polyline string for [lat, lon] points (vectorized)."""
+    arr = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if arr.size == 0:
+        return ""
+    ints = np.round(arr * 10 ** precision).astype(np.int64)
+    deltas = np.diff(ints, axis=0, prepend=0).ravel()
+    values = (deltas << 1) ^ (deltas >> 63)  # zigzag: negatives become odd
+    # Split each value into 5-bit chunks, low bits first; every chunk but
+    # the last carries the 0x20 continuation flag.
+    shifts = np.arange(7, dtype=np.int64) * 5
+    parts = []
+    for start in range(0, values.size, _POLYLINE_BLOCK):
+        block = values[start:start + _POLYLINE_BLOCK, None]
+        chunks = ((block >> shifts) & 0x1F).astype(np.uint8)
+        n_chunks = 1 + (block >= (np.int64(1) << shifts[1:])).sum(axis=1)
+        used = shifts[None, :] < (n_chunks[:, None] * 5)
+        more = shifts[None, :] < ((n_chunks[:, None] - 1) * 5)
+        chunks += 63
+        chunks[more] += 0x20
+        parts.append(chunks[used].tobytes())
+    return b"".join(parts).decode("ascii")
+
+
+def decode_polyline(encoded, precision=5):
+    """Inverse of encode_polyline (vectorized)."""
+    return decode_polyline_array(encoded, precision).tolist()
+
+
+def decode_polyline_array(encoded, precision=5):
+    """decode_polyline as an (n, 2) float array."""
+    if not encoded:
+        return np.empty((0, 2))
+    raw = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    ends = (raw & 0x20) == 0
+    group = np.concatenate(([0], np.cumsum(ends)[:-1]))
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    position = np.arange(len(raw)) - starts[group]
+    values = np.bincount(group, weights=(raw & 0x1F) << (5 * position)).astype(np.int64)
+    deltas = (values >> 1) ^ -(values & 1)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / 10 ** precision
+
+
+def parse_geometry_options(options):
+    """Validate the ``geometry`` block of a plan request.
+
+    ``simplify`` is "dp", "vw" or "none"; ``tolerance`` is in metres;
+    ``encoding`` is "coords" or "polyline"; ``levels`` is an optional list of
+    tolerances for multi-resolution output (coarse first).
+    """
+    options = options or {}
+    simplify = options.get("simplify", "none")
+    if simplify not in ("none", *SIMPLIFIERS):
+        raise ValueError(f"Unknown simplify algorithm: {simplify}")
+    encoding = options.get("encoding", "coords")
+    if encoding not in ("coords", "polyline"):
+        raise ValueError(f"Unknown geometry encoding: {encoding}")
+    tolerance = float(options.get("tolerance", 0))
+    levels = options.get("levels", [])
+    if isinstance(levels, str):
+        levels = [t for t in levels.split(",") if t]
+    levels = sorted((float(t) for t in levels), reverse=True)
+    if tolerance < 0 or any(t <= 0 for t in levels):
+        raise ValueError("Geometry tolerances must be positive")
+    return {"simplify": simplify, "tolerance": tolerance, "encoding": encoding, "levels": levels}
+
+
+def _encode(points, encoding):
+    return {"polyline": encode_polyline(points)} if encoding == "polyline" else {"points": points}
+
+
+def _shape(points, options):
+    """(simplify function, detail points) for parsed geometry options."""
+    algorithm = options["simplify"] if options["simplify"] != "none" else "dp"
+    simplify = SIMPLIFIERS[algorithm]
+    if options["simplify"] == "none" or options["tolerance"] <= 0:
+        return simplify, points
+    return simplify, simplify(points, options["tolerance"])
+
+
+def _geometry_meta(points, detail, options):
+    return {
+        "simplify": options["simplify"],
+        "tolerance": options["tolerance"],
+        "encoding": options["encoding"],
+        "original_points": len(points),
+        "points": len(detail),
+    }
+
+
+def shape_route(route, options):
+    """Apply parsed geometry options to a response ``route`` block.
+
+    The full-resolution ``points`` are replaced by the simplified geometry
+    in the requested format; ``levels`` adds coarser variants for
+    progressive map rendering.
+    """
+    points = route["points"]
+    simplify, detail = _shape(points, options)
+
+    shaped = {k: v for k, v in route.items() if k != "points"}
+    shaped.update(_encode(detail, options["encoding"]))
+    shaped["geometry"] = _geometry_meta(points, detail, options)
+    if options["levels"]:
+        shaped["levels"] = []
+        for tolerance in options["levels"]:
+            level = simplify(points, tolerance)
+            shaped["levels"].append({"tolerance": tolerance, "count": len(level), **_encode(level, options["encoding"])})
+    return shaped
+
+
+def iter_shaped_route(points, options, chunk_size=1000):
+    """shape_route for streaming: yields the geometry meta, the detail
+    geometry in chunks of ``chunk_size`` points, then each level.
+
+    ``points`` may be an (N, 2) array, so the full route is never built as
+    a list. Polyline chunks are encoded independently; decode and concatenate.
+    """
+    simplify, detail = _shape(points, options)
+    yield {"geometry": _geometry_meta(points, detail, options)}
+    for i in range(0, len(detail), chunk_size):
+        chunk = detail[i:i + chunk_size]
+        if isinstance(chunk, np.ndarray):
+            chunk = chunk.tolist()
+        yield {"offset": i, **_encode(chunk, options["encoding"])}
+    for tolerance in options["levels"]:
+        level = simplify(points, tolerance)
+        yield {"level": {"tolerance": tolerance, "count": len(level), **_encode(level, options["encoding"])}}
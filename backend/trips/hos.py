@@ -0,0 +1,235 @@
+"""Event-driven Hours-of-Service simulation.
+
+The engine works in hours from the start of the trip and jumps straight to
+the next rule boundary (11 h driving, 14 h window, 8 h since a break,
+70 h cycle, next fuel marker, end of route) instead of stepping through
+time. It is pure: inputs are numbers, outputs are DutyEvent tuples and a
+final HOSState, so it can be called in tight loops for what-if analysis.
+
+Given the offsets of truck stops along the route, a rest, restart or
+fuel stop is taken at the last suitable one shortly before its limit
+instead of wherever the limit falls.
+"""
+from bisect import bisect_right
+from dataclasses import asdict, dataclass, replace
+from typing import NamedTuple
+
+EPS = 1e-9
+
+OFF_DUTY = "Off Duty"
+SLEEPER = "Sleeper"
+DRIVING = "Driving"
+ON_DUTY = "On Duty Not Driving"
+
+# Event kind -> duty status
+STATUS = {
+    "pickup": ON_DUTY,
+    "drive": DRIVING,
+    "break": ON_DUTY,
+    "fuel": ON_DUTY,
+    "rest": OFF_DUTY,
+    "restart": OFF_DUTY,
+    "dropoff": ON_DUTY,
+}
+
+
+@dataclass(frozen=True)
+class HOSRules:
+    max_driving: float = 11.0
+    window: float = 14.0
+    break_after: float = 8.0
+    break_length: float = 0.5
+    rest_length: float = 10.0
+    cycle_limit: float = 70.0
+    restart_length: float = 34.0
+    fuel_length: float = 0.5
+    pickup_length: float = 1.0
+    dropoff_length: float = 1.0
+
+
+RULES = HOSRules()
+
+
+class DutyEvent(NamedTuple):
+    kind: str       # key of STATUS
+    start: float    # hours since trip start
+    end: float
+    driven: float   # route driving hours completed when the event starts
+    day: int        # trip day counter (+1 per rest, +2 per restart)
+
+    @property
+    def status(self):
+        return STATUS[self.kind]
+
+    @property
+    def hours(self):
+        return self.end - self.start
+
+
+@dataclass
+class HOSState:
+    """Everything the rules need to resume a simulation (see to_dict/from_dict)."""
+    clock: float = 0.0            # hours since trip start
+    driven: float = 0.0           # route driving hours completed
+    driving_today: float = 0.0    # driving since the last 10 h rest
+    window_start: float = None    # clock when the 14 h window opened (None: off duty)
+    since_break: float = 0.0      # driving since the last >= 30 min non-driving period
+    cycle_used: float = 0.0       # on-duty hours in the current 70 h cycle
+    fuel_done: int = 0            # fuel markers already passed
+    day: int = 1
+    stop_early: str = None        # "rest"/"restart"/"fuel" due now at a truck stop before the limit
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{k: data[k] for k in cls.__dataclass_fields__ if k in data})
+
+
+def _on_duty(state, kind, length, rules):
+    """Yield the event of a non-driving on-duty period, then advance state through it."""
+    if state.window_start is None:
+        state.window_start = state.clock
+    yield DutyEvent(kind, state.clock, state.clock + length, state.driven, state.day)
+    state.clock += length
+    state.cycle_used += length
+    if length >= rules.break_length - EPS:
+        state.since_break = 0.0
+
+
+def _stop_before(offsets, driven, limit, window):
+    """The last offset in [limit - window, limit] after ``driven``, or None."""
+    i = bisect_right(offsets, limit + EPS) - 1
+    if i >= 0 and offsets[i] > driven + EPS and offsets[i] >= limit - window - EPS:
+        return offsets[i]
+    return None
+
+
+def iter_events(drive_hours, state=None, fuel_at=(), rules=RULES, pickup=True, dropoff=True, stops_at=None, stop_window=1.0):
+    """Yield DutyEvents until ``drive_hours`` of route driving are done.
+
+    ``fuel_at`` lists the route driving-hour offsets of fuel markers, in
+    order. ``stops_at`` maps "rest" and "fuel" to the sorted driving-hour
+    offsets of truck stops fit for them; a drive that would end at a
+    rest/restart limit or fuel marker ends instead at the last such stop
+    at most ``stop_window`` hours before it. The caller's ``state`` is not
+    modified; the final state is the generator's return value (see
+    simulate()).
+    """
+    state = replace(state) if state is not None else HOSState()
+    return (yield from _run(drive_hours, state, list(fuel_at), rules, pickup, dropoff, stops_at, stop_window))
+
+
+def _run(drive_hours, state, fuel_at, rules, pickup, dropoff, stops_at, stop_window):
+    """iter_events working on the caller's state.
+
+    Every event is yielded before ``state`` advances through it, so while
+    the generator is suspended ``state`` is the state at the start of the
+    event just yielded (see state_at).
+    """
+    if pickup:
+        yield from _on_duty(state, "pickup", rules.pickup_length, rules)
+
+    while drive_hours - state.driven > EPS:
+        window_left = rules.window - (state.clock - state.window_start) if state.window_start is not None else rules.window
+        drive_room = min(rules.max_driving - state.driving_today, window_left)
+
+        if state.cycle_used >= rules.cycle_limit - EPS or state.stop_early == "restart":
+            yield DutyEvent("restart", state.clock, state.clock + rules.restart_length, state.driven, state.day)
+            state.stop_early = None
+            state.clock += rules.restart_length
+            state.driving_today = state.since_break = state.cycle_used = 0.0
+            state.window_start = None
+            state.day += 2
+            continue
+
+        if drive_room <= EPS or state.stop_early == "rest":
+            yield DutyEvent("rest", state.clock, state.clock + rules.rest_length, state.driven, state.day)
+            state.stop_early = None
+            state.clock += rules.rest_length
+            state.driving_today = state.since_break = 0.0
+            state.window_start = None
+            state.day += 1
+            continue
+
+        if state.since_break >= rules.break_after - EPS:
+            yield from _on_duty(state, "break", rules.break_length, rules)
+            continue
+
+        next_fuel = fuel_at[state.fuel_done] if state.fuel_done < len(fuel_at) else float("inf")
+        if state.driven >= next_fuel - EPS or state.stop_early == "fuel":
+            yield from _on_duty(state, "fuel", rules.fuel_length, rules)
+            state.stop_early = None
+            state.fuel_done += 1
+            continue
+
+        leg = min(
+            drive_hours - state.driven,
+            drive_room,
+            rules.break_after - state.since_break,
+            rules.cycle_limit - state.cycle_used,
+            next_fuel - state.driven,
+        )
+        due = None
+        if stops_at and leg < drive_hours - state.driven - EPS:
+            # What the leg runs into, in the order the checks above take them
+            if leg >= rules.cycle_limit - state.cycle_used - EPS:
+                kind, offsets = "restart", stops_at.get("rest")
+            elif leg >= drive_room - EPS:
+                kind, offsets = "rest", stops_at.get("rest")
+            elif leg >= next_fuel - state.driven - EPS:
+                kind, offsets = "fuel", stops_at.get("fuel")
+            else:
+                kind, offsets = None, None
+            stop = _stop_before(offsets, state.driven, state.driven + leg, stop_window) if offsets else None
+            if stop is not None:
+                leg, due = stop - state.driven, kind
+        if state.window_start is None:
+            state.window_start = state.clock
+        yield DutyEvent("drive", state.clock, state.clock + leg, state.driven, state.day)
+        state.clock += leg
+        state.driven += leg
+        state.driving_today += leg
+        state.since_break += leg
+        state.cycle_used += leg
+        state.stop_early = due
+
+    if dropoff:
+        yield from _on_duty(state, "dropoff", rules.dropoff_length, rules)
+    return state
+
+
+def simulate(drive_hours, state=None, fuel_at=(), rules=RULES, pickup=True, dropoff=True, stops_at=None, stop_window=1.0):
+    """Run iter_events to completion and return (events, final_state)."""
+    events = []
+    generator = iter_events(drive_hours, state, fuel_at, rules, pickup, dropoff, stops_at, stop_window)
+    while True:
+        try:
+            events.append(next(generator))
+        except StopIteration as stop:
+            return events, stop.value
+
+
+def state_at(hours, drive_hours, state=None, fuel_at=(), rules=RULES, pickup=True, stops_at=None, stop_window=1.0):
+    """Where the schedule iter_events would produce stands ``hours`` after ``state``.
+
+    Returns (HOSState, pickup still pending). A drive in progress is
+    advanced through the part already driven; any other event in progress
+    is rolled back to its start (the returned clock is then earlier), so
+    resuming from the state repeats it in full.
+    """
+    state = replace(state) if state is not None else HOSState()
+    target = state.clock + hours
+    for event in _run(drive_hours, state, list(fuel_at), rules, pickup, False, stops_at, stop_window):
+        if event.end <= target + EPS:
+            continue
+        if event.kind == "drive" and target > event.start:
+            done = target - event.start
+            state.clock = target
+            state.driven += done
+            state.driving_today += done
+            state.since_break += done
+            state.cycle_used += done
+        return state, event.kind == "pickup"
+    return state, False
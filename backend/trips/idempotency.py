@@ -0,0 +1,129 @@
+"""Idempotent plan-trip: replay repeats, collapse concurrent duplicates.
+
+Requests are identified by a canonical hash of the planning inputs
+(locations, cycle hours, start time, equipment). Inside the replay window
+a repeat gets the TripPlan saved for the first request instead of a new
+route fetch, simulation and insert; identical requests already in flight
+in this process wait for the one running computation (single-flight).
+An ``Idempotency-Key`` header pins a key to the first request's hash.
+"""
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+
+from . import writebehind
+from .cache import MISS, TieredCache, make_key
+from .models import TripPlan
+from .planning import stored_points
+
+_settings = getattr(settings, "IDEMPOTENCY", {})
+plan_memo = TieredCache(
+    "plan-memo",
+    ttl=_settings.get("WINDOW", 600),
+    memory_size=_settings.get("MEMORY_ENTRIES", 1024),
+    max_entries=_settings.get("MAX_ENTRIES", 50000),
+)
+
+
+class IdempotencyConflict(Exception):
+    """An Idempotency-Key was reused with a different request."""
+
+
+class SingleFlight:
+    """Run one call per key at a time; concurrent callers share its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Return (result, shared); ``shared`` is True for callers that waited."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return result, False
+
+
+flights = SingleFlight()
+
+
+def plan_hash(plan):
+    """Canonical hash of the inputs that determine a saved plan.
+
+    Geometry options only shape the response, so they are left out.
+    """
+    def place(coords, address):
+        return [round(float(coords[0]), 6), round(float(coords[1]), 6), (address or "").strip()]
+
+    return make_key(
+        "plan",
+        place(plan["current_coords"], plan["current_loc"]),
+        place(plan["pickup_coords"], plan["pickup_loc"]),
+        place(plan["dropoff_coords"], plan["dropoff_loc"]),
+        round(plan["current_cycle"], 6),
+        plan["start_time"].isoformat(),
+        [plan[f] or "" for f in ("driver_name", "co_driver_name", "truck_number", "trailer_number")],
+    )
+
+
+def replay_response(trip):
+    """Unshaped response payload of a saved trip (see planning.finalize_response)."""
+    response_data = dict(trip.plan_data or {})
+    response_data["route"] = {"points": stored_points(trip), "stops": response_data.get("route", {}).get("stops", [])}
+    return response_data
+
+
+def _saved(trip_id):
+    """The TripPlan with this id, queued or written, or None."""
+    # Queued plans first: no query, and no waiting on the writer's transaction
+    return writebehind.writer.get(trip_id) or TripPlan.objects.filter(id=trip_id).first()
+
+
+def idempotent_plan(plan, compute, idempotency_key=None):
+    """Return (response_data, trip, replayed) for a parsed plan request.
+
+    ``compute()`` builds and saves the plan and returns (response_data,
+    trip); it only runs when neither the memo nor an in-flight request can
+    answer. The returned response_data is a fresh dict for each caller.
+    """
+    request_hash = plan_hash(plan)
+    key_entry = make_key("idempotency-key", idempotency_key) if idempotency_key else None
+    known = plan_memo.get(key_entry) if key_entry is not None else MISS
+    if known is not MISS and known["hash"] != request_hash:
+        raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+
+    # The key's own trip first: the hash entry may be gone while the key's is not
+    trip = _saved(known["trip_id"]) if known is not MISS else None
+    if trip is None:
+        trip_id = plan_memo.get(request_hash)
+        trip = _saved(trip_id) if trip_id is not MISS else None
+    if trip is not None:
+        response_data, replayed = replay_response(trip), True
+    else:
+        def run():
+            response_data, trip = compute()
+            plan_memo.set(request_hash, trip.id)
+            return response_data, trip
+
+        (response_data, trip), replayed = flights.do(request_hash, run)
+        response_data = dict(response_data)
+
+    if key_entry is not None and known is MISS:
+        plan_memo.set(key_entry, {"hash": request_hash, "trip_id": trip.id})
+    return response_data, trip, replayed
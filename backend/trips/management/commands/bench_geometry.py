@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from trips.geometry import parse_geometry_options, shape_route
+from trips.planning import pack_geometry
+from trips.synthetic import synthetic_route
+
+ROUTES = {
+    "short": [[40.7128, -74.0060], [40.2206, -74.7597]],           # ~60 mi
+    "medium": [[41.8781, -87.6298], [39.7684, -86.1581], [38.2527, -85.7585], [36.1627, -86.7816]],  # ~500 mi
+    "transcontinental": [[40.7128, -74.0060], [41.8781, -87.6298], [34.0522, -118.2437]],  # ~2900 mi
+}
+
+VARIANTS = {
+    "full coords": {},
+    "dp 5m coords": {"simplify": "dp", "tolerance": 5},
+    "dp 10m coords": {"simplify": "dp", "tolerance": 10},
+    "vw 10m coords": {"simplify": "vw", "tolerance": 10},
+    "dp 10m polyline": {"simplify": "dp", "tolerance": 10, "encoding": "polyline"},
+    "full polyline": {"encoding": "polyline"},
+    "dp 10m polyline +3 levels": {"simplify": "dp", "tolerance": 10, "encoding": "polyline", "levels": [1000, 200, 50]},
+}
+
+
+def _size(obj):
+    return len(json.dumps(obj, separators=(",", ":")).encode("utf-8"))
+
+
+class Command(BaseCommand):
+    help = "Report route payload sizes for the geometry options on synthetic routes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--points-per-mile", type=float, default=10.0, help="Geometry density (OSRM full overview is ~5-15).")
+
+    def handle(self, *args, **opts):
+        for name, waypoints in ROUTES.items():
+            route = synthetic_route(waypoints, points_per_mile=opts["points_per_mile"], seed=0)["routes"][0]
+            points = [[lat, lon] for lon, lat in route["geometry"]["coordinates"]]
+            block = {"points": points, "stops": []}
+            miles = route["distance"] / 1609.34
+            stored = len(pack_geometry(points))
+            self.stdout.write(f"\n{name}: {miles:.0f} mi, {len(points)} points (stored geometry: {stored / 1024:.1f} KiB, raw JSON {_size(block) / 1024:.1f} KiB)")
+            for label, options in VARIANTS.items():
+                shaped = shape_route(block, parse_geometry_options(options))
+                self.stdout.write(f"  {label:<28} {shaped['geometry']['points']:>7} pts {_size(shaped) / 1024:>9.1f} KiB")
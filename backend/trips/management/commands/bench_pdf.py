@@ -0,0 +1,87 @@
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from reportlab.platypus import Table
+
+from trips import pdf
+from trips.planning import build_plan, parse_plan_request, waypoints
+from trips.synthetic import synthetic_route
+
+TRIP = {
+    "current_location": {"lat": 47.6062, "lng": -122.3321, "address": "Seattle, WA"},
+    "pickup_location": {"lat": 41.8781, "lng": -87.6298, "address": "Chicago, IL"},
+    "dropoff_location": {"lat": 25.7617, "lng": -80.1918, "address": "Miami, FL"},
+    "current_cycle_used": 20,
+    "driver_name": "Bench Driver",
+    "truck_number": "T-100",
+}
+
+
+def _per_cell_grid(blocks):
+    """The old grid construction: one setStyle call per coloured cell."""
+    occupied = pdf.grid_hours(blocks)
+    data = [["Time"] + [f"{h:02d}" for h in range(24)]]
+    for label, _ in pdf.GRID_ROWS.values():
+        data.append([label] + [""] * 24)
+    table = Table(data, style=pdf.GRID_BASE_STYLE)
+    for row, (status, (_, colour)) in enumerate(pdf.GRID_ROWS.items(), 1):
+        for h in sorted(occupied[status]):
+            table.setStyle([("BACKGROUND", (h + 1, row), (h + 1, row), colour)])
+    return table
+
+
+class Command(BaseCommand):
+    help = "Report daily log PDF rendering throughput in pages per second."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--trips", type=int, default=10, help="Trips rendered per mode.")
+
+    def handle(self, *args, **opts):
+        plan = parse_plan_request(TRIP)
+        response = build_plan(plan, synthetic_route(waypoints(plan), seed=0))
+        header = {"driver_name": plan["driver_name"], "co_driver_name": None, "truck_number": plan["truck_number"], "trailer_number": None}
+        logs, summary = response["logs"], response["summary"]
+        self.stdout.write(f"{len(logs)}-day trip, {opts['trips']} trips per mode")
+
+        def report(label, seconds, pages):
+            self.stdout.write(f"  {label:<34} {pages / seconds:>8.1f} pages/s ({seconds * 1000 / opts['trips']:.1f} ms/trip)")
+
+        # One document per trip, every day in one build
+        doc = pdf.document(header, logs, summary)
+        started = time.perf_counter()
+        for _ in range(opts["trips"]):
+            pdf.render(doc)
+        report("one pass, all days", time.perf_counter() - started, len(logs) * opts["trips"])
+
+        # One document per day (what the ZIP holds)
+        days = [pdf.document(header, [log], summary, all_logs=logs) for log in logs]
+        started = time.perf_counter()
+        for _ in range(opts["trips"]):
+            for day in days:
+                pdf.render(day)
+        report("one document per day", time.perf_counter() - started, len(logs) * opts["trips"])
+
+        # Same, with the old per-cell setStyle grid
+        original = pdf.grid_table
+        pdf.grid_table = _per_cell_grid
+        try:
+            started = time.perf_counter()
+            for _ in range(opts["trips"]):
+                for day in days:
+                    pdf.render(day)
+            report("one document per day, per-cell style", time.perf_counter() - started, len(logs) * opts["trips"])
+        finally:
+            pdf.grid_table = original
+
+        # Cached: content-address lookup only
+        with tempfile.TemporaryDirectory() as cache, override_settings(PDF_EXPORT={"DIR": cache, "BACKGROUND": False}):
+            keyed = [(pdf.document_key(doc), doc)]
+            pdf.ensure_rendered(keyed)
+            started = time.perf_counter()
+            for _ in range(opts["trips"]):
+                pdf.ensure_rendered([(pdf.document_key(doc), doc)])
+                with open(pdf.cache_path(keyed[0][0]), "rb") as f:
+                    f.read()
+            report("cached (hash + read)", time.perf_counter() - started, len(logs) * opts["trips"])
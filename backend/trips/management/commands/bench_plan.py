@@ -0,0 +1,66 @@
+import json
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from trips import benchmarks
+from trips.idempotency import plan_memo
+
+
+class Command(BaseCommand):
+    help = "Benchmark the planning pipeline on synthetic routes (latency and memory per stage)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenario", action="append", choices=list(benchmarks.SCENARIOS),
+                            help="Scenario to run (repeatable; default all).")
+        parser.add_argument("--stage", action="append", choices=benchmarks.STAGES, help="Stage to run (repeatable; default all).")
+        parser.add_argument("--repeat", type=int, default=5, help="Timed runs per stage (the median is reported).")
+        parser.add_argument("--output", help="Write the results as JSON to this file ('-' for stdout).")
+        parser.add_argument("--baseline", help="Compare against a results file written by --output.")
+        parser.add_argument("--threshold", type=float, default=benchmarks.THRESHOLD,
+                            help="Relative growth that counts as a regression (0.2 = 20%%).")
+
+    def handle(self, *args, **opts):
+        scenarios = opts["scenario"] or list(benchmarks.SCENARIOS)
+        stages = opts["stage"] or benchmarks.STAGES
+        results = {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "repeat": opts["repeat"],
+            "environment": benchmarks.environment(),
+            "scenarios": {},
+        }
+        quiet = opts["output"] == "-"
+        plan_memo.clear(memory_only=True)
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            client = Client()
+            for name in scenarios:
+                result = benchmarks.run_scenario(name, repeat=opts["repeat"], stages=stages, client=client)
+                results["scenarios"][name] = result
+                if not quiet:
+                    self.report(name, result)
+
+        if opts["output"] == "-":
+            self.stdout.write(json.dumps(results, indent=2))
+        elif opts["output"]:
+            with open(opts["output"], "w") as f:
+                json.dump(results, f, indent=2)
+
+        if opts["baseline"]:
+            with open(opts["baseline"]) as f:
+                baseline = json.load(f)
+            regressions = benchmarks.compare(results, baseline, threshold=opts["threshold"])
+            for r in regressions:
+                change = f" ({r['change']:+.0%})" if r["change"] is not None else ""
+                self.stderr.write(f"REGRESSION {r['scenario']}/{r['stage']} {r['metric']}: {r['baseline']} -> {r['current']}{change}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s) against {opts['baseline']}")
+            if not quiet:
+                self.stdout.write(f"no regressions against {opts['baseline']}")
+
+    def report(self, name, result):
+        self.stdout.write(f"\n{name}: {result['points']} points, {result['miles']:.0f} mi, {result['days']} days, {result['segments']} segments")
+        self.stdout.write(f"  {'stage':<16} {'median ms':>10} {'min ms':>10} {'peak KiB':>10} {'retained KiB':>13}")
+        for stage, m in result["stages"].items():
+            self.stdout.write(f"  {stage:<16} {m['median_ms']:>10.2f} {m['min_ms']:>10.2f} {m['peak_kib']:>10.1f} {m['retained_kib']:>13.1f}")
@@ -0,0 +1,52 @@
+import gzip
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from trips import benchmarks
+from trips.planning import build_plan, parse_plan_request
+from trips.renderers import FastJSONRenderer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _best(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000, result
+
+
+class Command(BaseCommand):
+    help = "Compare plan-trip response render time and bytes on the wire: DRF JSON vs orjson, identity vs gzip/brotli."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenario", action="append", choices=list(benchmarks.SCENARIOS), help="Route size (repeatable; default all).")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (the best is reported).")
+        parser.add_argument("--brotli-quality", type=int, default=settings.COMPRESSION.get("BROTLI_QUALITY", 4))
+        parser.add_argument("--gzip-level", type=int, default=settings.COMPRESSION.get("GZIP_LEVEL", 4))
+
+    def handle(self, *args, **opts):
+        renderers = {"drf json": JSONRenderer(), "orjson": FastJSONRenderer()}
+        for name in opts["scenario"] or benchmarks.SCENARIOS:
+            payload, route = benchmarks.scenario_route(name)
+            data = build_plan(parse_plan_request(payload), route)
+            self.stdout.write(f"\n{name}: {len(data['route']['points'])} points")
+            self.stdout.write(f"  {'encoding':<22} {'ms':>9} {'KiB':>10}")
+            for label, renderer in renderers.items():
+                ms, body = _best(lambda: renderer.render(data), opts["repeat"])
+                self.stdout.write(f"  {label:<22} {ms:>9.1f} {len(body) / 1024:>10.1f}")
+
+            codings = {"gzip -" + str(opts["gzip_level"]): lambda: gzip.compress(body, compresslevel=opts["gzip_level"], mtime=0)}
+            if brotli is not None:
+                codings["brotli q" + str(opts["brotli_quality"])] = lambda: brotli.compress(body, quality=opts["brotli_quality"])
+            for label, compress in codings.items():
+                ms, compressed = _best(compress, opts["repeat"])
+                self.stdout.write(f"  orjson + {label:<13} {ms:>9.1f} {len(compressed) / 1024:>10.1f}")
@@ -0,0 +1,80 @@
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from trips import spatial
+from trips.models import TripCell, TripPlan
+from trips.planning import pack_geometry, stored_points
+from trips.records import save_trips
+from trips.synthetic import _leg_geometry, haversine_miles
+
+SCAN_SAMPLE = 2000
+
+
+def _route(rng):
+    """A random 50-800 mile continental-US route at ~1 point per mile."""
+    origin = [rng.uniform(30.0, 47.0), rng.uniform(-122.0, -75.0)]
+    while True:
+        destination = [origin[0] + rng.uniform(-6, 6), origin[1] + rng.uniform(-8, 8)]
+        miles = haversine_miles(origin, destination)
+        if 50 <= miles <= 800 and 25 <= destination[0] <= 49 and -124 <= destination[1] <= -67:
+            return _leg_geometry(origin, destination, int(miles), rng)
+
+
+class Command(BaseCommand):
+    help = "Time spatial queries (near, bbox, corridor) over many synthetic trips; nothing is kept."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--trips", type=int, default=100000)
+        parser.add_argument("--queries", type=int, default=20, help="Queries per kind (the median is reported).")
+
+    def handle(self, *args, **opts):
+        rng = random.Random(0)
+        with transaction.atomic():
+            started = time.perf_counter()
+            for i in range(0, opts["trips"], 1000):
+                save_trips([
+                    TripPlan(driver_name="bench", plan_data={}, geometry=pack_geometry([[lat, lon] for lon, lat in _route(rng)]))
+                    for _ in range(min(1000, opts["trips"] - i))
+                ])
+            elapsed = time.perf_counter() - started
+            cells = TripCell.objects.count()
+            self.stdout.write(f"{opts['trips']} trips, {cells} cells ({cells / opts['trips']:.0f} per trip), "
+                              f"inserted in {elapsed:.1f}s incl. planning rows")
+
+            queries = {
+                "near 20 mi": lambda: spatial.near(rng.uniform(32, 45), rng.uniform(-118, -78), 20),
+                "bbox 1x1 deg": lambda: spatial.within(self._bbox(rng)),
+                "corridor 300 mi, 20 mi": lambda: spatial.corridor(self._corridor(rng), 20),
+            }
+            for label, query in queries.items():
+                timings, hits = [], []
+                for _ in range(opts["queries"]):
+                    t = time.perf_counter()
+                    hits.append(len(query()))
+                    timings.append(time.perf_counter() - t)
+                self.stdout.write(f"  {label:<24} median {np.median(timings) * 1000:8.1f} ms  "
+                                  f"p95 {np.percentile(timings, 95) * 1000:8.1f} ms  ({np.mean(hits):.0f} trips/query)")
+
+            # The old way: decode every route and scan its points
+            sample = list(TripPlan.objects.only("id", "geometry", "plan_data")[:SCAN_SAMPLE])
+            t = time.perf_counter()
+            for trip in sample:
+                points = np.asarray(stored_points(trip))
+                (np.hypot(points[:, 0] - 40.0, points[:, 1] + 90.0) < 0.3).any()
+            per_trip = (time.perf_counter() - t) / len(sample)
+            self.stdout.write(f"  {'full scan (estimated)':<24} {per_trip * opts['trips'] * 1000:8.0f} ms")
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def _bbox(rng):
+        lat, lng = rng.uniform(32, 45), rng.uniform(-118, -78)
+        return [lat, lng, lat + 1, lng + 1]
+
+    @staticmethod
+    def _corridor(rng):
+        lat, lng = rng.uniform(32, 45), rng.uniform(-118, -82)
+        return [[lat, lng + k * 0.5] for k in range(12)]
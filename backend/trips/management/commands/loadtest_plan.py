@@ -0,0 +1,185 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from django.utils.timezone import now
+
+from trips.models import TripPlan
+from trips.routing import osrm_client, route_cache
+from trips.standin import StandinServer
+from trips.writebehind import writer
+
+
+def _payload(rng):
+    """A plan-trip body with random continental-US waypoints (defeats the route cache)."""
+    def loc(name):
+        return {"lat": rng.uniform(30.0, 47.0), "lng": rng.uniform(-122.0, -75.0), "address": name}
+    return {
+        "current_location": loc("Current"),
+        "pickup_location": loc("Pickup"),
+        "dropoff_location": loc("Dropoff"),
+        "current_cycle_used": rng.uniform(0, 40),
+        "driver_name": "Load Test",
+    }
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))] if values else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test /api/plan-trip/ against a local OSRM stand-in: sync vs async throughput, "
+        "or --mode rate for a fixed arrival rate with p50/p95/p99 latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Plans per mode.")
+        parser.add_argument("--sync-workers", type=int, default=8, help="Concurrent threads driving the sync view.")
+        parser.add_argument("--concurrency", type=int, default=100, help="In-flight requests for the async view.")
+        parser.add_argument("--latency", type=float, default=0.25, help="Stand-in OSRM latency per request (s).")
+        parser.add_argument("--jitter", type=float, default=0.0, help="Stand-in extra random latency, up to this many seconds.")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stand-in responses that are 503s.")
+        parser.add_argument("--points-per-mile", type=float, default=0.5, help="Stand-in route geometry density.")
+        parser.add_argument("--mode", choices=["sync", "async", "both", "rate"], default="both")
+        parser.add_argument("--rate", type=float, default=20.0, help="Target arrivals per second (--mode rate).")
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds of arrivals (--mode rate).")
+        parser.add_argument("--max-in-flight", type=int, default=64, help="Concurrent requests cap (--mode rate).")
+        parser.add_argument("--url", help="Drive a running server at this base URL instead of the in-process app (--mode rate).")
+        parser.add_argument(
+            "--target-on-standin", action="store_true",
+            help="Confirm the --url server's OSRM_BASE_URL points at manage.py run_standin (required with --url).",
+        )
+        parser.add_argument("--keep", action="store_true", help="Keep the TripPlan rows the run creates.")
+
+    def handle(self, *args, **opts):
+        if opts["url"] and not opts["target_on_standin"]:
+            raise CommandError(
+                "--url drives a server whose upstream this command cannot redirect: start it with "
+                "OSRM_BASE_URL pointing at manage.py run_standin, then pass --target-on-standin"
+            )
+        standin = StandinServer(
+            latency=opts["latency"], points_per_mile=opts["points_per_mile"], jitter=opts["jitter"], error_rate=opts["error_rate"], seed=0,
+        ).start_process()
+        original_url, original_persistent = osrm_client.base_url, route_cache.persistent
+        osrm_client.base_url, route_cache.persistent = standin.url, False
+        # ids of the plans this run created, by the responses that reported them
+        self.trip_ids = []
+        run_started = now()
+        rng = random.Random(0)
+        results = {}
+        try:
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+                if opts["mode"] in ("sync", "both"):
+                    bodies = [json.dumps(_payload(rng)) for _ in range(opts["requests"])]
+                    results["sync"] = self.run_sync(bodies, opts["sync_workers"])
+                if opts["mode"] in ("async", "both"):
+                    bodies = [json.dumps(_payload(rng)) for _ in range(opts["requests"])]
+                    results["async"] = asyncio.run(self.run_async(bodies, opts["concurrency"]))
+                if opts["mode"] == "rate":
+                    bodies = [json.dumps(_payload(rng)) for _ in range(max(1, int(opts["rate"] * opts["duration"])))]
+                    results["rate"] = self.run_rate(bodies, opts["rate"], opts["max_in_flight"], opts["url"])
+        finally:
+            osrm_client.base_url, route_cache.persistent = original_url, original_persistent
+            route_cache.clear(memory_only=True)
+            standin.stop()
+            writer.flush(timeout=60)
+            if opts["url"]:
+                self.stdout.write(f"{len(self.trip_ids)} plans created on {opts['url']} are left there")
+            elif not opts["keep"]:
+                TripPlan.objects.filter(id__in=self.trip_ids, created_at__gte=run_started).delete()
+
+        if opts["mode"] == "rate":
+            self.stdout.write(f"stand-in latency {opts['latency']:.3f}s (+{opts['jitter']:.3f}s jitter, {opts['error_rate']:.0%} errors), "
+                              f"target {opts['rate']:.1f} req/s for {opts['duration']:.0f}s")
+        else:
+            self.stdout.write(f"stand-in latency {opts['latency']:.3f}s, {opts['requests']} plans per mode")
+        self.stdout.write(f"{'mode':<6} {'ok':>5} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for mode, r in results.items():
+            lat = [x * 1000 for x in r["latencies"]]
+            self.stdout.write(
+                f"{mode:<6} {r['ok']:>5} {r['errors']:>5} {r['ok'] / r['elapsed']:>8.1f} "
+                f"{_percentile(lat, 50):>8.1f} {_percentile(lat, 95):>8.1f} {_percentile(lat, 99):>8.1f}"
+            )
+            if r.get("statuses"):
+                self.stdout.write("       statuses: " + ", ".join(f"{code}: {n}" for code, n in sorted(r["statuses"].items())))
+
+    def run_sync(self, bodies, workers):
+        def one(body):
+            client = Client()
+            started = time.perf_counter()
+            resp = client.post("/api/plan-trip/", body, content_type="application/json")
+            return self._outcome(resp.status_code, resp.json, started)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(one, bodies))
+        return self._collect(outcomes, time.perf_counter() - started)
+
+    async def run_async(self, bodies, concurrency):
+        client = AsyncClient()
+        gate = asyncio.Semaphore(concurrency)
+
+        async def one(body):
+            async with gate:
+                started = time.perf_counter()
+                resp = await client.post("/api/plan-trip/async/", body, content_type="application/json")
+                return self._outcome(resp.status_code, resp.json, started)
+
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(one(body) for body in bodies))
+        return self._collect(outcomes, time.perf_counter() - started)
+
+    def run_rate(self, bodies, rate, max_in_flight, url=None):
+        """Open loop: request i is due at i / rate, whether or not earlier ones finished.
+
+        Latency is measured from the due time, so queueing behind a slow
+        server (or the in-flight cap) counts against it.
+        """
+        local = threading.local()
+        http = httpx.Client(base_url=url, timeout=60.0, limits=httpx.Limits(max_connections=max_in_flight)) if url else None
+
+        def one(i):
+            due = started + i / rate
+            time.sleep(max(0.0, due - time.perf_counter()))
+            try:
+                if http is not None:
+                    resp = http.post("/api/plan-trip/", content=bodies[i], headers={"Content-Type": "application/json"})
+                else:
+                    if not hasattr(local, "client"):
+                        local.client = Client()
+                    resp = local.client.post("/api/plan-trip/", bodies[i], content_type="application/json")
+            except httpx.HTTPError:
+                return 0, time.perf_counter() - due
+            return self._outcome(resp.status_code, resp.json, due)
+
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+                outcomes = list(pool.map(one, range(len(bodies))))
+        finally:
+            if http is not None:
+                http.close()
+        result = self._collect(outcomes, time.perf_counter() - started)
+        result["statuses"] = Counter(code for code, _ in outcomes)
+        return result
+
+    def _outcome(self, code, body, started):
+        """(status, seconds since ``started``); notes the trip_id of a planned trip for cleanup."""
+        elapsed = time.perf_counter() - started
+        if code == 200:
+            self.trip_ids.append(body()["trip_id"])
+        return code, elapsed
+
+    def _collect(self, outcomes, elapsed):
+        ok = [t for code, t in outcomes if code == 200]
+        return {"ok": len(ok), "errors": len(outcomes) - len(ok), "elapsed": elapsed, "latencies": ok}
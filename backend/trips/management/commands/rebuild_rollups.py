@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from trips.models import DriverDay, TruckWeek
+from trips.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Rebuild the DriverDay and TruckWeek analytics rollups from stored plans (e.g. after changing how they are counted)."
+
+    def handle(self, *args, **opts):
+        trips = rebuild()
+        self.stdout.write(f"rolled up {trips} trips into {DriverDay.objects.count()} driver days and {TruckWeek.objects.count()} truck weeks")
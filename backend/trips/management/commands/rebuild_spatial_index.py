@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from trips.models import TripCell, TripPlan
+from trips.spatial import cell_degrees, save_cells
+
+CHUNK = 500
+
+
+class Command(BaseCommand):
+    help = "Rebuild the TripCell spatial index from stored route geometry (e.g. after changing CELL_DEGREES)."
+
+    def handle(self, *args, **opts):
+        ids = list(TripPlan.objects.order_by("id").values_list("id", flat=True))
+        with transaction.atomic():
+            TripCell.objects.all().delete()
+            for i in range(0, len(ids), CHUNK):
+                save_cells(TripPlan.objects.filter(id__in=ids[i:i + CHUNK]).only("id", "geometry", "plan_data"))
+        self.stdout.write(f"indexed {len(ids)} trips in {TripCell.objects.count()} cells of {cell_degrees()} degrees")
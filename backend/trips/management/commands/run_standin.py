@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from trips.standin import StandinServer
+
+
+class Command(BaseCommand):
+    help = "Serve the OSRM/Nominatim stand-in (point OSRM_BASE_URL and NOMINATIM_BASE_URL at it)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=5001)
+        parser.add_argument("--latency", type=float, default=0.05, help="Base latency per request (s).")
+        parser.add_argument("--jitter", type=float, default=0.0, help="Extra uniform random latency, up to this many seconds.")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 503.")
+        parser.add_argument("--points-per-mile", type=float, default=2.0, help="Route geometry density.")
+        parser.add_argument("--seed", type=int, help="Seed for the latency/error draws.")
+
+    def handle(self, *args, **opts):
+        server = StandinServer(
+            opts["host"], opts["port"], latency=opts["latency"], points_per_mile=opts["points_per_mile"],
+            jitter=opts["jitter"], error_rate=opts["error_rate"], seed=opts["seed"],
+        )
+        self.stdout.write(f"stand-in serving on {server.url} (OSRM_BASE_URL={server.url} NOMINATIM_BASE_URL={server.url})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
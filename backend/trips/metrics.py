@@ -0,0 +1,253 @@
+"""Request timing spans, Prometheus metrics and a sampling profiler hook.
+
+``span(name)`` times one pipeline stage: the duration goes into the
+``trips_stage_seconds`` histogram and into the current request's
+Server-Timing header (see trips.middleware). With METRICS["ENABLED"]
+off it returns a shared no-op context manager, so instrumented code pays
+one attribute lookup and a function call.
+
+Metrics live in this process; the exposition also reads the cache and
+upstream client counters at scrape time.
+"""
+import asyncio
+import bisect
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Latency buckets in seconds (Prometheus "le" bounds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+POINT_BUCKETS = (100, 500, 1000, 5000, 10000, 50000, 100000, 500000)
+
+
+_enabled = None
+
+
+def enabled():
+    """METRICS["ENABLED"], read once (and again after a settings override)."""
+    global _enabled
+    if _enabled is None:
+        _enabled = getattr(settings, "METRICS", {}).get("ENABLED", True)
+    return _enabled
+
+
+@receiver(setting_changed)
+def _settings_changed(setting, **kwargs):
+    global _enabled
+    if setting == "METRICS":
+        _enabled = None
+
+
+# ------------------ METRICS ------------------
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help_text, labels, tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[i] += 1  # i == len(buckets) is the +Inf overflow
+            series[-2] += value
+            series[-1] += 1
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        for label_values, counts in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + (str(bound),))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {counts[-2]}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {counts[-1]}"
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+registry = []
+
+request_seconds = Histogram("trips_request_seconds", "API request latency.", ("view", "method"))
+requests_total = Counter("trips_requests_total", "API responses by status code.", ("view", "status"))
+stage_seconds = Histogram("trips_stage_seconds", "Time spent in each planning stage.", ("stage",))
+route_points = Histogram("trips_route_points", "Route geometry points per planned trip.", buckets=POINT_BUCKETS)
+
+
+def _gauges():
+    """Cache and upstream counters, read when scraped."""
+    from .cache import caches
+    from .upstream import clients
+
+    yield "# HELP trips_cache_events_total Tiered cache lookups and writes."
+    yield "# TYPE trips_cache_events_total counter"
+    for namespace, cache in sorted(caches.items()):
+        for event, value in cache.stats().items():
+            if event not in ("hit_ratio", "memory_entries"):
+                yield f"trips_cache_events_total{_labels(('cache', 'event'), (namespace, event))} {value}"
+    yield "# HELP trips_upstream_events_total Upstream requests, retries and failures."
+    yield "# TYPE trips_upstream_events_total counter"
+    for name, client in sorted(clients.items()):
+        for event, value in sorted(client.stats()["counters"].items()):
+            yield f"trips_upstream_events_total{_labels(('upstream', 'event'), (name, event))} {value}"
+    yield "# HELP trips_upstream_breaker_open Whether the upstream circuit breaker is open."
+    yield "# TYPE trips_upstream_breaker_open gauge"
+    for name, client in sorted(clients.items()):
+        yield f"trips_upstream_breaker_open{_labels(('upstream',), (name,))} {int(client.breaker.snapshot()['state'] == 'open')}"
+
+
+def exposition():
+    """Every metric in the Prometheus text format (0.0.4)."""
+    lines = [line for metric in registry for line in metric.expose()]
+    lines.extend(_gauges())
+    return "\n".join(lines) + "\n"
+
+
+# ------------------ SPANS ------------------
+
+# (name, seconds) pairs of the current request; None outside a request
+_timings = contextvars.ContextVar("trips_timings", default=None)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        stage_seconds.observe(elapsed, self.name)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((self.name, elapsed))
+        return False
+
+
+def span(name):
+    """Context manager timing one stage (a no-op when metrics are off)."""
+    return _Span(name) if enabled() else _NO_SPAN
+
+
+def start_request():
+    """Begin collecting spans for Server-Timing; returns a token for end_request."""
+    return _timings.set([])
+
+
+def end_request(token):
+    timings = _timings.get() or []
+    _timings.reset(token)
+    return timings
+
+
+def server_timing(timings, total):
+    """Server-Timing header value; repeated stages are summed."""
+    merged = {}
+    for name, seconds in timings:
+        merged[name] = merged.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in merged.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# ------------------ PROFILER ------------------
+
+class SamplingProfiler:
+    """Samples one thread's stack every ``interval`` seconds from a helper thread.
+
+    With ``task`` (an asyncio task running on that thread's event loop) only
+    samples taken while the task is the loop's current task are kept, so
+    requests sharing a loop stay out of each other's profile.
+
+    The stacks are kept as folded "outer;inner" lines with counts, the
+    input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id, interval=0.005, task=None):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.task = task
+        self._loop = task.get_loop() if task is not None else None
+        self.stacks = _Tally()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.task is not None and asyncio.current_task(self._loop) is not self.task:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
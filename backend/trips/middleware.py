@@ -0,0 +1,200 @@
+import asyncio
+import gzip
+import logging
+import os
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from . import metrics
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class TimingMiddleware:
+    """Request latency metrics, a Server-Timing header built from the
+    request's spans, and sampled stack profiles (METRICS["PROFILE_SAMPLE_RATE"]).
+
+    Runs sync or async, whichever the handler is; async requests are
+    profiled by task, so only the request's own samples are kept.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not metrics.enabled():
+            return self.get_response(request)
+
+        profiler = self._profiler()
+        token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            total = time.perf_counter() - started
+            timings = metrics.end_request(token)
+            if profiler is not None:
+                profiler.stop()
+                self._save_profile(request, profiler)
+        return self._record(request, response, timings, total)
+
+    async def __acall__(self, request):
+        if not metrics.enabled():
+            return await self.get_response(request)
+
+        profiler = self._profiler(asyncio.current_task())
+        token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            total = time.perf_counter() - started
+            timings = metrics.end_request(token)
+            if profiler is not None:
+                await sync_to_async(profiler.stop, thread_sensitive=False)()
+                await sync_to_async(self._save_profile, thread_sensitive=False)(request, profiler)
+        return self._record(request, response, timings, total)
+
+    @staticmethod
+    def _profiler(task=None):
+        conf = settings.METRICS
+        if random.random() >= conf.get("PROFILE_SAMPLE_RATE", 0.0):
+            return None
+        return metrics.SamplingProfiler(threading.get_ident(), conf.get("PROFILE_INTERVAL", 0.005), task).start()
+
+    @staticmethod
+    def _record(request, response, timings, total):
+        view = request.resolver_match.url_name if request.resolver_match else "unmatched"
+        metrics.request_seconds.observe(total, view or "unnamed", request.method)
+        metrics.requests_total.inc(view or "unnamed", str(response.status_code))
+        response["Server-Timing"] = metrics.server_timing(timings, total)
+        return response
+
+    def _save_profile(self, request, profiler):
+        directory = settings.METRICS.get("PROFILE_DIR")
+        if not directory or not profiler.stacks:
+            return
+        os.makedirs(directory, exist_ok=True)
+        name = (request.resolver_match.url_name if request.resolver_match else None) or "request"
+        path = os.path.join(directory, f"{time.time():.3f}-{name}.folded")
+        with open(path, "w") as f:
+            f.write(profiler.folded())
+        logger.info("profile of %s %s written to %s", request.method, request.path, path)
+
+
+def accepted_encodings(header):
+    """{coding: q} from an Accept-Encoding header."""
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = q
+    return accepted
+
+
+class CompressionMiddleware:
+    """Brotli or gzip for responses of at least COMPRESSION["MIN_SIZE"] bytes.
+
+    The client's Accept-Encoding picks the coding (brotli wins ties, when
+    installed). Streaming responses are passed through so NDJSON records
+    and PDFs reach the client as they are produced. Under ASGI, bodies of
+    at least COMPRESSION["OFFLOAD_SIZE"] bytes are compressed in a worker
+    thread so the event loop keeps serving other requests.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        coding = self._coding(request, response)
+        if coding is None:
+            return response
+        return self._encode(response, coding, self.compress(response.content, coding))
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        coding = self._coding(request, response)
+        if coding is None:
+            return response
+        if len(response.content) >= getattr(settings, "COMPRESSION", {}).get("OFFLOAD_SIZE", 65536):
+            body = await sync_to_async(self.compress, thread_sensitive=False)(response.content, coding)
+        else:
+            body = self.compress(response.content, coding)
+        return self._encode(response, coding, body)
+
+    def _coding(self, request, response):
+        """The coding to compress ``response`` with, or None to pass it through."""
+        conf = getattr(settings, "COMPRESSION", {})
+        if (
+            response.streaming
+            or response.has_header("Content-Encoding")
+            or len(response.content) < conf.get("MIN_SIZE", 1024)
+        ):
+            return None
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return self.negotiate(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+
+    @staticmethod
+    def compress(content, coding):
+        conf = getattr(settings, "COMPRESSION", {})
+        with metrics.span("compress"):
+            if coding == "br":
+                return brotli.compress(content, quality=conf.get("BROTLI_QUALITY", 4))
+            return gzip.compress(content, compresslevel=conf.get("GZIP_LEVEL", 6), mtime=0)
+
+    @staticmethod
+    def _encode(response, coding, body):
+        if len(body) >= len(response.content):
+            return response
+
+        response.content = body
+        response["Content-Length"] = str(len(body))
+        response["Content-Encoding"] = coding
+        # The body differs per coding, so a strong validator no longer applies
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        return response
+
+    @staticmethod
+    def negotiate(header):
+        accepted = accepted_encodings(header)
+        wildcard = accepted.get("*", 0.0)
+        best, best_q = None, 0.0
+        for coding in (("br", "gzip") if brotli is not None else ("gzip",)):
+            q = accepted.get(coding, wildcard)
+            if q > best_q:
+                best, best_q = coding, q
+        return best
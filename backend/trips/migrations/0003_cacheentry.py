@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0002_remove_tripplan_current_location_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('namespace', models.CharField(max_length=32)),
+                ('key', models.CharField(max_length=64)),
+                ('value', models.JSONField(null=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('last_used', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['namespace', 'last_used'], name='cacheentry_lru_idx')],
+                'constraints': [models.UniqueConstraint(fields=('namespace', 'key'), name='cacheentry_namespace_key')],
+            },
+        ),
+    ]
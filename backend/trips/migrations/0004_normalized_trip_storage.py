@@ -0,0 +1,113 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0003_cacheentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DutySegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField()),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('status', models.CharField(max_length=32)),
+                ('reason', models.CharField(blank=True, max_length=255)),
+            ],
+            options={
+                'ordering': ['trip', 'seq'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TripDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.PositiveSmallIntegerField()),
+                ('date', models.DateField()),
+                ('driving_hours', models.FloatField(default=0)),
+                ('on_duty_hours', models.FloatField(default=0)),
+                ('off_duty_hours', models.FloatField(default=0)),
+                ('sleeper_hours', models.FloatField(default=0)),
+                ('remarks', models.CharField(blank=True, max_length=500)),
+            ],
+            options={
+                'ordering': ['trip', 'day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TripStop',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField()),
+                ('type', models.CharField(max_length=16)),
+                ('lat', models.FloatField()),
+                ('lng', models.FloatField()),
+                ('arrival', models.DateTimeField(null=True)),
+                ('duration_hours', models.FloatField()),
+                ('reason', models.CharField(blank=True, max_length=255)),
+            ],
+            options={
+                'ordering': ['trip', 'seq'],
+            },
+        ),
+        migrations.AddField(
+            model_name='tripplan',
+            name='geometry',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='tripplan',
+            index=models.Index(fields=['driver_name', 'start_date'], name='tripplan_driver_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripplan',
+            index=models.Index(fields=['truck_number', 'start_date'], name='tripplan_truck_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripplan',
+            index=models.Index(fields=['start_date'], name='tripplan_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='dutysegment',
+            name='trip',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='trips.tripplan'),
+        ),
+        migrations.AddField(
+            model_name='tripday',
+            name='trip',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='days', to='trips.tripplan'),
+        ),
+        migrations.AddField(
+            model_name='dutysegment',
+            name='day',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='trips.tripday'),
+        ),
+        migrations.AddField(
+            model_name='tripstop',
+            name='trip',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stops', to='trips.tripplan'),
+        ),
+        migrations.AddIndex(
+            model_name='tripday',
+            index=models.Index(fields=['date'], name='tripday_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='tripday',
+            constraint=models.UniqueConstraint(fields=('trip', 'day'), name='tripday_trip_day'),
+        ),
+        migrations.AddIndex(
+            model_name='dutysegment',
+            index=models.Index(fields=['status', 'start'], name='dutysegment_status_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripstop',
+            index=models.Index(fields=['type', 'arrival'], name='tripstop_type_arrival_idx'),
+        ),
+    ]
@@ -0,0 +1,167 @@
+from datetime import datetime, time, timezone
+
+from django.db import migrations
+
+PRECISION = 6
+CHUNK = 500
+
+# Polylines and rows are built as trips.geometry and trips.records built
+# them when this migration was written; the live modules follow the
+# current models, not these.
+
+
+def encode_polyline(points, precision):
+    """Google encoded-polyline string for [lat, lon] points."""
+    chars, previous = [], (0, 0)
+    for point in points:
+        current = tuple(round(value * 10 ** precision) for value in point)
+        for value in (current[0] - previous[0], current[1] - previous[1]):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                chars.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            chars.append(chr(value + 63))
+        previous = current
+    return "".join(chars)
+
+
+def decode_polyline(encoded, precision):
+    """Inverse of encode_polyline."""
+    values, value, shift = [], 0, 0
+    for char in encoded:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1F) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    lat = lng = 0
+    points = []
+    for d_lat, d_lng in zip(values[::2], values[1::2]):
+        lat, lng = lat + d_lat, lng + d_lng
+        points.append([lat / 10 ** precision, lng / 10 ** precision])
+    return points
+
+# Stop type -> prefix of the reason on its timeline segment
+STOP_SEGMENTS = {
+    "pickup": "Loading at ",
+    "dropoff": "Unloading at ",
+    "fuel": "Fuel stop",
+    "rest": "10-hour reset",
+    "restart": "34-hour restart",
+}
+
+
+def _aware(value):
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def plan_rows(plan_data):
+    """Days, segments and stops of a stored plan as lists of field dicts."""
+    plan_data = plan_data or {}
+    days, segments = [], []
+    for log in plan_data.get("logs", []):
+        log_date = datetime.fromisoformat(log["date"]).date()
+        totals = log.get("totals", {})
+        days.append({
+            "day": log["day"],
+            "date": log_date,
+            "driving_hours": totals.get("driving", 0),
+            "on_duty_hours": totals.get("on_duty", 0),
+            "off_duty_hours": totals.get("off_duty", 0),
+            "sleeper_hours": totals.get("sleeper", 0),
+            "remarks": log.get("remarks", ""),
+        })
+        for block in log.get("timeBlocks", []):
+            start = datetime.combine(log_date, time.fromisoformat(block["start"]), tzinfo=timezone.utc)
+            segments.append({"day": log["day"], "start": start, "status": block["status"], "reason": block.get("reason", "")})
+
+    arrival = plan_data.get("summary", {}).get("estimated_arrival")
+    for seq, segment in enumerate(segments):
+        segment["seq"] = seq
+        if seq + 1 < len(segments):
+            segment["end"] = segments[seq + 1]["start"]
+        else:
+            segment["end"] = _aware(datetime.fromisoformat(arrival)) if arrival else segment["start"]
+
+    stops = []
+    pending = iter(segments)
+    for seq, stop in enumerate(plan_data.get("route", {}).get("stops", [])):
+        prefix = STOP_SEGMENTS.get(stop["type"])
+        arrival_at = None
+        if prefix is not None:
+            for segment in pending:
+                if segment["reason"].startswith(prefix):
+                    arrival_at = segment["start"]
+                    break
+        lat, lng = stop["location"]
+        stops.append({
+            "seq": seq,
+            "type": stop["type"],
+            "lat": lat,
+            "lng": lng,
+            "arrival": arrival_at,
+            "duration_hours": stop.get("duration", 0),
+            "reason": stop.get("reason", ""),
+        })
+    return days, segments, stops
+
+
+def save_rows(trips, day_model, segment_model, stop_model):
+    """Insert the child rows of already-saved trips (three bulk inserts in total)."""
+    day_rows, segment_rows, stop_rows = [], [], []
+    for trip in trips:
+        days, segments, stops = plan_rows(trip.plan_data)
+        day_rows.extend(day_model(trip_id=trip.id, **day) for day in days)
+        segment_rows.append((trip.id, segments))
+        stop_rows.extend(stop_model(trip_id=trip.id, **stop) for stop in stops)
+
+    saved_days = {(d.trip_id, d.day): d for d in day_model.objects.bulk_create(day_rows)}
+    segment_model.objects.bulk_create([
+        segment_model(trip_id=trip_id, day=saved_days[(trip_id, s["day"])], **{k: v for k, v in s.items() if k != "day"})
+        for trip_id, segments in segment_rows for s in segments
+    ])
+    stop_model.objects.bulk_create(stop_rows)
+
+
+def backfill(apps, schema_editor):
+    """Move stored geometry into TripPlan.geometry and build the normalized rows."""
+    TripPlan = apps.get_model("trips", "TripPlan")
+    models = (apps.get_model("trips", "TripDay"), apps.get_model("trips", "DutySegment"), apps.get_model("trips", "TripStop"))
+    ids = list(TripPlan.objects.filter(days__isnull=True).order_by("id").values_list("id", flat=True).distinct())
+    for i in range(0, len(ids), CHUNK):
+        trips = list(TripPlan.objects.filter(id__in=ids[i:i + CHUNK]))
+        for trip in trips:
+            route = (trip.plan_data or {}).get("route")
+            if not route or trip.geometry:
+                continue
+            if "polyline" in route:
+                points = decode_polyline(route["polyline"], route.get("precision", PRECISION))
+            else:
+                points = route.get("points", [])
+            trip.geometry = encode_polyline(points, PRECISION).encode("ascii")
+            trip.plan_data["route"] = {"stops": route.get("stops", [])}
+        TripPlan.objects.bulk_update(trips, ["geometry", "plan_data"])
+        save_rows(trips, *models)
+
+
+def restore(apps, schema_editor):
+    """Put the geometry back into plan_data before the column is dropped."""
+    TripPlan = apps.get_model("trips", "TripPlan")
+    trips = list(TripPlan.objects.exclude(geometry=None))
+    for trip in trips:
+        route = (trip.plan_data or {}).setdefault("route", {})
+        route["polyline"] = bytes(trip.geometry).decode("ascii")
+        route["precision"] = PRECISION
+    TripPlan.objects.bulk_update(trips, ["plan_data"], batch_size=CHUNK)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0004_normalized_trip_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, restore),
+    ]
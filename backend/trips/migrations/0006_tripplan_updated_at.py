@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:50
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def updated_from_created(apps, schema_editor):
+    apps.get_model("trips", "TripPlan").objects.update(updated_at=F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0005_backfill_trip_rows'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tripplan',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(updated_from_created, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='tripplan',
+            index=models.Index(fields=['created_at', 'id'], name='tripplan_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripplan',
+            index=models.Index(fields=['driver_name', 'created_at', 'id'], name='tripplan_driver_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripplan',
+            index=models.Index(fields=['truck_number', 'created_at', 'id'], name='tripplan_truck_created_idx'),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:08
+
+import math
+
+import django.db.models.deletion
+import numpy as np
+from django.conf import settings
+from django.db import migrations, models
+
+CHUNK = 500
+PRECISION = 6
+
+# Cells are computed as trips.spatial computed them when this migration
+# was written; the live module follows the current models, not these.
+
+
+def decode_polyline(encoded, precision):
+    values, value, shift = [], 0, 0
+    for char in encoded:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1F) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    return np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision
+
+
+def route_cells(points, degrees):
+    """Sorted unique cell ids a [lat, lon] polyline passes through (or borders)."""
+    if len(points) == 0:
+        return []
+    if len(points) > 1:
+        # Densify segments longer than half a cell
+        steps = np.maximum(1, np.ceil(np.abs(np.diff(points, axis=0)).max(axis=1) / (degrees / 2))).astype(np.int64)
+        if steps.max() > 1:
+            starts = np.repeat(points[:-1], steps, axis=0)
+            deltas = np.repeat(np.diff(points, axis=0) / steps[:, None], steps, axis=0)
+            offsets = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+            points = np.vstack([starts + deltas * offsets[:, None], points[-1:]])
+    grid = math.ceil(360 / degrees)
+    rows = np.floor((points[:, 0] + 90) / degrees).astype(np.int64)
+    cols = np.floor((points[:, 1] + 180) / degrees).astype(np.int64) % grid
+    return np.unique(rows * grid + cols).tolist()
+
+
+def backfill(apps, schema_editor):
+    """Index the routes of existing trips (0005 moved every route into TripPlan.geometry)."""
+    TripPlan = apps.get_model("trips", "TripPlan")
+    TripCell = apps.get_model("trips", "TripCell")
+    degrees = getattr(settings, "SPATIAL_INDEX", {}).get("CELL_DEGREES", 0.1)
+    ids = list(TripPlan.objects.exclude(geometry=None).order_by("id").values_list("id", flat=True))
+    for i in range(0, len(ids), CHUNK):
+        TripCell.objects.bulk_create([
+            TripCell(trip_id=trip.id, cell=cell)
+            for trip in TripPlan.objects.filter(id__in=ids[i:i + CHUNK]).only("id", "geometry")
+            for cell in route_cells(decode_polyline(bytes(trip.geometry).decode("ascii"), PRECISION), degrees)
+        ], batch_size=CHUNK)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0006_tripplan_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell', models.BigIntegerField()),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cells', to='trips.tripplan')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('cell', 'trip'), name='tripcell_cell_trip')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:43
+
+import numpy as np
+from django.db import migrations, models
+
+CHUNK = 500
+
+# Grids are built as trips.dutygrid built them when this migration was
+# written; the live module follows the current models, not these.
+MINUTES = 24 * 60
+SLOTS = 96
+CODES = {"Off Duty": 0, "Sleeper": 1, "Driving": 2, "On Duty Not Driving": 3}
+NO_STATUS = 255
+
+
+def _minute(hhmm):
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def log_slots(log):
+    """A log's 96 slots, each the code of the status covering most of it (NO_STATUS if none)."""
+    minutes = np.full(MINUTES, NO_STATUS, dtype=np.uint8)
+    for block in log.get("timeBlocks", []):
+        start, end = _minute(block["start"]), _minute(block["end"])
+        if block["status"] in CODES:
+            # A block whose end is not after its start runs to midnight
+            minutes[start:MINUTES if end <= start else end] = CODES[block["status"]]
+    counts = np.stack([(minutes == code).reshape(SLOTS, -1).sum(axis=1) for code in range(len(CODES))])
+    slots = counts.argmax(axis=0).astype(np.uint8)
+    slots[counts.max(axis=0) == 0] = NO_STATUS
+    return slots
+
+
+def backfill(apps, schema_editor):
+    """Fill the slot grids of existing days from their stored logs."""
+    TripPlan = apps.get_model("trips", "TripPlan")
+    TripDay = apps.get_model("trips", "TripDay")
+    ids = list(TripPlan.objects.filter(days__isnull=False).order_by("id").values_list("id", flat=True).distinct())
+    for i in range(0, len(ids), CHUNK):
+        logs = {
+            (trip.id, log["day"]): log
+            for trip in TripPlan.objects.filter(id__in=ids[i:i + CHUNK]).only("id", "plan_data")
+            for log in (trip.plan_data or {}).get("logs", [])
+        }
+        days = list(TripDay.objects.filter(trip_id__in=ids[i:i + CHUNK]))
+        for day in days:
+            log = logs.get((day.trip_id, day.day))
+            if log is not None:
+                day.grid = log_slots(log).tobytes()
+        TripDay.objects.bulk_update(days, ["grid"], batch_size=CHUNK)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0007_trip_cells'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tripday',
+            name='grid',
+            field=models.BinaryField(default=b'', max_length=96),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,134 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:48
+
+from datetime import datetime, timedelta
+
+from django.db import migrations, models
+
+CHUNK = 500
+
+# Rollups are counted as trips.rollups counted them when this migration
+# was written; the live module follows the current models, not these.
+COUNTERS = (
+    "plans", "restart_plans", "trip_days", "driving_hours", "on_duty_hours",
+    "off_duty_hours", "sleeper_hours", "miles", "rests", "restarts",
+)
+REST, RESTART = "10-hour reset", "34-hour restart"
+
+
+def _add(target, key, counters):
+    totals = target.setdefault(key, dict.fromkeys(COUNTERS, 0))
+    for name, value in counters.items():
+        totals[name] += value
+
+
+def contributions(trip, by_driver, by_truck):
+    """Add one stored plan's per-day counters to the driver and truck totals."""
+    plan_data = trip.plan_data or {}
+    logs = plan_data.get("logs", [])
+    if not logs:
+        return
+    stops, previous = {}, None
+    for log in logs:
+        for block in log.get("timeBlocks", []):
+            segment = (block["status"], block.get("reason", ""))
+            # The part after midnight of a period begun the day before
+            if not (block["start"] == "00:00" and previous == segment):
+                for kind, prefix in (("rests", REST), ("restarts", RESTART)):
+                    if segment[1].startswith(prefix):
+                        stops[log["day"], kind] = stops.get((log["day"], kind), 0) + 1
+            previous = segment
+    restart = any(kind == "restarts" for _, kind in stops)
+    total_miles = plan_data.get("summary", {}).get("total_distance_miles", 0)
+    total_driving = sum(log.get("totals", {}).get("driving", 0) for log in logs)
+
+    for n, log in enumerate(logs):
+        log_date = datetime.fromisoformat(log["date"]).date()
+        totals = log.get("totals", {})
+        counters = {
+            "plans": int(n == 0),
+            "restart_plans": int(n == 0 and restart),
+            "trip_days": 1,
+            "driving_hours": totals.get("driving", 0),
+            "on_duty_hours": totals.get("on_duty", 0),
+            "off_duty_hours": totals.get("off_duty", 0),
+            "sleeper_hours": totals.get("sleeper", 0),
+            "miles": total_miles * totals.get("driving", 0) / total_driving if total_driving else 0.0,
+            "rests": stops.get((log["day"], "rests"), 0),
+            "restarts": stops.get((log["day"], "restarts"), 0),
+        }
+        _add(by_driver, (trip.driver_name or "", log_date), counters)
+        if trip.truck_number:
+            _add(by_truck, (trip.truck_number, log_date - timedelta(days=log_date.weekday())), counters)
+
+
+def backfill(apps, schema_editor):
+    """Roll up the plans saved before the rollup tables existed."""
+    TripPlan = apps.get_model("trips", "TripPlan")
+    DriverDay = apps.get_model("trips", "DriverDay")
+    TruckWeek = apps.get_model("trips", "TruckWeek")
+    by_driver, by_truck = {}, {}
+    ids = list(TripPlan.objects.order_by("id").values_list("id", flat=True))
+    for i in range(0, len(ids), CHUNK):
+        for trip in TripPlan.objects.filter(id__in=ids[i:i + CHUNK]).only("id", "driver_name", "truck_number", "plan_data"):
+            contributions(trip, by_driver, by_truck)
+    DriverDay.objects.bulk_create(
+        [DriverDay(driver_name=driver, date=day, **counters) for (driver, day), counters in by_driver.items()], batch_size=CHUNK,
+    )
+    TruckWeek.objects.bulk_create(
+        [TruckWeek(truck_number=truck, week=week, **counters) for (truck, week), counters in by_truck.items()], batch_size=CHUNK,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0008_tripday_grid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plans', models.IntegerField(default=0)),
+                ('restart_plans', models.IntegerField(default=0)),
+                ('trip_days', models.IntegerField(default=0)),
+                ('driving_hours', models.FloatField(default=0)),
+                ('on_duty_hours', models.FloatField(default=0)),
+                ('off_duty_hours', models.FloatField(default=0)),
+                ('sleeper_hours', models.FloatField(default=0)),
+                ('miles', models.FloatField(default=0)),
+                ('rests', models.IntegerField(default=0)),
+                ('restarts', models.IntegerField(default=0)),
+                ('driver_name', models.CharField(max_length=100)),
+                ('date', models.DateField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date'], name='driverday_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('driver_name', 'date'), name='driverday_driver_date')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TruckWeek',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plans', models.IntegerField(default=0)),
+                ('restart_plans', models.IntegerField(default=0)),
+                ('trip_days', models.IntegerField(default=0)),
+                ('driving_hours', models.FloatField(default=0)),
+                ('on_duty_hours', models.FloatField(default=0)),
+                ('off_duty_hours', models.FloatField(default=0)),
+                ('sleeper_hours', models.FloatField(default=0)),
+                ('miles', models.FloatField(default=0)),
+                ('rests', models.IntegerField(default=0)),
+                ('restarts', models.IntegerField(default=0)),
+                ('truck_number', models.CharField(max_length=50)),
+                ('week', models.DateField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['week'], name='truckweek_week_idx')],
+                'constraints': [models.UniqueConstraint(fields=('truck_number', 'week'), name='truckweek_truck_week')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
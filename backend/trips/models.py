@@ -10,7 +10,173 @@ class TripPlan(models.Model):
 
     # Store the generated plan
     plan_data = models.JSONField(null=True)  # requires Postgres, Django 3.1+
+    # Full-resolution route as an encoded polyline (trips.planning.pack_geometry)
+    geometry = models.BinaryField(null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["driver_name", "start_date"], name="tripplan_driver_date_idx"),
+            models.Index(fields=["truck_number", "start_date"], name="tripplan_truck_date_idx"),
+            models.Index(fields=["start_date"], name="tripplan_date_idx"),
+            # Keyset pagination of the trip history, optionally per driver/truck
+            models.Index(fields=["created_at", "id"], name="tripplan_created_idx"),
+            models.Index(fields=["driver_name", "created_at", "id"], name="tripplan_driver_created_idx"),
+            models.Index(fields=["truck_number", "created_at", "id"], name="tripplan_truck_created_idx"),
+        ]
 
     def __str__(self):
         return f"Trip from {self.pickup_location} to {self.dropoff_location}"
+
+
+class TripDay(models.Model):
+    """One daily log of a trip, with its duty-status totals in hours."""
+    trip = models.ForeignKey(TripPlan, on_delete=models.CASCADE, related_name="days")
+    day = models.PositiveSmallIntegerField()
+    date = models.DateField()
+    driving_hours = models.FloatField(default=0)
+    on_duty_hours = models.FloatField(default=0)
+    off_duty_hours = models.FloatField(default=0)
+    sleeper_hours = models.FloatField(default=0)
+    remarks = models.CharField(max_length=500, blank=True)
+    grid = models.BinaryField(max_length=96, default=b"")  # trips.dutygrid slots, one status byte per 15 minutes
+
+    class Meta:
+        ordering = ["trip", "day"]
+        constraints = [
+            models.UniqueConstraint(fields=["trip", "day"], name="tripday_trip_day"),
+        ]
+        indexes = [
+            models.Index(fields=["date"], name="tripday_date_idx"),
+        ]
+
+    def __str__(self):
+        return f"Trip {self.trip_id} day {self.day} ({self.date})"
+
+
+class DutySegment(models.Model):
+    """A contiguous period in one duty status."""
+    trip = models.ForeignKey(TripPlan, on_delete=models.CASCADE, related_name="segments")
+    day = models.ForeignKey(TripDay, on_delete=models.CASCADE, related_name="segments")
+    seq = models.PositiveIntegerField()
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    status = models.CharField(max_length=32)
+    reason = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        ordering = ["trip", "seq"]
+        indexes = [
+            models.Index(fields=["status", "start"], name="dutysegment_status_start_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.status} {self.start:%Y-%m-%d %H:%M}-{self.end:%H:%M}"
+
+
+class TripStop(models.Model):
+    """A pickup, dropoff, fuel, rest or restart stop along the route."""
+    trip = models.ForeignKey(TripPlan, on_delete=models.CASCADE, related_name="stops")
+    seq = models.PositiveIntegerField()
+    type = models.CharField(max_length=16)
+    lat = models.FloatField()
+    lng = models.FloatField()
+    arrival = models.DateTimeField(null=True)
+    duration_hours = models.FloatField()
+    reason = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        ordering = ["trip", "seq"]
+        indexes = [
+            models.Index(fields=["type", "arrival"], name="tripstop_type_arrival_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.type} stop on trip {self.trip_id}"
+
+
+class TripCell(models.Model):
+    """A grid cell the trip's route passes through (see trips.spatial)."""
+    trip = models.ForeignKey(TripPlan, on_delete=models.CASCADE, related_name="cells")
+    cell = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            # Also the lookup index: cell ranges -> trip ids without touching the table
+            models.UniqueConstraint(fields=["cell", "trip"], name="tripcell_cell_trip"),
+        ]
+
+    def __str__(self):
+        return f"Trip {self.trip_id} cell {self.cell}"
+
+
+class CacheEntry(models.Model):
+    """Persistent tier for trips.cache.TieredCache."""
+    namespace = models.CharField(max_length=32)
+    key = models.CharField(max_length=64)
+    value = models.JSONField(null=True)
+    expires_at = models.DateTimeField(db_index=True)
+    last_used = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["namespace", "key"], name="cacheentry_namespace_key"),
+        ]
+        indexes = [
+            models.Index(fields=["namespace", "last_used"], name="cacheentry_lru_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.namespace}:{self.key}"
+
+
+class RollupCounters(models.Model):
+    """Counters shared by the HOS rollups (see trips.rollups)."""
+    plans = models.IntegerField(default=0)            # plans starting in the period
+    restart_plans = models.IntegerField(default=0)    # of those, plans taking a 34-hour restart
+    trip_days = models.IntegerField(default=0)        # one per trip per day it has a log
+    driving_hours = models.FloatField(default=0)
+    on_duty_hours = models.FloatField(default=0)
+    off_duty_hours = models.FloatField(default=0)
+    sleeper_hours = models.FloatField(default=0)
+    miles = models.FloatField(default=0)
+    rests = models.IntegerField(default=0)
+    restarts = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class DriverDay(RollupCounters):
+    """Rollup of every plan's logs per driver per day."""
+    driver_name = models.CharField(max_length=100)
+    date = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["driver_name", "date"], name="driverday_driver_date"),
+        ]
+        indexes = [
+            models.Index(fields=["date"], name="driverday_date_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.driver_name} on {self.date}"
+
+
+class TruckWeek(RollupCounters):
+    """Rollup of every plan's logs per truck per week (weeks start on Monday)."""
+    truck_number = models.CharField(max_length=50)
+    week = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["truck_number", "week"], name="truckweek_truck_week"),
+        ]
+        indexes = [
+            models.Index(fields=["week"], name="truckweek_week_idx"),
+        ]
+
+    def __str__(self):
+        return f"Truck {self.truck_number} week of {self.week}"
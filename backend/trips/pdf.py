@@ -0,0 +1,361 @@
+"""ELD daily log PDFs: rendering, content-addressed cache and background jobs.
+
+A render job takes the whole trip: either every day in one document or
+one document per day, built in a single call so the styles and table
+layouts are set up once. Files are stored under PDF_EXPORT["DIR"] by a
+hash of everything printed on them, so re-downloads (and identical logs
+on other trips) are served from disk without touching ReportLab. Missing
+files are rendered in the shared process pool; the view answers 202 until
+they are ready, and 500 for PDF_EXPORT["RETRY_FAILED_AFTER"] seconds
+after a failed render. After each render the cache is pruned to files
+younger than MAX_AGE seconds and, oldest first, to MAX_BYTES in total.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures.process import BrokenProcessPool
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from . import dutygrid
+from .hos import DRIVING, OFF_DUTY, ON_DUTY, SLEEPER
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout changes so cached files are not reused
+RENDER_VERSION = 2
+
+# Log status -> (grid label, colour)
+GRID_ROWS = {
+    OFF_DUTY: ("Off Duty", colors.green),
+    SLEEPER: ("Sleeper Berth", colors.purple),
+    DRIVING: ("Driving", colors.red),
+    ON_DUTY: ("On Duty (Not Driving)", colors.yellow),
+}
+
+_styles = getSampleStyleSheet()
+TITLE_STYLE = ParagraphStyle(name="TitleStyle", parent=_styles["Heading1"], fontSize=18, spaceAfter=12)
+NORMAL_STYLE = ParagraphStyle(name="NormalStyle", parent=_styles["Normal"], fontSize=10)
+HEADING_STYLE = _styles["Heading2"]
+
+LEGEND_STYLE = TableStyle([
+    ("TEXTCOLOR", (0, 0), (-1, -1), colors.black),
+    ("ALIGN", (0, 0), (0, -1), "CENTER"),
+    ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+    ("GRID", (0, 0), (-1, -1), 1, colors.black),
+] + [("BACKGROUND", (0, row), (0, row), colour) for row, (_, colour) in enumerate(GRID_ROWS.values(), 1)])
+GRID_BASE_STYLE = [
+    ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+    ("FONTSIZE", (0, 0), (-1, -1), 6),
+    ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+    ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
+]
+SUMMARY_STYLE = TableStyle([
+    ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+    ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+    ("GRID", (0, 0), (-1, -1), 1, colors.black),
+])
+
+
+# ------------------ RENDERING ------------------
+
+def grid_table(grid):
+    """24-hour duty grid from a log's encoded slot grid; cell colours go into the table style in one list."""
+    occupied = dutygrid.hour_statuses(dutygrid.decode(grid))
+    data = [["Time"] + [f"{h:02d}" for h in range(24)]]
+    style = list(GRID_BASE_STYLE)
+    for row, (status, (label, colour)) in enumerate(GRID_ROWS.items(), 1):
+        data.append([label] + [""] * 24)
+        style.extend(("BACKGROUND", (h + 1, row), (h + 1, row), colour) for h in occupied[status])
+    return Table(data, colWidths=[1.1 * inch] + [0.22 * inch] * 24, style=style)
+
+
+def day_story(header, log, miles_per_day):
+    """Flowables for one daily log page."""
+    totals = log.get("totals", {})
+    header = {k: escape(v) if isinstance(v, str) else v for k, v in header.items()}
+    story = [
+        Paragraph(f"DRIVER'S DAILY LOG - DAY {log['day']}", TITLE_STYLE),
+        Paragraph(f"Date: {log.get('date', 'N/A')}", NORMAL_STYLE),
+        Spacer(1, 12),
+        Paragraph(f"Driver: {header.get('driver_name') or 'N/A'}", NORMAL_STYLE),
+        Paragraph(f"Co-Driver: {header.get('co_driver_name') or 'N/A'}", NORMAL_STYLE),
+        Paragraph(f"Truck #: {header.get('truck_number') or 'N/A'}", NORMAL_STYLE),
+        Paragraph(f"Trailer #: {header.get('trailer_number') or 'N/A'}", NORMAL_STYLE),
+        Spacer(1, 12),
+        Paragraph("DUTY STATUS LEGEND", HEADING_STYLE),
+        Table([["Color", "Status"]] + [["", label] for label, _ in GRID_ROWS.values()],
+              colWidths=[0.5 * inch, 2 * inch], style=LEGEND_STYLE),
+        Spacer(1, 12),
+        grid_table(log["grid"]),
+        Spacer(1, 12),
+        Table([
+            ["Category", "Hours"],
+            ["Off Duty", f"{totals.get('off_duty', 0):.2f}"],
+            ["Sleeper Berth", f"{totals.get('sleeper', 0):.2f}"],
+            ["Driving", f"{totals.get('driving', 0):.2f}"],
+            ["On Duty (Not Driving)", f"{totals.get('on_duty', 0):.2f}"],
+        ], colWidths=[1.5 * inch, 1 * inch], style=SUMMARY_STYLE),
+        Spacer(1, 12),
+        Paragraph(f"Total Miles: {miles_per_day:.0f} miles", NORMAL_STYLE),
+        Spacer(1, 12),
+        Paragraph("Remarks", HEADING_STYLE),
+        Paragraph(escape(log.get("remarks") or "No remarks"), NORMAL_STYLE),
+    ]
+    return story
+
+
+def _build(stories):
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=54, leftMargin=54, topMargin=54, bottomMargin=54)
+    flowables = []
+    for i, story in enumerate(stories):
+        if i:
+            flowables.append(PageBreak())
+        flowables.extend(story)
+    doc.build(flowables)
+    return buffer.getvalue()
+
+
+def render(document):
+    """PDF bytes for a document() dict: one page per log, in one build."""
+    logs = document["logs"]
+    return _build([day_story(document["header"], log, document["miles_per_day"]) for log in logs])
+
+
+# ------------------ DOCUMENTS & CACHE ------------------
+
+def printed(log):
+    """The parts of a log a page prints; the duty grid is the log's slot grid (see trips.dutygrid)."""
+    return {
+        "day": log["day"],
+        "date": log.get("date"),
+        "grid": dutygrid.encode(dutygrid.log_slots(log)),
+        "totals": log.get("totals", {}),
+        "remarks": log.get("remarks"),
+    }
+
+
+def document(header, logs, summary, all_logs=None):
+    """Everything printed on a PDF of ``logs`` (the cache key is its hash)."""
+    all_logs = all_logs if all_logs is not None else logs
+    return {
+        "version": RENDER_VERSION,
+        "header": header,
+        "logs": [printed(log) for log in logs],
+        "miles_per_day": (summary or {}).get("total_distance_miles", 0) / (len(all_logs) or 1),
+    }
+
+
+def trip_documents(trip):
+    """{"all": document, 1: document, 2: ...} for a saved trip."""
+    plan_data = trip.plan_data or {}
+    logs = plan_data.get("logs", [])
+    summary = plan_data.get("summary", {})
+    header = {f: getattr(trip, f) for f in ("driver_name", "co_driver_name", "truck_number", "trailer_number")}
+    documents = {"all": document(header, logs, summary)}
+    for log in logs:
+        documents[log["day"]] = document(header, [log], summary, all_logs=logs)
+    return documents
+
+
+def document_key(doc):
+    return hashlib.sha256(json.dumps(doc, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def cache_dir():
+    path = settings.PDF_EXPORT["DIR"]
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cache_path(key):
+    return os.path.join(cache_dir(), f"{key}.pdf")
+
+
+def _store(key, data):
+    """Write atomically so readers never see a partial file."""
+    fd, tmp = tempfile.mkstemp(dir=cache_dir(), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, cache_path(key))
+
+
+def render_job(documents):
+    """Render and cache the (key, document) pairs that are not on disk yet.
+
+    Runs in a pool worker; per-day documents are built together so a whole
+    trip costs one task.
+    """
+    rendered = 0
+    for key, doc in documents:
+        if not os.path.exists(cache_path(key)):
+            _store(key, render(doc))
+            rendered += len(doc["logs"])
+    if rendered:
+        prune_cache()
+    return rendered
+
+
+def prune_cache():
+    """Delete cached files older than MAX_AGE, then the oldest PDFs until the rest fit in MAX_BYTES.
+
+    Returns the number of files removed. Files another process removed
+    first are skipped.
+    """
+    conf = settings.PDF_EXPORT
+    max_age, max_bytes = conf.get("MAX_AGE"), conf.get("MAX_BYTES")
+    if max_age is None and max_bytes is None:
+        return 0
+    entries = []
+    with os.scandir(cache_dir()) as listing:
+        for entry in listing:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort()
+
+    cutoff = time.time() - max_age if max_age is not None else None
+    removed, kept = [], []
+    for entry in entries:
+        if cutoff is not None and entry[0] < cutoff:
+            removed.append(entry)
+        elif entry[2].endswith(".pdf"):
+            kept.append(entry)
+    if max_bytes is not None:
+        total = sum(size for _, size, _ in kept)
+        for entry in kept:
+            if total <= max_bytes:
+                break
+            removed.append(entry)
+            total -= entry[1]
+    count = 0
+    for _, _, path in removed:
+        try:
+            os.remove(path)
+            count += 1
+        except FileNotFoundError:
+            pass
+    return count
+
+
+# ------------------ BACKGROUND ------------------
+
+class RenderFailed(Exception):
+    """Rendering the requested PDFs failed (recently, for a background job)."""
+
+
+_jobs = {}
+_failed = {}  # job key -> (time.monotonic() of the failure, message)
+_jobs_lock = threading.Lock()
+
+
+def _retry_after():
+    return settings.PDF_EXPORT.get("RETRY_FAILED_AFTER", 60)
+
+
+def ensure_rendered(documents):
+    """Start rendering the missing documents; True once all are cached.
+
+    One job per distinct set of keys is in flight at a time. A failed job
+    is logged and raises RenderFailed for the same keys until
+    RETRY_FAILED_AFTER has passed; the next request then retries it.
+    """
+    missing = [(key, doc) for key, doc in documents if not os.path.exists(cache_path(key))]
+    if not missing:
+        return True
+    if not settings.PDF_EXPORT.get("BACKGROUND", True):
+        try:
+            render_job(missing)
+        except Exception as e:
+            logger.exception("pdf: rendering %d documents failed", len(missing))
+            raise RenderFailed(f"PDF rendering failed ({type(e).__name__})") from e
+        return True
+
+    from .batch import get_pool, reset_pool
+
+    job_key = tuple(sorted(key for key, _ in missing))
+    with _jobs_lock:
+        failed = _failed.get(job_key)
+        if failed is not None and time.monotonic() - failed[0] < _retry_after():
+            raise RenderFailed(failed[1])
+        if job_key in _jobs:
+            return False
+        _failed.pop(job_key, None)
+        pool = get_pool()
+        try:
+            future = pool.submit(render_job, missing)
+        except BrokenProcessPool:
+            # A worker died since the last job; start over with a new pool
+            reset_pool(pool)
+            pool = get_pool()
+            future = pool.submit(render_job, missing)
+        _jobs[job_key] = future
+    # Outside the lock: the callback runs right here if the job already finished
+    future.add_done_callback(lambda done: _finish(job_key, pool, done))
+    return False
+
+
+def _finish(job_key, pool, future):
+    error = None if future.cancelled() else future.exception()
+    if error is not None:
+        logger.error("pdf: background render of %d documents failed", len(job_key), exc_info=error)
+    if isinstance(error, BrokenProcessPool):
+        from .batch import reset_pool
+
+        reset_pool(pool)
+    with _jobs_lock:
+        _jobs.pop(job_key, None)
+        if error is not None:
+            now = time.monotonic()
+            for key in [k for k, (at, _) in _failed.items() if now - at >= _retry_after()]:
+                del _failed[key]
+            _failed[job_key] = (now, f"PDF rendering failed ({type(error).__name__})")
+
+
+# ------------------ ZIP ------------------
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable file object that collects what zipfile writes."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return b"".join(chunks)
+
+
+def stream_zip(entries, chunk_size=64 * 1024):
+    """Yield a ZIP of (name, path) files as it is written (PDFs are stored, not deflated)."""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+        for name, path in entries:
+            with open(path, "rb") as source, archive.open(name, "w") as entry:
+                while chunk := source.read(chunk_size):
+                    entry.write(chunk)
+                    if data := sink.drain():
+                        yield data
+    if data := sink.drain():
+        yield data
@@ -0,0 +1,403 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.conf import settings
+
+from . import dutygrid, hos, pois, writebehind
+from .geometry import decode_polyline, encode_polyline, iter_shaped_route, parse_geometry_options, shape_route
+from .metrics import route_points, span
+from .models import TripPlan
+from .records import save_trips
+from .route_index import RouteIndex
+
+
+# ------------------ HELPERS ------------------
+
+FUEL_INTERVAL_MILES = 1000
+
+
+def fuel_markers(index, driven_miles=0.0):
+    """Driving-hour offsets of every 1000-mile fuel marker along the route.
+
+    ``driven_miles`` already driven before the route starts (on a re-plan)
+    moves the markers up.
+    """
+    first = FUEL_INTERVAL_MILES - driven_miles % FUEL_INTERVAL_MILES
+    miles = np.arange(first, index.total_miles, FUEL_INTERVAL_MILES)
+    return index.hours_at_miles(miles).tolist()
+
+
+def route_schedule(index, driven_miles=0.0):
+    """(fuel marker offsets, RouteStops or None): what simulating a route needs besides the HOS state."""
+    return fuel_markers(index, driven_miles), pois.along(index)
+
+
+def simulate_route(index, drive_hours, state, pickup=True, schedule=None):
+    """hos.simulate over a route, ending drives at truck stops when a dataset is configured.
+
+    ``schedule`` is route_schedule(index) when the caller already has it.
+    Returns (events, final state, RouteStops or None).
+    """
+    fuel_at, facilities = schedule or route_schedule(index)
+    events, final = hos.simulate(
+        drive_hours, state, fuel_at=fuel_at, pickup=pickup,
+        stops_at=facilities.offsets() if facilities else None,
+        stop_window=settings.TRUCK_STOPS.get("WINDOW_HOURS", 1.0),
+    )
+    return events, final, facilities
+
+
+def plan_places(plan):
+    """Names and coordinates of a plan's waypoints, as kept in its checkpoint."""
+    return {
+        "current": plan["current_loc"],
+        "pickup": plan["pickup_loc"],
+        "dropoff": plan["dropoff_loc"],
+        "pickup_coords": plan["pickup_coords"],
+        "dropoff_coords": plan["dropoff_coords"],
+    }
+
+
+def make_checkpoint(start_time, state, drive_hours, schedule, places, route_miles=0.0, pickup=True):
+    """Serializable resume point of a plan (see trips.replan).
+
+    The HOS state at ``start_time`` with everything needed to re-run the
+    simulation from there: remaining driving hours, fuel markers and truck
+    stops in the same driving-hour frame, where that frame starts along the
+    stored geometry (miles) and whether the pickup is still ahead.
+    """
+    fuel_at, facilities = schedule
+    return {
+        "time": start_time.isoformat(),
+        "state": state.to_dict(),
+        "drive_hours": drive_hours,
+        "route_miles": route_miles,
+        "pickup": pickup,
+        "fuel_at": list(fuel_at),
+        "stops_at": facilities.offsets() if facilities else None,
+        "places": places,
+    }
+
+
+def _route_stop(kind, event, index, facilities, reason):
+    """Stop dict for a fuel/rest/restart event, at its truck stop if it was ended at one."""
+    stop = {"type": kind, "location": index.point_at_hours(event.driven), "duration": round(event.hours, 2), "reason": reason}
+    facility = facilities.at(event.driven, "fuel" if kind == "fuel" else "rest") if facilities else None
+    if facility is not None:
+        stop["location"] = facility.pop("location")
+        stop["facility"] = facility
+    return stop
+
+
+def iter_timeline(events, start_time, index, pickup_coords, dropoff_coords, pickup_loc, dropoff_loc, facilities=None):
+    """Yield (timeline segment, route stop or None) for each engine DutyEvent.
+
+    ``facilities`` (RouteStops) puts fuel and rest stops at the truck stops
+    the engine ended drives at.
+    """
+    for event in events:
+        segment = {
+            "day": event.day,
+            "start": start_time + timedelta(hours=event.start),
+            "end": start_time + timedelta(hours=event.end),
+            "status": event.status,
+        }
+        stop = None
+        if event.kind == "pickup":
+            segment["reason"] = f"Loading at {pickup_loc}"
+            stop = {"type": "pickup", "location": pickup_coords, "duration": round(event.hours, 2), "reason": segment["reason"]}
+        elif event.kind == "dropoff":
+            segment["reason"] = f"Unloading at {dropoff_loc}"
+            stop = {"type": "dropoff", "location": dropoff_coords, "duration": round(event.hours, 2), "reason": segment["reason"]}
+        elif event.kind == "break":
+            segment["reason"] = "30-min break"
+        elif event.kind == "fuel":
+            segment["reason"] = "Fuel stop"
+            stop = _route_stop("fuel", event, index, facilities, "Fuel stop")
+        elif event.kind == "rest":
+            segment["reason"] = "10-hour reset"
+            stop = _route_stop("rest", event, index, facilities, "Daily reset")
+        elif event.kind == "restart":
+            segment["reason"] = "34-hour restart"
+            stop = _route_stop("restart", event, index, facilities, "70-hour restart")
+        yield segment, stop
+
+
+def events_to_timeline(events, start_time, index, pickup_coords, dropoff_coords, pickup_loc, dropoff_loc, facilities=None):
+    """Turn engine DutyEvents into timeline segments and route stops."""
+    timeline = []
+    stops = []
+    for segment, stop in iter_timeline(events, start_time, index, pickup_coords, dropoff_coords, pickup_loc, dropoff_loc, facilities):
+        timeline.append(segment)
+        if stop is not None:
+            stops.append(stop)
+    return timeline, stops
+
+
+def build_timeline(start_time, route_data, current_cycle, pickup_coords, dropoff_coords, current_loc, pickup_loc, dropoff_loc, index=None, schedule=None):
+    """Simulate HOS-compliant timeline for the route.
+
+    The rules live in trips.hos; this turns its events into timeline
+    segments and stops. Stops are placed with a RouteIndex (pass ``index``
+    to reuse one already built for this route, and ``schedule`` likewise)
+    and, when TRUCK_STOPS has a dataset, at truck stops (see
+    simulate_route).
+    """
+    total_distance_miles = route_data["routes"][0]["distance"] / 1609.34
+    total_driving_hours = route_data["routes"][0]["duration"] / 3600
+    points = [[lat, lon] for lon, lat in route_data["routes"][0]["geometry"]["coordinates"]]
+    if index is None:
+        index = RouteIndex.from_route(route_data)
+
+    events, final, facilities = simulate_route(index, total_driving_hours, hos.HOSState(cycle_used=current_cycle), schedule=schedule)
+    timeline, stops = events_to_timeline(events, start_time, index, pickup_coords, dropoff_coords, pickup_loc, dropoff_loc, facilities)
+    current_time = start_time + timedelta(hours=final.clock)
+
+    return timeline, stops, total_distance_miles, total_driving_hours, current_time, points
+
+
+def _day_log(i, log_date, entries, current_loc, pickup_loc, dropoff_loc):
+    slots = dutygrid.to_slots(dutygrid.minute_codes(dutygrid.segment_spans(log_date, entries)))
+    blocks = [{
+        "start": seg["start"].strftime("%H:%M"),
+        "end": seg["end"].strftime("%H:%M"),
+        "status": seg["status"],
+        "reason": seg.get("reason", "")
+    } for seg in entries]
+    return {
+        "day": i,
+        "date": str(log_date),
+        "timeBlocks": blocks,
+        "grid": dutygrid.encode(slots),
+        "totals": dutygrid.segment_totals(entries),
+        "remarks": f"Trip Day {i}: {current_loc} → {pickup_loc} → {dropoff_loc}"
+    }
+
+
+def iter_logs(timeline, current_loc, pickup_loc, dropoff_loc, first_day=1):
+    """Yield per-day logs from chronological timeline segments.
+
+    Segments are clipped at midnight, so each day's log holds exactly that
+    day's part of them (see trips.dutygrid for its "grid"). A day's log is
+    yielded as soon as the first segment of a later day arrives, so
+    ``timeline`` can be a generator. Logs are numbered from ``first_day``.
+    """
+    i, log_date, entries = first_day - 1, None, []
+    for entry in timeline:
+        for piece in dutygrid.clip(entry):
+            d = piece["start"].date()
+            if entries and d != log_date:
+                i += 1
+                yield _day_log(i, log_date, entries, current_loc, pickup_loc, dropoff_loc)
+                entries = []
+            log_date = d
+            entries.append(piece)
+    if entries:
+        yield _day_log(i + 1, log_date, entries, current_loc, pickup_loc, dropoff_loc)
+
+
+def split_into_logs(timeline, current_loc, pickup_loc, dropoff_loc):
+    """Split timeline into per-day logs."""
+    return list(iter_logs(sorted(timeline, key=lambda entry: entry["start"]), current_loc, pickup_loc, dropoff_loc))
+
+
+def build_summary(total_distance_miles, total_driving_hours, current_time):
+    """Build overall trip summary."""
+    return {
+        "total_distance_miles": round(total_distance_miles, 1),
+        "total_driving_hours": round(total_driving_hours, 1),
+        "total_trip_hours": round(total_driving_hours + 2, 1),  # +2 for pickup/dropoff
+        "estimated_arrival": current_time.isoformat()
+    }
+
+
+# ------------------ PIPELINE ------------------
+
+DEFAULT_START_TIME = datetime(2025, 9, 27, 22, 54)  # 10:54 PM WAT
+
+
+def parse_plan_request(data):
+    """Pull the planning inputs out of a plan-trip payload."""
+    start_date = data.get("start_date")
+    return {
+        "current_loc": data.get("current_location", {}).get("address"),
+        "pickup_loc": data.get("pickup_location", {}).get("address"),
+        "dropoff_loc": data.get("dropoff_location", {}).get("address"),
+        "current_cycle": float(data.get("current_cycle_used", 0)),
+        "start_time": datetime.fromisoformat(start_date) if start_date else DEFAULT_START_TIME,
+        # Use provided coordinates directly
+        "current_coords": [data["current_location"]["lat"], data["current_location"]["lng"]],
+        "pickup_coords": [data["pickup_location"]["lat"], data["pickup_location"]["lng"]],
+        "dropoff_coords": [data["dropoff_location"]["lat"], data["dropoff_location"]["lng"]],
+        "driver_name": data.get("driver_name"),
+        "co_driver_name": data.get("co_driver_name"),
+        "truck_number": data.get("truck_number"),
+        "trailer_number": data.get("trailer_number"),
+        "geometry": parse_geometry_options(data.get("geometry")),
+    }
+
+
+def waypoints(plan):
+    return [plan["current_coords"], plan["pickup_coords"], plan["dropoff_coords"]]
+
+
+def build_plan(plan, route_data):
+    """Run the timeline, log and summary stages and return the response payload.
+
+    The payload also carries the plan's checkpoint, which is saved with it
+    and dropped from the response by finalize_response.
+    """
+    # Timeline
+    with span("build_timeline"):
+        index = RouteIndex.from_route(route_data)
+        schedule = route_schedule(index)
+        timeline, stops, total_distance, total_driving, end_time, points = build_timeline(
+            plan["start_time"], route_data, plan["current_cycle"], plan["pickup_coords"], plan["dropoff_coords"],
+            plan["current_loc"], plan["pickup_loc"], plan["dropoff_loc"], index=index, schedule=schedule
+        )
+    route_points.observe(len(points))
+
+    # Logs
+    with span("split_into_logs"):
+        logs = split_into_logs(timeline, plan["current_loc"], plan["pickup_loc"], plan["dropoff_loc"])
+
+    # Summary
+    summary = build_summary(total_distance, total_driving, end_time)
+
+    return {
+        "route": {"points": points, "stops": stops},
+        "timeline": [timeline_entry(seg) for seg in timeline],
+        "logs": logs,
+        "summary": summary,
+        "checkpoint": make_checkpoint(
+            plan["start_time"], hos.HOSState(cycle_used=plan["current_cycle"]), total_driving, schedule, plan_places(plan)
+        ),
+    }
+
+
+def timeline_entry(seg):
+    """Response form of a timeline segment."""
+    return {
+        "day": seg["day"],
+        "start": seg["start"].strftime("%H:%M"),
+        "end": seg["end"].strftime("%H:%M"),
+        "status": seg["status"],
+        "reason": seg.get("reason", "")
+    }
+
+
+def iter_plan(plan, route_data, chunk_size=1000):
+    """build_plan + save_plan as a stream of (kind, payload) records.
+
+    The summary comes first (the engine's event list is small and cheap),
+    then timeline segments and stops as they are produced, each day's log
+    once the next day starts, then the route geometry in chunks and
+    finally the saved trip id.
+    """
+    index = RouteIndex.from_route(route_data)
+    total_distance = route_data["routes"][0]["distance"] / 1609.34
+    total_driving = route_data["routes"][0]["duration"] / 3600
+    schedule = route_schedule(index)
+    initial = hos.HOSState(cycle_used=plan["current_cycle"])
+    events, final, facilities = simulate_route(index, total_driving, initial, schedule=schedule)
+    summary = build_summary(total_distance, total_driving, plan["start_time"] + timedelta(hours=final.clock))
+    yield "summary", summary
+
+    timeline, stops, pending = [], [], []
+
+    def segments():
+        for segment, stop in iter_timeline(
+            events, plan["start_time"], index, plan["pickup_coords"], plan["dropoff_coords"], plan["pickup_loc"], plan["dropoff_loc"],
+            facilities,
+        ):
+            timeline.append(timeline_entry(segment))
+            pending.append(("segment", timeline[-1]))
+            if stop is not None:
+                stops.append(stop)
+                pending.append(("stop", stop))
+            yield segment
+
+    logs = []
+    for log in iter_logs(segments(), plan["current_loc"], plan["pickup_loc"], plan["dropoff_loc"]):
+        yield from pending
+        pending.clear()
+        logs.append(log)
+        yield "log", log
+    yield from pending
+
+    for chunk in iter_shaped_route(index.points, plan["geometry"], chunk_size):
+        yield "geometry", chunk
+
+    checkpoint = make_checkpoint(plan["start_time"], initial, total_driving, schedule, plan_places(plan))
+    trip = save_plan(plan, {
+        "route": {"points": index.points, "stops": stops}, "timeline": timeline, "logs": logs, "summary": summary, "checkpoint": checkpoint,
+    })
+    yield "trip", {"trip_id": trip.id}
+
+
+STORED_POLYLINE_PRECISION = 6
+
+
+def pack_geometry(points):
+    """[lat, lon] points as the bytes stored in TripPlan.geometry."""
+    return encode_polyline(points, STORED_POLYLINE_PRECISION).encode("ascii")
+
+
+def storable_plan_data(response_data):
+    """Copy of the response without the route points (they go to TripPlan.geometry)."""
+    stored = dict(response_data)
+    stored["route"] = {"stops": response_data["route"]["stops"]}
+    return stored
+
+
+def stored_points(trip):
+    """Full-resolution [lat, lon] points of a saved trip.
+
+    Rows saved before the geometry column kept a polyline or raw points in
+    plan_data.
+    """
+    if trip.geometry:
+        return decode_polyline(bytes(trip.geometry).decode("ascii"), STORED_POLYLINE_PRECISION)
+    route = (trip.plan_data or {}).get("route", {})
+    if "polyline" in route:
+        return decode_polyline(route["polyline"], route.get("precision", STORED_POLYLINE_PRECISION))
+    return route.get("points", [])
+
+
+def trip_plan_fields(plan):
+    """TripPlan column values for a parsed plan request."""
+    return {
+        "driver_name": plan["driver_name"],
+        "co_driver_name": plan["co_driver_name"],
+        "truck_number": plan["truck_number"],
+        "trailer_number": plan["trailer_number"],
+        "start_date": plan["start_time"],
+        "current_cycle_used": plan["current_cycle"],
+    }
+
+
+def storable_trip(plan, response_data):
+    """Unsaved TripPlan for a built plan (see records.save_trips)."""
+    return TripPlan(
+        **trip_plan_fields(plan),
+        plan_data=storable_plan_data(response_data),
+        geometry=pack_geometry(response_data["route"]["points"]),
+    )
+
+
+def save_plan(plan, response_data):
+    """Save the plan's TripPlan, or queue it when write-behind is on (the id is set either way)."""
+    with span("save_plan"):
+        trip = storable_trip(plan, response_data)
+        if writebehind.enabled():
+            return writebehind.submit(trip)
+        return save_trips([trip])[0]
+
+
+def finalize_response(plan, response_data, trip):
+    """Shape the route geometry as the client asked, drop the stored-only checkpoint and attach the saved trip id."""
+    with span("shape_route"):
+        response_data["route"] = shape_route(response_data["route"], plan["geometry"])
+    response_data.pop("checkpoint", None)
+    response_data["trip_id"] = trip.id
+    return response_data
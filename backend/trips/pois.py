@@ -0,0 +1,172 @@
+"""Truck stops for placing rest and fuel stops.
+
+TRUCK_STOPS["PATH"] (a CSV or Parquet file) is loaded once into a KD-tree
+over unit-sphere coordinates, where a chord-length radius is an exact
+great-circle one. For a route, the tree is queried in bulk for the
+facilities within MAX_DETOUR_MILES of samples taken every SAMPLE_MILES
+along it; each gets the driving-hour offset of its closest sample, and
+hos.iter_events ends drives at those offsets (see planning.simulate_route).
+"""
+import csv
+import itertools
+import threading
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .metrics import span
+from .route_index import EARTH_RADIUS_MILES
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # optional: without scipy, stops stay where the HOS limits fall
+    cKDTree = None
+
+SAMPLE_MILES = 0.5
+TRUTHY = {"1", "true", "t", "yes", "y"}
+
+
+def _xyz(points):
+    lat, lon = np.radians(points[:, 0]), np.radians(points[:, 1])
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def _chord(miles):
+    return 2 * np.sin(np.asarray(miles) / EARTH_RADIUS_MILES / 2)
+
+
+def _miles(chord):
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def _flag(value):
+    """Dataset yes/no column (missing or empty means yes)."""
+    if value is None or value == "":
+        return True
+    if isinstance(value, str):
+        return value.strip().lower() in TRUTHY
+    return bool(value)
+
+
+def _read_rows(path):
+    path = Path(path)
+    if path.suffix.lower() in (".parquet", ".pq"):
+        import pyarrow.parquet as pq  # only needed for Parquet datasets
+
+        return pq.read_table(path).to_pylist()
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+class TruckStops:
+    """Truck-stop facilities with a KD-tree over their positions.
+
+    ``parking`` and ``diesel`` flag the facilities fit for rests/restarts
+    and for fuel stops.
+    """
+
+    def __init__(self, names, points, parking=None, diesel=None):
+        self.names = list(names)
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.parking = np.ones(len(self.points), dtype=bool) if parking is None else np.asarray(parking, dtype=bool)
+        self.diesel = np.ones(len(self.points), dtype=bool) if diesel is None else np.asarray(diesel, dtype=bool)
+        self.tree = cKDTree(_xyz(self.points)) if len(self.points) else None
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a CSV/Parquet dataset with name, lat, lon and optional parking, diesel columns."""
+        rows = _read_rows(path)
+        return cls(
+            [str(row.get("name") or "Truck stop") for row in rows],
+            [[float(row["lat"]), float(row["lon"])] for row in rows],
+            [_flag(row.get("parking")) for row in rows],
+            [_flag(row.get("diesel")) for row in rows],
+        )
+
+    def __len__(self):
+        return len(self.points)
+
+    def along(self, index, max_detour_miles):
+        """RouteStops for the facilities within ``max_detour_miles`` of a RouteIndex's route."""
+        if self.tree is None:
+            return RouteStops(self, np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))
+        miles = np.append(np.arange(0.0, index.total_miles, SAMPLE_MILES), index.total_miles)
+        samples = _xyz(np.column_stack([np.interp(miles, index.cum_miles, index.points[:, i]) for i in (0, 1)]))
+        # Every facility within reach of every sample, so stops sharing an interchange are all kept;
+        # a facility's closest sample gives its place on the route
+        hits = self.tree.query_ball_point(samples, _chord(max_detour_miles + SAMPLE_MILES / 2), return_sorted=False)
+        sample = np.repeat(np.arange(len(samples)), [len(h) for h in hits])
+        rows = np.fromiter(itertools.chain.from_iterable(hits), dtype=np.int64, count=len(sample))
+        chord = np.linalg.norm(samples[sample] - self.tree.data[rows], axis=1)
+        found = np.lexsort((chord, rows))
+        found = found[np.unique(rows[found], return_index=True)[1]]
+        found = found[np.lexsort((rows[found], sample[found]))]
+        return RouteStops(self, rows[found], index.hours_at_miles(miles[sample[found]]), _miles(chord[found]))
+
+
+class RouteStops:
+    """Truck stops along one route, in driving order."""
+
+    def __init__(self, stops, rows, hours, detour_miles):
+        self.stops, self.rows, self.hours, self.detour_miles = stops, rows, hours, detour_miles
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _fit(self, kind):
+        return (self.stops.diesel if kind == "fuel" else self.stops.parking)[self.rows]
+
+    def offsets(self):
+        """hos.iter_events ``stops_at``: driving-hour offsets of the stops fit for rests and for fuel."""
+        return {kind: self.hours[self._fit(kind)].tolist() for kind in ("rest", "fuel")}
+
+    def at(self, hours, kind):
+        """The stop fit for ``kind`` reached after ``hours`` of driving, as a dict, or None."""
+        i = np.searchsorted(self.hours, hours - 1e-6)
+        fit = self._fit(kind)
+        while i < len(self.rows) and self.hours[i] <= hours + 1e-6:
+            if fit[i]:
+                row = self.rows[i]
+                return {
+                    "name": self.stops.names[row],
+                    "location": self.stops.points[row].tolist(),
+                    "detour_miles": round(float(self.detour_miles[i]), 2),
+                }
+            i += 1
+        return None
+
+
+_stops = None
+_loaded = False
+_lock = threading.Lock()
+
+
+def truck_stops():
+    """The TRUCK_STOPS["PATH"] dataset, loaded once; None when unset or scipy is missing."""
+    global _stops, _loaded
+    if not _loaded:
+        with _lock:
+            if not _loaded:
+                path = getattr(settings, "TRUCK_STOPS", {}).get("PATH")
+                _stops = TruckStops.from_file(path) if path and cKDTree is not None else None
+                _loaded = True
+    return _stops
+
+
+@receiver(setting_changed)
+def _settings_changed(setting, **kwargs):
+    global _stops, _loaded
+    if setting == "TRUCK_STOPS":
+        _stops, _loaded = None, False
+
+
+def along(index):
+    """RouteStops for a RouteIndex from the configured dataset, or None without one."""
+    stops = truck_stops()
+    if stops is None:
+        return None
+    with span("truck_stops"):
+        return stops.along(index, settings.TRUCK_STOPS.get("MAX_DETOUR_MILES", 1.0))
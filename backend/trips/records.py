@@ -0,0 +1,144 @@
+"""Normalized rows (days, duty segments, stops) for saved trip plans.
+
+The rows are derived from the stored plan_data alone (daily logs, stops
+and summary), so the same code writes new plans and rewrites re-planned ones.
+"""
+from datetime import datetime, time, timezone
+
+from django.db import transaction
+
+from . import rollups
+from .dutygrid import log_slots
+from .models import DutySegment, TripDay, TripPlan, TripStop
+from .spatial import save_cells
+
+# Stop type -> prefix of the reason on its timeline segment
+STOP_SEGMENTS = {
+    "pickup": "Loading at ",
+    "dropoff": "Unloading at ",
+    "fuel": "Fuel stop",
+    "rest": "10-hour reset",
+    "restart": "34-hour restart",
+}
+
+
+def _aware(value):
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def plan_rows(plan_data):
+    """Days, segments and stops of a stored plan as lists of field dicts.
+
+    Log blocks only carry HH:MM, but they are contiguous: each segment ends
+    where the next starts and the last ends at the estimated arrival.
+    Day dicts carry the log's slot grid as bytes (see trips.dutygrid) and
+    segment dicts the day number; stops get the start of their segment as
+    the arrival time (the first piece of one clipped at midnight).
+    """
+    plan_data = plan_data or {}
+    days, segments = [], []
+    for log in plan_data.get("logs", []):
+        log_date = datetime.fromisoformat(log["date"]).date()
+        totals = log.get("totals", {})
+        days.append({
+            "day": log["day"],
+            "date": log_date,
+            "driving_hours": totals.get("driving", 0),
+            "on_duty_hours": totals.get("on_duty", 0),
+            "off_duty_hours": totals.get("off_duty", 0),
+            "sleeper_hours": totals.get("sleeper", 0),
+            "remarks": log.get("remarks", ""),
+            "grid": log_slots(log).tobytes(),
+        })
+        for block in log.get("timeBlocks", []):
+            start = datetime.combine(log_date, time.fromisoformat(block["start"]), tzinfo=timezone.utc)
+            segments.append({"day": log["day"], "start": start, "status": block["status"], "reason": block.get("reason", "")})
+
+    arrival = plan_data.get("summary", {}).get("estimated_arrival")
+    for seq, segment in enumerate(segments):
+        segment["seq"] = seq
+        if seq + 1 < len(segments):
+            segment["end"] = segments[seq + 1]["start"]
+        else:
+            segment["end"] = _aware(datetime.fromisoformat(arrival)) if arrival else segment["start"]
+
+    stops = []
+    pending = (s for i, s in enumerate(segments) if not (i and continues(segments[i - 1], s)))
+    for seq, stop in enumerate(plan_data.get("route", {}).get("stops", [])):
+        prefix = STOP_SEGMENTS.get(stop["type"])
+        arrival_at = None
+        if prefix is not None:
+            for segment in pending:
+                if segment["reason"].startswith(prefix):
+                    arrival_at = segment["start"]
+                    break
+        lat, lng = stop["location"]
+        stops.append({
+            "seq": seq,
+            "type": stop["type"],
+            "lat": lat,
+            "lng": lng,
+            "arrival": arrival_at,
+            "duration_hours": stop.get("duration", 0),
+            "reason": stop.get("reason", ""),
+        })
+    return days, segments, stops
+
+
+def continues(previous, segment):
+    """Whether ``segment`` is the part after midnight of the same duty period as ``previous``."""
+    start = segment["start"]
+    return (
+        start.hour == start.minute == 0 and previous["start"] < start
+        and (previous["status"], previous["reason"]) == (segment["status"], segment["reason"])
+    )
+
+
+def save_rows(trips):
+    """Insert the child rows of already-saved trips (three bulk inserts in total).
+
+    Returns each trip's plan_rows, in order.
+    """
+    rows, day_rows, segment_rows, stop_rows = [], [], [], []
+    for trip in trips:
+        days, segments, stops = plan_rows(trip.plan_data)
+        rows.append((days, segments, stops))
+        day_rows.extend(TripDay(trip_id=trip.id, **day) for day in days)
+        segment_rows.append((trip.id, segments))
+        stop_rows.extend(TripStop(trip_id=trip.id, **stop) for stop in stops)
+
+    saved_days = {(d.trip_id, d.day): d for d in TripDay.objects.bulk_create(day_rows)}
+    DutySegment.objects.bulk_create([
+        DutySegment(trip_id=trip_id, day=saved_days[(trip_id, s["day"])], **{k: v for k, v in s.items() if k != "day"})
+        for trip_id, segments in segment_rows for s in segments
+    ])
+    TripStop.objects.bulk_create(stop_rows)
+    return rows
+
+
+def replace_rows(trip, first_day, first_stop):
+    """Rewrite a re-planned trip's rows from log day ``first_day`` and stop ``first_stop`` on.
+
+    Earlier days, their segments and earlier stops are left as they are.
+    """
+    days, segments, stops = plan_rows(trip.plan_data)
+    TripDay.objects.filter(trip_id=trip.id, day__gte=first_day).delete()  # segments go with their day
+    TripStop.objects.filter(trip_id=trip.id, seq__gte=first_stop).delete()
+    saved_days = {d.day: d for d in TripDay.objects.bulk_create(
+        [TripDay(trip_id=trip.id, **day) for day in days if day["day"] >= first_day]
+    )}
+    DutySegment.objects.bulk_create([
+        DutySegment(trip_id=trip.id, day=saved_days[s["day"]], **{k: v for k, v in s.items() if k != "day"})
+        for s in segments if s["day"] >= first_day
+    ])
+    TripStop.objects.bulk_create([TripStop(trip_id=trip.id, **stop) for stop in stops[first_stop:]])
+
+
+def save_trips(trips):
+    """bulk_create TripPlans, their normalized rows, spatial index cells and rollups in one transaction."""
+    with transaction.atomic():
+        trips = TripPlan.objects.bulk_create(trips)
+        rows = save_rows(trips)
+        save_cells(trips)
+        rollups.add(trips, rows)
+    return trips
@@ -0,0 +1,56 @@
+import json
+
+from rest_framework.utils import encoders
+from rest_framework.renderers import JSONRenderer
+
+from .metrics import span
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to DRF's stdlib encoder
+    orjson = None
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer reporting its time as the "serialize" stage."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with span("serialize"):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+_fallback = encoders.JSONEncoder().default
+_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z if orjson is not None else 0
+
+
+def dumps(data):
+    """Compact UTF-8 JSON bytes, for responses built outside DRF."""
+    if orjson is not None:
+        return orjson.dumps(data, default=_fallback, option=_OPTIONS)
+    return json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONRenderer(TimedJSONRenderer):
+    """orjson-backed JSONRenderer (the stdlib path when orjson is missing).
+
+    datetimes, UUIDs and NumPy arrays/scalars are encoded natively;
+    anything else (Decimal, lazy strings, querysets...) goes through DRF's
+    encoder. Output matches JSONRenderer's compact form, apart from
+    datetimes keeping their microseconds.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b""
+
+        options = _OPTIONS
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        with span("serialize"):
+            ret = orjson.dumps(data, default=_fallback, option=options)
+            # Same as JSONRenderer: keep the output valid JavaScript
+            if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+                ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+            return ret
@@ -0,0 +1,287 @@
+"""Re-planning a saved trip from a mid-trip checkpoint.
+
+Every plan keeps a checkpoint (planning.make_checkpoint): the HOS state at
+a point in time plus the remaining driving hours, fuel markers and truck
+stops in one driving-hour frame. A re-plan rolls that state forward to the
+report time with hos.state_at (or takes the duty state the driver
+reports), finds the driver on the stored route and simulates only what is
+left:
+
+- within REPLAN["REJOIN_MILES"] of the stored route, the rest of it is
+  reused with no routing call;
+- off it, only position -> remaining waypoints is routed (legs are cached
+  on their own, so pickup -> dropoff usually is a cache hit) and the
+  stored geometry becomes the driven part plus the new route.
+
+Logs of the days before the report stay as they are; the day in progress
+and later days are rebuilt, and only their rows are rewritten.
+
+Plan times are wall-clock times in the frame of the start_date the trip
+was planned with: local to the client when it had no UTC offset (as the
+frontend sends it), in its offset otherwise. Report times are read in the
+same frame (see _report_time), never assumed to be UTC.
+"""
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone as django_timezone
+
+from . import hos, pois, rollups, routing, spatial
+from .metrics import span
+from .models import TripPlan
+from .planning import (
+    build_summary, events_to_timeline, fuel_markers, iter_logs, make_checkpoint, pack_geometry, simulate_route, timeline_entry,
+)
+from .records import STOP_SEGMENTS, continues, plan_rows, replace_rows
+from .route_index import EARTH_RADIUS_MILES, RouteIndex
+
+
+class ReplanConflict(Exception):
+    """The trip changed while the re-plan was computed."""
+
+
+def _wall(value):
+    """``value`` on the plan's wall clock, naive (stored rows tag plan-local times as UTC)."""
+    return value.replace(tzinfo=None)
+
+
+def _report_time(report, zone):
+    """The report time on the plan's wall clock.
+
+    A time without an offset is plan-local, like plan_trip's start_date.
+    One with an offset, or the current time when none is sent, can only be
+    placed on a plan whose start_date had an offset (``zone``).
+    """
+    if report is None or report.tzinfo is not None:
+        if zone is None:
+            raise ValueError("time is required, without a UTC offset, for trips planned in local time")
+        report = (report or django_timezone.now()).astimezone(zone)
+    return _wall(report)
+
+
+def parse_replan_request(data):
+    """Pull the re-planning inputs out of a replan payload.
+
+    ``duty`` (optional) is the driver's reported duty state: driving_today,
+    since_break, cycle_used and window_hours (hours since the 14 h window
+    opened; null when off duty). Without it the planned state is used.
+    ``time`` defaults to now; see _report_time for how it is read.
+    """
+    position = data.get("position") or {}
+    report = data.get("time")
+    duty = data.get("duty")
+    if duty is not None and not isinstance(duty, dict):
+        raise ValueError("duty must be an object")
+    picked_up = data.get("picked_up")
+    return {
+        "position": [float(position["lat"]), float(position["lng"])],
+        "time": datetime.fromisoformat(report) if report else None,
+        "duty": duty,
+        "picked_up": None if picked_up is None else bool(picked_up),
+    }
+
+
+def _miles_from(point, points):
+    """Great-circle miles from ``point`` to each row of ``points``."""
+    lat, lon = np.radians(points[:, 0]), np.radians(points[:, 1])
+    lat0, lon0 = np.radians(point[0]), np.radians(point[1])
+    h = np.sin((lat - lat0) / 2) ** 2 + np.cos(lat0) * np.cos(lat) * np.sin((lon - lon0) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def _legacy_places(plan_data):
+    """checkpoint["places"] recovered from the stops and log remarks of plans saved without one."""
+    places = {"current": None, "pickup": None, "dropoff": None, "pickup_coords": None, "dropoff_coords": None}
+    for stop in plan_data.get("route", {}).get("stops", []):
+        if stop["type"] in ("pickup", "dropoff"):
+            places[stop["type"]] = stop.get("reason", "").removeprefix(STOP_SEGMENTS[stop["type"]])
+            places[stop["type"] + "_coords"] = stop["location"]
+    logs = plan_data.get("logs") or [{}]
+    route = logs[0].get("remarks", "").partition(": ")[2].split(" → ")
+    if len(route) == 3:
+        places["current"] = route[0]
+    return places
+
+
+def _legacy_checkpoint(trip, points, segments):
+    """Checkpoint of a plan saved before plans kept one: the trip start, with uniform speed along the route."""
+    plan_data = trip.plan_data or {}
+    start = _wall(segments[0]["start"]) if segments else datetime.combine(trip.start_date, time())
+    drive_hours = plan_data.get("summary", {}).get("total_driving_hours", 0.0)
+    index = RouteIndex(points, leg_hours=[drive_hours])
+    return make_checkpoint(
+        start, hos.HOSState(cycle_used=trip.current_cycle_used), drive_hours, (fuel_markers(index), None),
+        _legacy_places(plan_data),
+    )
+
+
+def _reported_state(planned, duty, clock):
+    """``planned`` with the driver's reported duty hours, as of ``clock``."""
+    state = hos.HOSState.from_dict({**planned.to_dict(), "clock": clock})
+    for field in ("driving_today", "since_break", "cycle_used"):
+        if duty.get(field) is not None:
+            setattr(state, field, float(duty[field]))
+    if "window_hours" in duty:
+        state.window_start = None if duty["window_hours"] is None else clock - float(duty["window_hours"])
+    state.stop_early = None
+    return state
+
+
+def _rebased(state):
+    """``state`` with the clock, driving and fuel counters restarted at zero for a new frame."""
+    window_start = state.window_start - state.clock if state.window_start is not None else None
+    return hos.HOSState.from_dict({**state.to_dict(), "clock": 0.0, "driven": 0.0, "fuel_done": 0, "window_start": window_start})
+
+
+def replan(trip, request):
+    """Re-plan a saved trip from a report (see parse_replan_request).
+
+    Returns (response payload, changes): the payload carries the rebuilt
+    days only; ``changes`` is what save_replan writes.
+    """
+    plan_data = trip.plan_data or {}
+    points = spatial.trip_points(trip)
+    if len(points) == 0:
+        raise ValueError("Trip has no stored route")
+    _, segments, stops = plan_rows(plan_data)
+    checkpoint = plan_data.get("checkpoint") or _legacy_checkpoint(trip, points, segments)
+    places = checkpoint["places"]
+    stop_window = settings.TRUCK_STOPS.get("WINDOW_HOURS", 1.0)
+
+    # Duty state at the report, rolled forward from the checkpoint
+    with span("replan_state"):
+        checkpoint_time = datetime.fromisoformat(checkpoint["time"])
+        zone, checkpoint_time = checkpoint_time.tzinfo, _wall(checkpoint_time)
+        saved_state = hos.HOSState.from_dict(checkpoint["state"])
+        elapsed = (_report_time(request["time"], zone) - checkpoint_time).total_seconds() / 3600 - saved_state.clock
+        if elapsed < 0:
+            raise ValueError("time is before the trip's last checkpoint")
+        state, pickup = hos.state_at(
+            elapsed, checkpoint["drive_hours"], saved_state, checkpoint["fuel_at"],
+            pickup=checkpoint["pickup"], stops_at=checkpoint["stops_at"], stop_window=stop_window,
+        )
+        if request["duty"]:
+            state = _reported_state(state, request["duty"], saved_state.clock + elapsed)
+        if request["picked_up"] is not None:
+            pickup = not request["picked_up"]
+        resume = checkpoint_time + timedelta(hours=state.clock)
+        state = _rebased(state)
+
+    # Remaining route: the rest of the stored one, or a fresh leg from the driver's position
+    with span("replan_route"):
+        route = RouteIndex(points)
+        # Stored geometry miles -> the plan's road miles
+        scale = plan_data.get("summary", {}).get("total_distance_miles", route.total_miles) / route.total_miles if route.total_miles > 0 else 1.0
+        first = max(0, int(np.searchsorted(route.cum_miles, checkpoint["route_miles"])) - 1)
+        distances = _miles_from(request["position"], points[first:])
+        nearest = first + int(distances.argmin())
+        left_before = route.total_miles - checkpoint["route_miles"]
+        rerouted = float(distances.min()) > settings.REPLAN.get("REJOIN_MILES", 2.0)
+        if not rerouted:
+            route_miles = float(route.cum_miles[nearest])
+            left = route.total_miles - route_miles
+            drive_hours = checkpoint["drive_hours"] * left / left_before if left_before > 0 else 0.0
+            index = RouteIndex(points[nearest:], leg_hours=[drive_hours])
+            geometry = None
+            # Fuel markers still ahead, moved into the new frame
+            done = checkpoint["drive_hours"] - drive_hours
+            fuel_at = [hours - done for hours in checkpoint["fuel_at"] if hours - done > hos.EPS]
+        else:
+            waypoints = [request["position"], *([places["pickup_coords"]] if pickup else []), places["dropoff_coords"]]
+            route_data = routing.fetch_route(waypoints)
+            index = RouteIndex.from_route(route_data)
+            drive_hours = route_data["routes"][0]["duration"] / 3600
+            route_miles = float(route.cum_miles[nearest] + _miles_from(points[nearest], index.points[:1])[0])
+            geometry = np.vstack([points[:nearest + 1], index.points])
+            fuel_at = fuel_markers(index, scale * route_miles)
+
+    # Simulate what is left
+    with span("build_timeline"):
+        schedule = fuel_at, pois.along(index)
+        events, final, facilities = simulate_route(index, drive_hours, state, pickup=pickup, schedule=schedule)
+        new_segments, new_stops = events_to_timeline(
+            events, resume, index, places["pickup_coords"], places["dropoff_coords"], places["pickup"], places["dropoff"], facilities
+        )
+
+    # Keep what happened before the report; rebuild the day in progress and later days
+    with span("split_into_logs"):
+        kept, truncated = [], False
+        for segment in segments:
+            start, end = _wall(segment["start"]), _wall(segment["end"])
+            if start >= resume:
+                break
+            truncated = end > resume
+            kept.append({**segment, "start": start, "end": min(end, resume)})
+        # A segment cut short belongs to the log of the day it started
+        affected = kept[-1]["start"].date() if truncated else resume.date()
+        logs = [log for log in plan_data.get("logs", []) if datetime.fromisoformat(log["date"]).date() < affected]
+        first_day = len(logs) + 1
+        new_logs = list(iter_logs(
+            [segment for segment in kept if segment["start"].date() >= affected] + new_segments,
+            places["current"], places["pickup"], places["dropoff"], first_day=first_day,
+        ))
+
+        # Log segments are clipped at midnight; timeline entries are not
+        kept_entries = sum(1 for i, segment in enumerate(kept) if not (i and continues(kept[i - 1], segment)))
+        timeline = [dict(entry) for entry in plan_data.get("timeline", [])[:kept_entries]]
+        if timeline:
+            timeline[-1]["end"] = kept[-1]["end"].strftime("%H:%M")
+        new_timeline = [timeline_entry(segment) for segment in new_segments]
+        kept_stops = 0
+        for stop in stops:
+            if stop["arrival"] is None or _wall(stop["arrival"]) >= resume:
+                break
+            kept_stops += 1
+
+    driven = sum((s["end"] - s["start"]).total_seconds() for s in kept if s["status"] == hos.DRIVING) / 3600
+    summary = build_summary(
+        scale * route_miles + index.total_miles * (1.0 if rerouted else scale),
+        driven + drive_hours,
+        (resume + timedelta(hours=final.clock)).replace(tzinfo=zone),
+    )
+    new_checkpoint = make_checkpoint(resume.replace(tzinfo=zone), state, drive_hours, schedule, places, route_miles, pickup)
+
+    stored = {
+        **plan_data,
+        "route": {"stops": plan_data.get("route", {}).get("stops", [])[:kept_stops] + new_stops},
+        "timeline": timeline + new_timeline,
+        "logs": logs + new_logs,
+        "summary": summary,
+        "checkpoint": new_checkpoint,
+    }
+    response_data = {
+        "trip_id": trip.id,
+        "replanned_from": resume.replace(tzinfo=zone).isoformat(),
+        "rerouted": rerouted,
+        "first_day": first_day,
+        "logs": new_logs,
+        "timeline": new_timeline,
+        "stops": new_stops,
+        "summary": summary,
+    }
+    changes = {"plan_data": stored, "geometry": geometry, "first_day": first_day, "first_stop": kept_stops}
+    return response_data, changes
+
+
+def save_replan(trip, changes):
+    """Write a re-plan: the plan, the rows of the rebuilt days, rollups and, after a re-route, geometry and spatial cells.
+
+    The trip is only updated if nothing else re-planned it since it was
+    read (its updated_at is unchanged); otherwise ReplanConflict.
+    """
+    with span("save_plan"), transaction.atomic():
+        previous_plan_data = trip.plan_data
+        fields = {"plan_data": changes["plan_data"], "updated_at": django_timezone.now()}
+        if changes["geometry"] is not None:
+            fields["geometry"] = pack_geometry(changes["geometry"].tolist())
+        if not TripPlan.objects.filter(id=trip.id, updated_at=trip.updated_at).update(**fields):
+            raise ReplanConflict("Trip was re-planned concurrently; retry")
+        for name, value in fields.items():
+            setattr(trip, name, value)
+        replace_rows(trip, changes["first_day"], changes["first_stop"])
+        rollups.replace(trip, previous_plan_data)
+        if changes["geometry"] is not None:
+            spatial.reindex([trip])
+    return trip
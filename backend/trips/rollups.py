@@ -0,0 +1,210 @@
+"""Fleet HOS rollups: per driver per day (DriverDay) and per truck per week (TruckWeek).
+
+The rows are kept current as plans are written: records.save_trips adds
+each new trip's contribution, replan.save_replan the difference between
+the new plan and the old one, and deleting a TripPlan (one instance or a
+queryset) takes its contribution back out. Contributions go out in one executemany per
+table whose upsert adds to the stored counters, so concurrent writers
+never overwrite each other's totals. Fleet questions then read only the
+rollup rows of the period asked about (driver_report, truck_report),
+however many plans are stored; manage.py rebuild_rollups recomputes them
+from plan_data.
+"""
+from collections import Counter
+from datetime import date, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from . import records
+from .models import DriverDay, TripPlan, TruckWeek
+
+COUNTERS = (
+    "plans", "restart_plans", "trip_days", "driving_hours", "on_duty_hours",
+    "off_duty_hours", "sleeper_hours", "miles", "rests", "restarts",
+)
+DRIVER_KEYS = ("driver_name", "date")
+TRUCK_KEYS = ("truck_number", "week")
+
+
+def week_of(day):
+    """Monday of ``day``'s week."""
+    return day - timedelta(days=day.weekday())
+
+
+def _add(target, key, counters, sign=1):
+    totals = target.setdefault(key, dict.fromkeys(COUNTERS, 0))
+    for name, value in counters.items():
+        totals[name] += sign * value
+
+
+def contributions(trip, plan_data, rows=None, into=None, sign=1):
+    """Add what ``trip`` planned as ``plan_data`` contributes to the rollups to ``into`` (driver deltas, truck deltas).
+
+    ``rows`` is records.plan_rows(plan_data), when already at hand. The
+    plan counts on the date of its first log; miles are spread over the
+    days by driving hours.
+    """
+    by_driver, by_truck = into if into is not None else ({}, {})
+    days, segments, _ = rows or records.plan_rows(plan_data)
+    if not days:
+        return by_driver, by_truck
+
+    stops = Counter()
+    for i, segment in enumerate(segments):
+        if i and records.continues(segments[i - 1], segment):
+            continue
+        for kind in ("rest", "restart"):
+            if segment["reason"].startswith(records.STOP_SEGMENTS[kind]):
+                stops[segment["day"], kind] += 1
+    restart = any(kind == "restart" for _, kind in stops)
+    total_miles = (plan_data or {}).get("summary", {}).get("total_distance_miles", 0)
+    total_driving = sum(day["driving_hours"] for day in days)
+
+    for n, day in enumerate(days):
+        counters = {
+            "plans": int(n == 0),
+            "restart_plans": int(n == 0 and restart),
+            "trip_days": 1,
+            "driving_hours": day["driving_hours"],
+            "on_duty_hours": day["on_duty_hours"],
+            "off_duty_hours": day["off_duty_hours"],
+            "sleeper_hours": day["sleeper_hours"],
+            "miles": total_miles * day["driving_hours"] / total_driving if total_driving else 0.0,
+            "rests": stops[day["day"], "rest"],
+            "restarts": stops[day["day"], "restart"],
+        }
+        _add(by_driver, (trip.driver_name or "", day["date"]), counters, sign)
+        if trip.truck_number:
+            _add(by_truck, (trip.truck_number, week_of(day["date"])), counters, sign)
+    return by_driver, by_truck
+
+
+def _upsert(model, key_fields, deltas):
+    """Add ``deltas`` ({key: counters}) to ``model``'s rows, creating missing ones."""
+    rows = [
+        (*(k.isoformat() if isinstance(k, date) else k for k in key), *(counters[name] for name in COUNTERS))
+        for key, counters in deltas.items() if any(counters.values())
+    ]
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    columns = [qn(name) for name in (*key_fields, *COUNTERS)]
+    updates = ", ".join(f"{qn(name)} = {table}.{qn(name)} + excluded.{qn(name)}" for name in COUNTERS)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON CONFLICT ({', '.join(qn(k) for k in key_fields)}) DO UPDATE SET {updates}",
+            rows,
+        )
+
+
+def apply(deltas):
+    """Write (driver deltas, truck deltas) as built by contributions()."""
+    by_driver, by_truck = deltas
+    _upsert(DriverDay, DRIVER_KEYS, by_driver)
+    _upsert(TruckWeek, TRUCK_KEYS, by_truck)
+
+
+def add(trips, rows):
+    """Roll up newly saved trips; ``rows`` holds their plan_rows, in order."""
+    deltas = ({}, {})
+    for trip, trip_rows in zip(trips, rows):
+        contributions(trip, trip.plan_data, trip_rows, deltas)
+    apply(deltas)
+
+
+def replace(trip, previous_plan_data):
+    """Swap a re-planned trip's old contribution for its current one.
+
+    Days and weeks the trip no longer reaches are deleted once no other trip counts on them.
+    """
+    deltas = contributions(trip, previous_plan_data, sign=-1)
+    contributions(trip, trip.plan_data, into=deltas)
+    apply(deltas)
+    _prune(trip)
+
+
+@receiver(pre_delete, sender=TripPlan)
+def remove(sender, instance, **kwargs):
+    """Take a deleted trip's contribution back out, inside the delete's transaction."""
+    apply(contributions(instance, instance.plan_data, sign=-1))
+    _prune(instance)
+
+
+def _prune(trip):
+    """Delete ``trip``'s driver and truck rows no trip counts on any more."""
+    DriverDay.objects.filter(driver_name=trip.driver_name or "", trip_days__lte=0).delete()
+    if trip.truck_number:
+        TruckWeek.objects.filter(truck_number=trip.truck_number, trip_days__lte=0).delete()
+
+
+def rebuild(chunk=500):
+    """Recompute every rollup row from stored plans. Returns the number of trips read."""
+    ids = list(TripPlan.objects.order_by("id").values_list("id", flat=True))
+    with transaction.atomic():
+        DriverDay.objects.all().delete()
+        TruckWeek.objects.all().delete()
+        for i in range(0, len(ids), chunk):
+            deltas = ({}, {})
+            for trip in TripPlan.objects.filter(id__in=ids[i:i + chunk]).only("id", "driver_name", "truck_number", "plan_data"):
+                contributions(trip, trip.plan_data, into=deltas)
+            apply(deltas)
+    return len(ids)
+
+
+# ------------------ REPORTS ------------------
+
+SUMS = {name: Sum(name) for name in COUNTERS}
+
+
+def _rounded(totals):
+    return {name: round(totals[name] or 0, 2) if name.endswith(("hours", "miles")) else totals[name] or 0 for name in COUNTERS}
+
+
+def _fleet(rows):
+    totals = _rounded(rows.aggregate(**SUMS))
+    count = rows.count()
+    totals["restart_share"] = round(totals["restart_plans"] / totals["plans"], 4) if totals["plans"] else 0.0
+    return totals, count
+
+
+def driver_report(start, end, driver=None):
+    """Per-driver totals and averages over ``start``..``end`` (inclusive) from DriverDay rows."""
+    rows = DriverDay.objects.filter(date__range=(start, end))
+    if driver:
+        rows = rows.filter(driver_name=driver)
+    drivers = []
+    for row in rows.values("driver_name").annotate(days=Count("id"), **SUMS).order_by("driver_name"):
+        totals = _rounded(row)
+        drivers.append({
+            "driver": row["driver_name"],
+            "days": row["days"],
+            **totals,
+            "avg_driving_hours_per_day": round(totals["driving_hours"] / row["days"], 2),
+        })
+    fleet, driver_days = _fleet(rows)
+    fleet["driver_days"] = driver_days
+    fleet["avg_driving_hours_per_driver_day"] = round(fleet["driving_hours"] / driver_days, 2) if driver_days else 0.0
+    return {"from": start.isoformat(), "to": end.isoformat(), "drivers": drivers, "fleet": fleet}
+
+
+def truck_report(start, end, truck=None):
+    """Per-truck weekly rows and totals for the weeks overlapping ``start``..``end`` from TruckWeek rows."""
+    rows = TruckWeek.objects.filter(week__range=(week_of(start), end))
+    if truck:
+        rows = rows.filter(truck_number=truck)
+    weeks = [
+        {"truck": row["truck_number"], "week": row["week"].isoformat(), **_rounded(row)}
+        for row in rows.order_by("truck_number", "week").values("truck_number", "week", *COUNTERS)
+    ]
+    trucks = [
+        {"truck": row["truck_number"], "weeks": row["weeks"], **_rounded(row)}
+        for row in rows.values("truck_number").annotate(weeks=Count("id"), **SUMS).order_by("truck_number")
+    ]
+    fleet, truck_weeks = _fleet(rows)
+    fleet["truck_weeks"] = truck_weeks
+    return {"from": week_of(start).isoformat(), "to": end.isoformat(), "trucks": trucks, "weeks": weeks, "fleet": fleet}
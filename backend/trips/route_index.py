@@ -0,0 +1,86 @@
+"""Cumulative distance/duration index over a route's geometry.
+
+Built once per route; every mile-marker or time-offset lookup afterwards
+is a binary search plus linear interpolation between two vertices.
+"""
+import numpy as np
+
+EARTH_RADIUS_MILES = 3958.8
+METERS_PER_MILE = 1609.34
+
+
+class RouteIndex:
+    """Position lookups along a route by miles driven or driving hours elapsed.
+
+    ``cum_miles`` is the haversine length of the geometry rescaled to the
+    routed distance. ``cum_hours`` spreads each leg's routed duration over
+    that leg in proportion to distance, so slow and fast legs keep their
+    own average speed.
+    """
+
+    def __init__(self, points, total_miles=None, leg_miles=None, leg_hours=None):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(self.points) == 0:
+            raise ValueError("Route has no geometry")
+
+        lat, lon = np.radians(self.points[:, 0]), np.radians(self.points[:, 1])
+        h = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+        segment = 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+        cum = np.concatenate(([0.0], np.cumsum(segment)))
+        geometry_miles = float(cum[-1])
+
+        self.total_miles = float(total_miles) if total_miles is not None else geometry_miles
+        self.cum_miles = cum * (self.total_miles / geometry_miles) if geometry_miles > 0 else cum
+
+        if leg_hours:
+            leg_miles = leg_miles or [self.total_miles / len(leg_hours)] * len(leg_hours)
+            mile_marks = np.concatenate(([0.0], np.cumsum(leg_miles)))
+            hour_marks = np.concatenate(([0.0], np.cumsum(leg_hours)))
+            if mile_marks[-1] > 0:
+                mile_marks *= self.total_miles / mile_marks[-1]
+            self.cum_hours = np.interp(self.cum_miles, mile_marks, hour_marks)
+        else:
+            self.cum_hours = np.zeros_like(self.cum_miles)
+        self.total_hours = float(self.cum_hours[-1])
+
+    @classmethod
+    def from_route(cls, route_data):
+        """Index the first route of an OSRM /route response."""
+        route = route_data["routes"][0]
+        points = np.asarray(route["geometry"]["coordinates"], dtype=np.float64).reshape(-1, 2)[:, ::-1]
+        legs = route.get("legs") or [{"distance": route["distance"], "duration": route["duration"]}]
+        return cls(
+            points,
+            total_miles=route["distance"] / METERS_PER_MILE,
+            leg_miles=[leg["distance"] / METERS_PER_MILE for leg in legs],
+            leg_hours=[leg["duration"] / 3600 for leg in legs],
+        )
+
+    def _interpolate(self, axis, values):
+        """Interpolated vertex positions where ``axis`` (cum_miles/cum_hours) reaches ``values``."""
+        values = np.clip(np.asarray(values, dtype=np.float64), axis[0], axis[-1])
+        hi = np.clip(np.searchsorted(axis, values, side="left"), 1, max(1, len(axis) - 1))
+        if len(axis) == 1:
+            return np.repeat(self.points[:1], values.size, axis=0).reshape(values.shape + (2,))
+        lo = hi - 1
+        span = axis[hi] - axis[lo]
+        t = np.divide(values - axis[lo], span, out=np.zeros_like(values), where=span > 0)
+        return np.round(self.points[lo] + (self.points[hi] - self.points[lo]) * t[..., None], 6)
+
+    def point_at_miles(self, miles):
+        """[lat, lon] at ``miles`` along the route (scalar) or an (n, 2) array (array-like)."""
+        result = self._interpolate(self.cum_miles, miles)
+        return result.tolist() if np.ndim(miles) else [float(result[0]), float(result[1])]
+
+    def point_at_hours(self, hours):
+        """[lat, lon] after ``hours`` of driving."""
+        result = self._interpolate(self.cum_hours, hours)
+        return result.tolist() if np.ndim(hours) else [float(result[0]), float(result[1])]
+
+    def miles_at_hours(self, hours):
+        result = np.interp(hours, self.cum_hours, self.cum_miles)
+        return result if np.ndim(hours) else float(result)
+
+    def hours_at_miles(self, miles):
+        result = np.interp(miles, self.cum_miles, self.cum_hours)
+        return result if np.ndim(miles) else float(result)
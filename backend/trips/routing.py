@@ -0,0 +1,441 @@
+import asyncio
+import re
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .cache import MISS, TieredCache, make_key
+from .upstream import RateLimiter, UpstreamError, build_client
+
+OSRM_PROFILE = "driving"
+OSRM_ROUTE_OPTIONS = {"overview": "full", "geometries": "geojson", "steps": "true"}
+OSRM_TABLE_OPTIONS = {"annotations": "duration,distance"}
+
+osrm_client = build_client("osrm", settings.OSRM_BASE_URL)
+nominatim_client = build_client("nominatim", settings.NOMINATIM_BASE_URL, headers={"User-Agent": "TripPlanner/1.0"})
+
+_route_settings = getattr(settings, "ROUTE_CACHE", {})
+route_cache = TieredCache(
+    "route",
+    ttl=_route_settings.get("TTL", 7 * 24 * 3600),
+    memory_size=_route_settings.get("MEMORY_ENTRIES", 256),
+    max_entries=_route_settings.get("MAX_ENTRIES", 10000),
+)
+
+_table_settings = getattr(settings, "TABLE_CACHE", {})
+table_cache = TieredCache(
+    "table",
+    ttl=_table_settings.get("TTL", 24 * 3600),
+    memory_size=_table_settings.get("MEMORY_ENTRIES", 20000),
+    max_entries=_table_settings.get("MAX_ENTRIES", 200000),
+)
+
+_geocode_settings = getattr(settings, "GEOCODE_CACHE", {})
+geocode_cache = TieredCache(
+    "geocode",
+    ttl=_geocode_settings.get("TTL", 30 * 24 * 3600),
+    memory_size=_geocode_settings.get("MEMORY_ENTRIES", 1024),
+    max_entries=_geocode_settings.get("MAX_ENTRIES", 50000),
+)
+geocode_limiter = RateLimiter(_geocode_settings.get("RATE_LIMIT", 1.0))
+
+
+def normalize_coords(coords: list, precision: int = None):
+    """Round [lat, lon] waypoints so nearby requests share a cache key."""
+    if precision is None:
+        precision = _route_settings.get("PRECISION", 5)
+    return [[round(float(lat), precision), round(float(lon), precision)] for lat, lon in coords]
+
+
+def route_cache_key(coords: list, profile: str = OSRM_PROFILE, options: dict = None):
+    return make_key("leg", profile, options or OSRM_ROUTE_OPTIONS, normalize_coords(coords))
+
+
+def normalize_address(address: str):
+    """Canonical form of a free-text address: case, punctuation and spacing folded."""
+    address = unicodedata.normalize("NFKC", address or "").casefold()
+    return " ".join(re.sub(r"[^\w#/-]+", " ", address).split())
+
+
+def _geocode_params(address):
+    return {"q": address, "format": "json", "limit": 1}
+
+
+def _parse_geocode(resp):
+    """Return (coords or None, cacheable). Only a clean 200 is worth caching."""
+    if resp.status_code == 200 and resp.json():
+        result = resp.json()[0]
+        return [float(result["lat"]), float(result["lon"])], True
+    return None, resp.status_code == 200
+
+
+def _cache_geocode(key, coords, cacheable):
+    if cacheable:
+        geocode_cache.set(key, coords, ttl=None if coords is not None else _geocode_settings.get("NEGATIVE_TTL", 24 * 3600))
+    return coords
+
+
+def request_geocode(address: str):
+    """Ask Nominatim for an address, bypassing the cache but honouring the rate limit."""
+    geocode_limiter.wait()
+    return _parse_geocode(nominatim_client.get("/search", params=_geocode_params(address)))
+
+
+def geocode_address(address: str):
+    """Geocode an address using Nominatim.
+
+    Results are cached on the normalized address; addresses Nominatim cannot
+    resolve are cached as misses for a shorter NEGATIVE_TTL.
+    """
+    key = normalize_address(address)
+    if not key:
+        return None
+    coords = geocode_cache.get(key)
+    if coords is MISS:
+        coords = _cache_geocode(key, *request_geocode(address))
+    return coords
+
+
+async def ageocode_address(address: str):
+    """Non-blocking geocode_address."""
+    key = normalize_address(address)
+    if not key:
+        return None
+    coords = await sync_to_async(geocode_cache.get)(key)
+    if coords is MISS:
+        await geocode_limiter.await_turn()
+        result = _parse_geocode(await nominatim_client.aget("/search", params=_geocode_params(address)))
+        coords = await sync_to_async(_cache_geocode)(key, *result)
+    return coords
+
+
+def geocode_many(addresses: list):
+    """Geocode a batch of addresses, deduplicated on their normalized form.
+
+    Cached addresses are answered immediately; the rest go upstream from a
+    small worker pool, spaced out by the shared rate limiter. Returns
+    (results, stats) with one result per input address, in order.
+    """
+    keys = [normalize_address(address) for address in addresses]
+    unique = {}
+    for key, address in zip(keys, addresses):
+        if key:
+            unique.setdefault(key, address)
+
+    resolved, errors = {}, {}
+    for key in unique:
+        coords = geocode_cache.get(key)
+        if coords is not MISS:
+            resolved[key] = coords
+    missing = [key for key in unique if key not in resolved]
+
+    def lookup(key):
+        try:
+            return key, request_geocode(unique[key]), None
+        except UpstreamError as e:
+            return key, None, str(e)
+
+    if missing:
+        workers = min(len(missing), _geocode_settings.get("BATCH_WORKERS", 4))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for key, result, error in pool.map(lookup, missing):
+                if error:
+                    errors[key] = error
+                else:
+                    resolved[key] = _cache_geocode(key, *result)
+
+    results = []
+    for key, address in zip(keys, addresses):
+        coords = resolved.get(key)
+        entry = {"address": address, "found": coords is not None}
+        if coords is not None:
+            entry["lat"], entry["lng"] = coords
+        if key in errors:
+            entry["error"] = errors[key]
+        results.append(entry)
+    stats = {"requested": len(addresses), "unique": len(unique), "cached": len(unique) - len(missing), "upstream": len(missing)}
+    return results, stats
+
+
+def _route_path(coords, profile):
+    coords_str = ";".join([f"{lon},{lat}" for lat, lon in coords])
+    return f"/route/v1/{profile}/{coords_str}"
+
+
+def _parse_route(resp):
+    if resp.status_code != 200:
+        raise Exception("Route calculation failed")
+    return resp.json()
+
+
+def request_route(coords: list, profile: str = OSRM_PROFILE, options: dict = None):
+    """Ask OSRM for a driving route between waypoints, bypassing the cache."""
+    return _parse_route(osrm_client.get(_route_path(coords, profile), params=options or OSRM_ROUTE_OPTIONS))
+
+
+async def arequest_route(coords: list, profile: str = OSRM_PROFILE, options: dict = None):
+    """Non-blocking request_route."""
+    return _parse_route(await osrm_client.aget(_route_path(coords, profile), params=options or OSRM_ROUTE_OPTIONS))
+
+
+def _leg_from_response(route_data):
+    """Reduce a single-leg OSRM response to what stitching needs."""
+    route = route_data["routes"][0]
+    leg = route["legs"][0] if route.get("legs") else {}
+    return {
+        "distance": route["distance"],
+        "duration": route["duration"],
+        "geometry": route["geometry"],
+        "steps": leg.get("steps", []),
+        "summary": leg.get("summary", ""),
+        "waypoints": route_data.get("waypoints", []),
+    }
+
+
+def fetch_leg(origin, destination, profile: str = OSRM_PROFILE, options: dict = None):
+    """Fetch a single origin→destination leg, cached on its own."""
+    return fetch_legs([origin, destination], profile, options)[0]
+
+
+def _leg_pairs(coords):
+    coords = normalize_coords(coords)
+    pairs = [list(pair) for pair in zip(coords, coords[1:])]
+    if not pairs:
+        raise ValueError("At least two waypoints are required")
+    return pairs
+
+
+def _cached_legs(keys):
+    legs = [route_cache.get(key) for key in keys]
+    return legs, [i for i, leg in enumerate(legs) if leg is MISS]
+
+
+def _store_legs(legs, keys, missing, fetched):
+    for i, route_data in zip(missing, fetched):
+        legs[i] = _leg_from_response(route_data)
+        route_cache.set(keys[i], legs[i])
+    return legs
+
+
+def fetch_legs(coords: list, profile: str = OSRM_PROFILE, options: dict = None):
+    """Return one leg per consecutive waypoint pair, fetching only uncached legs.
+
+    Cache lookups and writes stay on the calling thread; only the OSRM
+    requests for missing legs run concurrently.
+    """
+    pairs = _leg_pairs(coords)
+    keys = [route_cache_key(pair, profile, options) for pair in pairs]
+    legs, missing = _cached_legs(keys)
+    if len(missing) == 1:
+        fetched = [request_route(pairs[missing[0]], profile, options)]
+    elif missing:
+        with ThreadPoolExecutor(max_workers=len(missing)) as pool:
+            fetched = list(pool.map(lambda i: request_route(pairs[i], profile, options), missing))
+    else:
+        fetched = []
+    return _store_legs(legs, keys, missing, fetched)
+
+
+async def afetch_legs(coords: list, profile: str = OSRM_PROFILE, options: dict = None):
+    """Non-blocking fetch_legs: cache I/O runs in a worker thread, OSRM calls on the loop."""
+    pairs = _leg_pairs(coords)
+    keys = [route_cache_key(pair, profile, options) for pair in pairs]
+    legs, missing = await sync_to_async(_cached_legs)(keys)
+    fetched = await asyncio.gather(*(arequest_route(pairs[i], profile, options) for i in missing))
+    if missing:
+        await sync_to_async(_store_legs)(legs, keys, missing, fetched)
+    return legs
+
+
+def stitch_legs(legs: list):
+    """Combine per-leg results into the single OSRM response shape build_timeline reads."""
+    coordinates = []
+    for leg in legs:
+        leg_coords = leg["geometry"]["coordinates"]
+        if coordinates and leg_coords and coordinates[-1] == leg_coords[0]:
+            leg_coords = leg_coords[1:]
+        coordinates.extend(leg_coords)
+
+    waypoints = []
+    for i, leg in enumerate(legs):
+        waypoints.extend(leg["waypoints"] if i == 0 else leg["waypoints"][1:])
+
+    return {
+        "code": "Ok",
+        "routes": [{
+            "distance": sum(leg["distance"] for leg in legs),
+            "duration": sum(leg["duration"] for leg in legs),
+            "geometry": {"type": "LineString", "coordinates": coordinates},
+            "legs": [
+                {"distance": leg["distance"], "duration": leg["duration"], "steps": leg["steps"], "summary": leg["summary"]}
+                for leg in legs
+            ],
+        }],
+        "waypoints": waypoints,
+    }
+
+
+def fetch_route(coords: list, profile: str = OSRM_PROFILE, options: dict = None):
+    """Fetch driving route between waypoints using OSRM with intermediate points.
+
+    Each consecutive pair of waypoints is fetched and cached as its own leg,
+    so trips sharing a leg (e.g. the same pickup→dropoff) only fetch the legs
+    not seen before. Missing legs are requested concurrently.
+    """
+    return stitch_legs(fetch_legs(coords, profile, options))
+
+
+def fetch_routes(coords_list: list, max_workers: int = 16, profile: str = OSRM_PROFILE, options: dict = None):
+    """fetch_route for many waypoint lists at once.
+
+    Legs are deduplicated across the whole batch, so each distinct leg is
+    looked up once and fetched at most once; the fetches share one thread
+    pool. Returns one stitched route per input, or the exception that
+    prevented it.
+    """
+    pairs_list = []
+    for coords in coords_list:
+        try:
+            pairs_list.append(_leg_pairs(coords))
+        except ValueError as e:
+            pairs_list.append(e)
+
+    unique = {}
+    for pairs in pairs_list:
+        if not isinstance(pairs, Exception):
+            for pair in pairs:
+                unique.setdefault(route_cache_key(pair, profile, options), pair)
+
+    keys = list(unique)
+    legs, missing = _cached_legs(keys)
+    failures = {}
+
+    def request(i):
+        try:
+            return i, request_route(unique[keys[i]], profile, options), None
+        except Exception as e:
+            return i, None, e
+
+    fetched_ok, fetched = [], []
+    if missing:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missing)))) as pool:
+            for i, route_data, error in pool.map(request, missing):
+                if error is None:
+                    fetched_ok.append(i)
+                    fetched.append(route_data)
+                else:
+                    failures[keys[i]] = error
+    _store_legs(legs, keys, fetched_ok, fetched)
+    by_key = dict(zip(keys, legs))
+
+    routes = []
+    for pairs in pairs_list:
+        if isinstance(pairs, Exception):
+            routes.append(pairs)
+            continue
+        pair_keys = [route_cache_key(pair, profile, options) for pair in pairs]
+        error = next((failures[k] for k in pair_keys if k in failures), None)
+        routes.append(error if error is not None else stitch_legs([by_key[k] for k in pair_keys]))
+    return routes
+
+
+async def afetch_route(coords: list, profile: str = OSRM_PROFILE, options: dict = None):
+    """Non-blocking fetch_route."""
+    return stitch_legs(await afetch_legs(coords, profile, options))
+
+
+def table_cache_key(origin, destination, profile: str = OSRM_PROFILE):
+    """Key of one table cell; coordinates are expected normalized (see normalize_coords)."""
+    return make_key("cell", profile, origin, destination)
+
+
+def request_table(sources: list, destinations: list, profile: str = OSRM_PROFILE):
+    """Ask the OSRM table service for durations and distances from every source to every destination."""
+    coords_str = ";".join(f"{lon},{lat}" for lat, lon in [*sources, *destinations])
+    params = {
+        **OSRM_TABLE_OPTIONS,
+        "sources": ";".join(str(i) for i in range(len(sources))),
+        "destinations": ";".join(str(len(sources) + i) for i in range(len(destinations))),
+    }
+    resp = osrm_client.get(f"/table/v1/{profile}/{coords_str}", params=params)
+    if resp.status_code != 200 or resp.json().get("code") != "Ok":
+        raise Exception("Table calculation failed")
+    return resp.json()
+
+
+def _blocks(n_rows, n_cols, max_coordinates):
+    """(row slice, column slice) blocks of a table, each at most ``max_coordinates`` coordinates."""
+    if n_rows + n_cols <= max_coordinates:
+        return [(slice(0, n_rows), slice(0, n_cols))]
+    col_size = min(n_cols, max(1, max_coordinates // 2))
+    row_size = max(1, max_coordinates - col_size)
+    return [
+        (slice(r, r + row_size), slice(c, c + col_size))
+        for r, c in product(range(0, n_rows, row_size), range(0, n_cols, col_size))
+    ]
+
+
+def fetch_table(sources: list, destinations: list, needed=None, profile: str = OSRM_PROFILE):
+    """Driving (durations in s, distances in m) arrays from each source to each destination.
+
+    Only the cells set in ``needed`` (a boolean mask, default all) are
+    filled; the rest, and cells OSRM cannot route, are NaN. Cells are cached
+    on their own origin/destination pair, so overlapping tables share them.
+    The missing cells are fetched in one table request over the sources and
+    destinations they involve, split into blocks of at most
+    TABLE_CACHE["MAX_COORDINATES"] coordinates (requested concurrently)
+    when that is too large for the server.
+    """
+    sources, destinations = normalize_coords(sources), normalize_coords(destinations)
+    shape = (len(sources), len(destinations))
+    needed = np.ones(shape, dtype=bool) if needed is None else np.asarray(needed, dtype=bool)
+    durations, distances = np.full(shape, np.nan), np.full(shape, np.nan)
+
+    cells = {}
+    for i, j in zip(*np.nonzero(needed)):
+        cells.setdefault(table_cache_key(sources[i], destinations[j], profile), []).append((i, j))
+    cached = table_cache.get_many(list(cells))
+    missing = [key for key in cells if key not in cached]
+
+    if missing:
+        # Unique coordinates of the missing cells, in first-seen order
+        rows, cols = {}, {}
+        for key in missing:
+            i, j = cells[key][0]
+            rows.setdefault(tuple(sources[i]), len(rows))
+            cols.setdefault(tuple(destinations[j]), len(cols))
+        row_coords, col_coords = [list(c) for c in rows], [list(c) for c in cols]
+        blocks = _blocks(len(rows), len(cols), _table_settings.get("MAX_COORDINATES", 100))
+
+        def request(block):
+            return request_table(row_coords[block[0]], col_coords[block[1]], profile)
+
+        if len(blocks) == 1:
+            fetched = [request(blocks[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(blocks), 8)) as pool:
+                fetched = list(pool.map(request, blocks))
+
+        table = np.full((len(rows), len(cols), 2), np.nan)
+        for (row_slice, col_slice), data in zip(blocks, fetched):
+            table[row_slice, col_slice, 0] = np.array(data["durations"], dtype=np.float64)
+            if data.get("distances") is not None:
+                table[row_slice, col_slice, 1] = np.array(data["distances"], dtype=np.float64)
+        new = {}
+        for key in missing:
+            i, j = cells[key][0]
+            value = table[rows[tuple(sources[i])], cols[tuple(destinations[j])]]
+            new[key] = [None if np.isnan(v) else float(v) for v in value]
+        table_cache.set_many(new)
+        cached.update(new)
+
+    for key, positions in cells.items():
+        duration, distance = cached[key]
+        for cell in positions:
+            durations[cell] = np.nan if duration is None else duration
+            distances[cell] = np.nan if distance is None else distance
+    return durations, distances
@@ -2,6 +2,19 @@ from rest_framework import serializers
 from .models import TripPlan
 
 class TripPlanSerializer(serializers.ModelSerializer):
+    # plan_data["summary"], annotated by the history views so lists can skip plan_data
+    summary = serializers.JSONField(read_only=True)
+
     class Meta:
         model = TripPlan
-        fields = "__all__"
\ No newline at end of file
+        fields = [
+            "id", "driver_name", "co_driver_name", "truck_number", "trailer_number",
+            "start_date", "current_cycle_used", "created_at", "updated_at", "summary", "plan_data",
+        ]
+
+    def __init__(self, *args, fields=None, **kwargs):
+        """``fields`` limits the output to a subset of Meta.fields."""
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
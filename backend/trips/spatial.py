@@ -0,0 +1,310 @@
+"""Grid-cell spatial index over stored route geometry.
+
+The globe is cut into square cells of SPATIAL_INDEX["CELL_DEGREES"] and
+every trip gets one TripCell row per cell its route passes through,
+written in the same transaction as the trip (records.save_trips) and
+deleted with it. A query looks up the cells around its area (one indexed
+range scan per grid row). A trip with a cell lying wholly inside the
+query area matches outright; only the remaining candidates have their
+geometry checked exactly.
+
+Routes are sampled at most half a cell apart, so a route crossing a cell
+always has a sample in that cell or one of its eight neighbours; queries
+widen their cells by one ring to make up for it. Changing CELL_DEGREES
+requires ``manage.py rebuild_spatial_index``.
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .geometry import decode_polyline_array
+from .models import TripCell, TripPlan
+
+MILES_PER_DEGREE_LAT = 69.0
+CHUNK = 500
+
+
+def cell_degrees():
+    return getattr(settings, "SPATIAL_INDEX", {}).get("CELL_DEGREES", 0.1)
+
+
+def _grid(degrees):
+    return math.ceil(360 / degrees)
+
+
+def _rows_cols(points, degrees):
+    rows = np.floor((points[:, 0] + 90) / degrees).astype(np.int64)
+    cols = np.floor((points[:, 1] + 180) / degrees).astype(np.int64) % _grid(degrees)
+    return rows, cols
+
+
+def route_cells(points, degrees=None):
+    """Sorted unique cell ids a [lat, lon] polyline passes through (or borders)."""
+    degrees = degrees or cell_degrees()
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 0:
+        return np.empty(0, dtype=np.int64)
+    if len(points) > 1:
+        # Densify segments longer than half a cell
+        steps = np.maximum(1, np.ceil(np.abs(np.diff(points, axis=0)).max(axis=1) / (degrees / 2))).astype(np.int64)
+        if steps.max() > 1:
+            starts = np.repeat(points[:-1], steps, axis=0)
+            deltas = np.repeat(np.diff(points, axis=0) / steps[:, None], steps, axis=0)
+            offsets = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+            points = np.vstack([starts + deltas * offsets[:, None], points[-1:]])
+    rows, cols = _rows_cols(points, degrees)
+    return np.unique(rows * _grid(degrees) + cols)
+
+
+def _area_cells(min_lat, min_lng, max_lat, max_lng, degrees):
+    """{row: (first col, last col)} covering a bbox, widened by one cell."""
+    rows, cols = _rows_cols(np.array([[min_lat, min_lng], [max_lat, max_lng]]), degrees)
+    return {row: (cols[0] - 1, cols[1] + 1) for row in range(rows[0] - 1, rows[1] + 2)}
+
+
+def _cell_filter(runs, degrees):
+    """Q matching TripCell rows in {row: [(first col, last col), ...]}."""
+    grid = _grid(degrees)
+    q = Q()
+    for row, spans in runs.items():
+        for first, last in spans:
+            q |= Q(cell__gte=row * grid + max(first, 0), cell__lte=row * grid + min(last, grid - 1))
+    return q
+
+
+def _runs(cells, degrees):
+    """Group cell ids into {row: [(first col, last col), ...]} runs of adjacent cells."""
+    grid = _grid(degrees)
+    runs = {}
+    for cell in np.unique(cells).tolist():
+        row, col = divmod(cell, grid)
+        spans = runs.setdefault(row, [])
+        if spans and spans[-1][1] == col - 1:
+            spans[-1] = (spans[-1][0], col)
+        else:
+            spans.append((col, col))
+    return runs
+
+
+def _dilate(cells, degrees):
+    grid = _grid(degrees)
+    rows, cols = np.divmod(np.asarray(cells, dtype=np.int64), grid)
+    ring = np.array([(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)])
+    rows = (rows[:, None] + ring[:, 0]).ravel()
+    cols = ((cols[:, None] + ring[:, 1]) % grid).ravel()
+    return np.unique(rows * grid + cols)
+
+
+# ------------------ WRITES ------------------
+
+def _decode(geometry):
+    from .planning import STORED_POLYLINE_PRECISION
+
+    return decode_polyline_array(bytes(geometry).decode("ascii"), STORED_POLYLINE_PRECISION)
+
+
+def trip_points(trip):
+    """A trip's route as an (n, 2) array (rows saved before TripPlan.geometry keep it in plan_data)."""
+    if trip.geometry:
+        return _decode(trip.geometry)
+    from .planning import stored_points
+
+    return np.asarray(stored_points(trip), dtype=np.float64).reshape(-1, 2)
+
+
+def save_cells(trips):
+    """Insert the TripCell rows of already-saved trips.
+
+    A plain executemany: the rows are two integers, and building model
+    instances for them cost more than computing the cells.
+    """
+    table = connection.ops.quote_name(TripCell._meta.db_table)
+    degrees = cell_degrees()
+    rows = [(trip.id, cell) for trip in trips for cell in route_cells(trip_points(trip), degrees).tolist()]
+    with connection.cursor() as cursor:
+        cursor.executemany(f"INSERT INTO {table} (trip_id, cell) VALUES (%s, %s)", rows)
+
+
+def reindex(trips):
+    """Replace the cells of trips whose geometry changed."""
+    with transaction.atomic():
+        TripCell.objects.filter(trip_id__in=[t.id for t in trips]).delete()
+        save_cells(trips)
+
+
+# ------------------ QUERIES ------------------
+
+def _project(points, ref_lat):
+    """Equirectangular projection to miles around ``ref_lat`` (fine at corridor scale)."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    scale = np.array([MILES_PER_DEGREE_LAT, MILES_PER_DEGREE_LAT * math.cos(math.radians(ref_lat))])
+    return points * scale
+
+
+def _point_segment_distances(p, a, b):
+    """(len(p), len(a)) distances from points to segments a[i]-b[i]."""
+    d = b - a
+    length2 = (d ** 2).sum(axis=1)
+    rel = p[:, None, :] - a[None, :, :]
+    t = np.clip(np.divide((rel * d).sum(axis=2), length2, out=np.zeros((len(p), len(a))), where=length2 > 0), 0, 1)
+    return np.hypot(*(rel - t[:, :, None] * d).transpose(2, 0, 1))
+
+
+def _segments(line):
+    """(starts, ends) of a polyline's segments; a single point is a zero-length segment."""
+    return (line, line) if len(line) == 1 else (line[:-1], line[1:])
+
+
+def _min_distance(p, a, b, chunk=1 << 18):
+    """Smallest distance from any of the points to any segment a[i]-b[i] (projected miles)."""
+    if len(p) == 0 or len(a) == 0:
+        return math.inf
+    rows = max(1, chunk // len(a))
+    return min(float(_point_segment_distances(p[i:i + rows], a, b).min()) for i in range(0, len(p), rows))
+
+
+def _crossing(a, b, c, d, chunk=1 << 18):
+    """Whether any segment a[i]-b[i] properly crosses any segment c[j]-d[j]."""
+    if len(a) == 0 or len(c) == 0:
+        return False
+
+    def cross(u, v):
+        return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+    rows = max(1, chunk // len(c))
+    for i in range(0, len(a), rows):
+        p, q = a[i:i + rows, None, :], b[i:i + rows, None, :]
+        o1, o2 = cross(q - p, c[None] - p), cross(q - p, d[None] - p)
+        o3, o4 = cross(d[None] - c[None], p - c[None]), cross(d[None] - c[None], q - c[None])
+        if ((o1 * o2 < 0) & (o3 * o4 < 0)).any():
+            return True
+    return False
+
+
+def _cell_corners(cells, degrees):
+    """(len(cells), 4, 2) [lat, lon] corners of cells."""
+    rows, cols = np.divmod(np.asarray(cells, dtype=np.int64), _grid(degrees))
+    south_west = np.stack([rows * degrees - 90, cols * degrees - 180], axis=1)
+    return south_west[:, None, :] + np.array([[0, 0], [0, 1], [1, 0], [1, 1]]) * degrees
+
+
+def _geometries(trip_ids):
+    """Yield (trip id, [lat, lon] array) for trips in chunks."""
+    for i in range(0, len(trip_ids), CHUNK):
+        for trip_id, geometry in TripPlan.objects.filter(id__in=trip_ids[i:i + CHUNK]).values_list("id", "geometry"):
+            if geometry:
+                yield trip_id, _decode(geometry)
+            else:
+                yield trip_id, trip_points(TripPlan.objects.only("id", "geometry", "plan_data").get(id=trip_id))
+
+
+def _lookup(q, inside, refine):
+    """Sorted ids of the matching trips among the TripCell rows matching ``q``.
+
+    Every indexed cell holds a point of its route, so a trip with a cell
+    lying wholly inside the query area (``inside(cells)``) matches without
+    looking at its geometry; only the others are checked with
+    ``refine(points)``.
+    """
+    rows = np.array(TripCell.objects.filter(q).values_list("trip_id", "cell"), dtype=np.int64).reshape(-1, 2)
+    if not len(rows):
+        return []
+    cells = np.unique(rows[:, 1])
+    certain = set(np.unique(rows[np.isin(rows[:, 1], cells[inside(cells)]), 0]).tolist())
+    pending = sorted(set(np.unique(rows[:, 0]).tolist()) - certain)
+    certain.update(trip_id for trip_id, points in _geometries(pending) if len(points) and refine(points))
+    return sorted(certain)
+
+
+def near(lat, lng, radius_miles):
+    """Ids of trips whose route passes within ``radius_miles`` of a point."""
+    degrees = cell_degrees()
+    dlat = radius_miles / MILES_PER_DEGREE_LAT
+    dlng = radius_miles / (MILES_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+    area = _area_cells(lat - dlat, lng - dlng, lat + dlat, lng + dlng, degrees)
+    center = _project([lat, lng], lat)
+
+    def inside(cells):
+        corners = _project(_cell_corners(cells, degrees).reshape(-1, 2), lat)
+        return (np.hypot(*(corners - center).T) <= radius_miles).reshape(-1, 4).all(axis=1)
+
+    def refine(points):
+        return _min_distance(center, *_segments(_project(points, lat))) <= radius_miles
+
+    return _lookup(_cell_filter({row: [span] for row, span in area.items()}, degrees), inside, refine)
+
+
+def _segments_hit_bbox(points, bbox):
+    """Whether any segment of the polyline touches the bbox (Liang-Barsky, vectorized)."""
+    lo, hi = np.array(bbox[:2]), np.array(bbox[2:])
+    if len(points) == 1:
+        return bool(((points[0] >= lo) & (points[0] <= hi)).all())
+    a, d = points[:-1], np.diff(points, axis=0)
+    inside = (a >= lo) & (a <= hi)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t1, t2 = (lo - a) / d, (hi - a) / d
+    flat = d == 0
+    t_in = np.where(flat, np.where(inside, -np.inf, np.inf), np.minimum(t1, t2)).max(axis=1)
+    t_out = np.where(flat, np.where(inside, np.inf, -np.inf), np.maximum(t1, t2)).min(axis=1)
+    return bool((np.maximum(t_in, 0) <= np.minimum(t_out, 1)).any())
+
+
+def within(bbox):
+    """Ids of trips whose route enters the bbox (min_lat, min_lng, max_lat, max_lng)."""
+    degrees = cell_degrees()
+    area = _area_cells(*bbox, degrees)
+    lo, hi = np.array(bbox[:2]), np.array(bbox[2:])
+
+    def inside(cells):
+        corners = _cell_corners(cells, degrees)
+        return ((corners >= lo) & (corners <= hi)).all(axis=(1, 2))
+
+    return _lookup(_cell_filter({row: [span] for row, span in area.items()}, degrees), inside, lambda points: _segments_hit_bbox(points, bbox))
+
+
+def corridor(points, radius_miles, chunk=1 << 20):
+    """Ids of trips whose route passes within ``radius_miles`` of a [lat, lon] polyline."""
+    degrees = cell_degrees()
+    line = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(line) == 0:
+        return []
+    # Buffer the corridor by the radius (in cells), then by the usual ring
+    reach = radius_miles / (MILES_PER_DEGREE_LAT * max(math.cos(math.radians(np.abs(line[:, 0]).max())), 0.01))
+    cells = route_cells(line, degrees)
+    for _ in range(math.ceil(reach / degrees) + 1):
+        cells = _dilate(cells, degrees)
+
+    ref_lat = float(line[:, 0].mean())
+    projected = _project(line, ref_lat)
+    line_starts, line_ends = _segments(projected)
+    grid = _grid(degrees)
+
+    def inside(cells):
+        # A cell is inside when all its corners are within reach of one segment (each capsule is convex)
+        corners = _project(_cell_corners(cells, degrees).reshape(-1, 2), ref_lat)
+        rows = max(4, chunk // len(line_starts) // 4 * 4)
+        result = np.zeros(len(cells), dtype=bool)
+        for i in range(0, len(corners), rows):
+            distances = _point_segment_distances(corners[i:i + rows], line_starts, line_ends)
+            result[i // 4:(i + rows) // 4] = (distances.reshape(-1, 4, len(line_starts)).max(axis=1) <= radius_miles).any(axis=1)
+        return result
+
+    def refine(trip_points):
+        # Only the part of the trip inside the buffered cells can be close
+        rows, cols = _rows_cols(trip_points, degrees)
+        ids = rows * grid + cols
+        close = cells[np.minimum(np.searchsorted(cells, ids), len(cells) - 1)] == ids
+        trip_line = _project(trip_points, ref_lat)
+        starts, ends = _segments(trip_line)
+        near_segments = close if len(trip_line) == 1 else close[:-1] | close[1:]
+        starts, ends = starts[near_segments], ends[near_segments]
+        return (
+            _crossing(starts, ends, line_starts, line_ends)
+            or _min_distance(trip_line[close], line_starts, line_ends) <= radius_miles
+            or _min_distance(projected, starts, ends) <= radius_miles
+        )
+
+    return _lookup(_cell_filter(_runs(cells, degrees), degrees), inside, refine)
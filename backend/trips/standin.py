@@ -0,0 +1,95 @@
+"""Local stand-in for the OSRM and Nominatim HTTP APIs.
+
+Serves synthetic responses so load tests never touch the public servers.
+Each request waits ``latency`` seconds (plus up to ``jitter`` more) and
+fails with a 503 with probability ``error_rate``, so retries, the circuit
+breaker and tail latency can be exercised as well.
+"""
+import json
+import multiprocessing
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .synthetic import synthetic_geocode, synthetic_route, synthetic_table
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        delay = server.latency + (server.rng.uniform(0, server.jitter) if server.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        if server.error_rate and server.rng.random() < server.error_rate:
+            self._send(503, {"code": "ServiceUnavailable", "message": "stand-in injected error"})
+            return
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+
+        if parts[:2] == ["route", "v1"] and len(parts) == 4:
+            waypoints = [[float(lat), float(lon)] for lon, lat in (p.split(",") for p in parts[3].split(";"))]
+            self._send(200, synthetic_route(waypoints, points_per_mile=server.points_per_mile))
+        elif parts[:2] == ["table", "v1"] and len(parts) == 4:
+            coords = [[float(lat), float(lon)] for lon, lat in (p.split(",") for p in parts[3].split(";"))]
+            query = parse_qs(url.query)
+            sources = [coords[int(i)] for i in query["sources"][0].split(";")] if "sources" in query else coords
+            destinations = [coords[int(i)] for i in query["destinations"][0].split(";")] if "destinations" in query else coords
+            self._send(200, synthetic_table(sources, destinations))
+        elif parts == ["search"]:
+            query = parse_qs(url.query).get("q", [""])[0]
+            self._send(200, [synthetic_geocode(query)] if query else [])
+        else:
+            self._send(404, {"code": "InvalidUrl"})
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, points_per_mile=2.0, jitter=0.0, error_rate=0.0, seed=None):
+        super().__init__((host, port), StandinHandler)
+        self.latency = latency
+        self.points_per_mile = points_per_mile
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a daemon thread and return self."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        self._process = None
+        return self
+
+    def start_process(self):
+        """Serve from a forked child process so responses don't compete for our GIL."""
+        self._process = multiprocessing.get_context("fork").Process(target=self.serve_forever, daemon=True)
+        self._process.start()
+        return self
+
+    def stop(self):
+        if getattr(self, "_process", None) is not None:
+            self._process.terminate()
+            self._process.join()
+        else:
+            self.shutdown()
+        self.server_close()
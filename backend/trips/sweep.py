@@ -0,0 +1,102 @@
+"""What-if sweeps over start time and cycle hours for a single route.
+
+The route is fetched once and the HOS engine is run over the grid. The
+engine works in hours since the trip start and has no time-of-day rules,
+so the duty sequence depends only on the cycle hours already used. Each
+cycle value is therefore simulated once, and the ETAs for every start time
+are offsets from that single run. Drives end at truck stops exactly as
+in plan_trip (see planning.simulate_route) when a dataset is configured.
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+
+from . import hos
+from .planning import route_schedule
+from .route_index import RouteIndex
+
+
+def _grid(spec, name, parse, step_type, limit):
+    """A list of values, or a {"from", "to", "step"} range (inclusive)."""
+    if isinstance(spec, list):
+        if not spec or len(spec) > limit:
+            raise ValueError(f"{name} must have 1 to {limit} values")
+        return [parse(v) for v in spec]
+    if isinstance(spec, dict) and {"from", "to", "step"} <= spec.keys():
+        first, last, step = parse(spec["from"]), parse(spec["to"]), step_type(spec["step"])
+        if not step > step_type(0) or last < first:
+            raise ValueError(f"{name} needs from <= to and a positive step")
+        count = int((last - first) / step + 1e-9) + 1
+        if count > limit:
+            raise ValueError(f"{name} must have 1 to {limit} values")
+        return [first + i * step for i in range(count)]
+    raise ValueError(f"{name} must be a list or a {{from, to, step}} range")
+
+
+def parse_sweep(data, max_cells):
+    """Pull the start-time and cycle grids out of a sweep payload."""
+    sweep = data.get("sweep") or {}
+    start_times = _grid(
+        sweep.get("start_times"), "start_times", datetime.fromisoformat,
+        lambda hours: timedelta(hours=float(hours)), max_cells,
+    )
+    cycles = [round(c, 6) for c in _grid(sweep.get("cycles"), "cycles", float, float, max_cells)]
+    if len(start_times) * len(cycles) > max_cells:
+        raise ValueError(f"At most {max_cells} cells per sweep")
+    for cycle in cycles:
+        if not 0 <= cycle <= hos.RULES.cycle_limit:
+            raise ValueError(f"cycles must be between 0 and {hos.RULES.cycle_limit:g}")
+    return start_times, cycles
+
+
+def run_cycle(drive_hours, cycle_used, fuel_at, rules=hos.RULES, stops_at=None, stop_window=1.0):
+    """Trip length, rest and restart counts for one cycle value."""
+    rests = restarts = 0
+    generator = hos.iter_events(
+        drive_hours, hos.HOSState(cycle_used=cycle_used), fuel_at, rules, stops_at=stops_at, stop_window=stop_window,
+    )
+    while True:
+        try:
+            kind = next(generator).kind
+        except StopIteration as stop:
+            final = stop.value
+            break
+        if kind == "rest":
+            rests += 1
+        elif kind == "restart":
+            restarts += 1
+    return final.clock, final.day, rests, restarts
+
+
+def sweep_route(route_data, start_times, cycles):
+    """ETA matrix (rows: start times, columns: cycles) plus per-cycle stats.
+
+    Trip hours, days, rests and restarts do not depend on the start time,
+    so they are returned once per column.
+    """
+    index = RouteIndex.from_route(route_data)
+    fuel_at, facilities = route_schedule(index)
+    stops_at = facilities.offsets() if facilities else None
+    stop_window = settings.TRUCK_STOPS.get("WINDOW_HOURS", 1.0)
+    drive_hours = route_data["routes"][0]["duration"] / 3600
+
+    columns = {}
+    for cycle in cycles:
+        if cycle not in columns:
+            columns[cycle] = run_cycle(drive_hours, cycle, fuel_at, stops_at=stops_at, stop_window=stop_window)
+    trip_hours = [columns[c][0] for c in cycles]
+    offsets = [timedelta(hours=h) for h in trip_hours]
+
+    return {
+        "start_times": [s.isoformat() for s in start_times],
+        "cycles": cycles,
+        "eta": [[(start + offset).isoformat() for offset in offsets] for start in start_times],
+        "trip_hours": [round(h, 2) for h in trip_hours],
+        "days": [columns[c][1] for c in cycles],
+        "rests": [columns[c][2] for c in cycles],
+        "restart": [columns[c][3] > 0 for c in cycles],
+        "route": {
+            "total_distance_miles": round(route_data["routes"][0]["distance"] / 1609.34, 1),
+            "total_driving_hours": round(drive_hours, 1),
+        },
+    }
@@ -0,0 +1,89 @@
+"""Synthetic OSRM-style responses for the local stand-in server and benchmarks."""
+import math
+import random
+
+EARTH_RADIUS_MILES = 3958.8
+METERS_PER_MILE = 1609.34
+
+
+def haversine_miles(a, b):
+    """Great-circle distance in miles between two [lat, lon] points."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(h))
+
+
+def _leg_geometry(origin, destination, n_points, rng):
+    """Interpolate origin→destination with a gentle meander so it is not a straight line."""
+    n_points = max(2, n_points)
+    wiggle = min(0.05, haversine_miles(origin, destination) / 2000)
+    coords = []
+    for i in range(n_points):
+        t = i / (n_points - 1)
+        offset = 0.0 if i in (0, n_points - 1) else wiggle * math.sin(t * math.pi * 8) + rng.uniform(-1, 1) * 2e-5
+        lat = origin[0] + (destination[0] - origin[0]) * t + offset
+        lon = origin[1] + (destination[1] - origin[1]) * t - offset
+        coords.append([round(lon, 6), round(lat, 6)])
+    return coords
+
+
+def synthetic_route(waypoints, points_per_mile=2.0, min_points=10, speed_mph=55.0, detour=1.2, seed=None):
+    """Build an OSRM /route response for [lat, lon] waypoints.
+
+    Road distance is the great-circle distance times ``detour``; duration
+    assumes a constant ``speed_mph``. Each leg gets one step per ~50 miles.
+    """
+    rng = random.Random(seed)
+    coordinates, legs = [], []
+    for origin, destination in zip(waypoints, waypoints[1:]):
+        miles = haversine_miles(origin, destination) * detour
+        geometry = _leg_geometry(origin, destination, max(min_points, int(miles * points_per_mile)), rng)
+        coordinates.extend(geometry if not coordinates else geometry[1:])
+        distance = miles * METERS_PER_MILE
+        duration = miles / speed_mph * 3600
+        n_steps = max(1, int(miles // 50))
+        legs.append({
+            "distance": round(distance, 1),
+            "duration": round(duration, 1),
+            "summary": "Synthetic Hwy",
+            "steps": [
+                {
+                    "distance": round(distance / n_steps, 1),
+                    "duration": round(duration / n_steps, 1),
+                    "name": f"Synthetic Hwy {i + 1}",
+                    "maneuver": {"type": "depart" if i == 0 else "continue", "location": geometry[i * (len(geometry) - 1) // n_steps]},
+                }
+                for i in range(n_steps)
+            ],
+            "weight": round(duration, 1),
+        })
+    return {
+        "code": "Ok",
+        "routes": [{
+            "distance": round(sum(leg["distance"] for leg in legs), 1),
+            "duration": round(sum(leg["duration"] for leg in legs), 1),
+            "geometry": {"type": "LineString", "coordinates": coordinates},
+            "legs": legs,
+            "weight_name": "routability",
+            "weight": round(sum(leg["weight"] for leg in legs), 1),
+        }],
+        "waypoints": [{"name": "", "location": [lon, lat]} for lat, lon in waypoints],
+    }
+
+
+def synthetic_table(sources, destinations, speed_mph=55.0, detour=1.2):
+    """Build an OSRM /table response (durations and distances) for [lat, lon] sources and destinations."""
+    miles = [[haversine_miles(origin, destination) * detour for destination in destinations] for origin in sources]
+    return {
+        "code": "Ok",
+        "durations": [[round(m / speed_mph * 3600, 1) for m in row] for row in miles],
+        "distances": [[round(m * METERS_PER_MILE, 1) for m in row] for row in miles],
+        "sources": [{"name": "", "location": [lon, lat]} for lat, lon in sources],
+        "destinations": [{"name": "", "location": [lon, lat]} for lat, lon in destinations],
+    }
+
+
+def synthetic_geocode(address):
+    """Deterministic continental-US coordinates for an address string."""
+    rng = random.Random(address.strip().lower())
+    return {"lat": f"{rng.uniform(30.0, 47.0):.6f}", "lon": f"{rng.uniform(-122.0, -75.0):.6f}", "display_name": address}
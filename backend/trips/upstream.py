@@ -0,0 +1,311 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Registry of every client built in this process, for monitoring.
+clients = {}
+
+
+class UpstreamError(Exception):
+    """An upstream service failed or ran out of latency budget."""
+
+
+class CircuitOpenError(UpstreamError):
+    """The circuit breaker is open; the upstream is not being called."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    Opens after ``failure_threshold`` failures in a row and fails fast for
+    ``reset_timeout`` seconds, then lets one trial request through
+    (half-open). A success closes it again, a failure re-opens it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = round(max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)), 2)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "times_opened": self.times_opened,
+                "retry_in": retry_in,
+            }
+
+
+class RateLimiter:
+    """Spaces calls at least ``1 / rate`` seconds apart across threads.
+
+    Callers reserve the next free slot and sleep until it arrives, so a
+    burst is spread out evenly instead of rejected.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Claim the next slot and return how long to wait for it."""
+        with self._lock:
+            current = time.monotonic()
+            slot = max(current, self._next_slot)
+            self._next_slot = slot + self.interval
+            return slot - current
+
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def await_turn(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class UpstreamClient:
+    """Pooled HTTP client for one upstream service.
+
+    ``get`` uses a blocking requests.Session, ``aget`` an httpx.AsyncClient;
+    both share the breaker and counters. Every call gets a total latency ``budget`` (seconds) shared by all of its
+    attempts; connection errors, timeouts, 429s and 5xx responses are retried
+    up to ``retries`` times with full-jitter exponential backoff while budget
+    remains. Calls fail fast with CircuitOpenError while the breaker is open.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, name, base_url, budget=5.0, connect_timeout=2.0, retries=2, backoff=0.2,
+                 pool_size=10, async_pool_size=200, headers=None, breaker=None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.budget = budget
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.async_pool_size = async_pool_size
+        self._async_clients = weakref.WeakKeyDictionary()
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self.counters = {"requests": 0, "retries": 0, "failures": 0, "short_circuited": 0, "budget_exhausted": 0}
+        self._lock = threading.Lock()
+        clients[name] = self
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _start_attempt(self, attempt, deadline):
+        """Check the budget and breaker; return the seconds left or None to stop.
+
+        The budget comes first: once allow() has let a half-open trial
+        through, the attempt must be made so that it ends in
+        record_success or record_failure.
+        """
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+        if attempt:
+            self._count("retries")
+        self._count("requests")
+        return remaining
+
+    def _fail_attempt(self, attempt, deadline, error):
+        """Record a failed attempt; return the backoff delay or None to stop."""
+        self._count("failures")
+        self.breaker.record_failure()
+        logger.warning("%s request failed (attempt %d): %s", self.name, attempt + 1, error)
+        delay = random.uniform(0, self.backoff * (2 ** attempt))
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def _give_up(self, error):
+        self._count("budget_exhausted")
+        return UpstreamError(f"{self.name} request failed: {error or 'latency budget exhausted'}")
+
+    def get(self, path, params=None, budget=None):
+        """GET ``path`` relative to the base URL and return the response.
+
+        Non-retryable responses (including 4xx) are returned as-is; the
+        caller decides what they mean.
+        """
+        deadline = time.monotonic() + (self.budget if budget is None else budget)
+        last_error = None
+
+        for attempt in range(self.retries + 1):
+            remaining = self._start_attempt(attempt, deadline)
+            if remaining is None:
+                break
+            try:
+                resp = self.session.get(self._url(path), params=params, timeout=(min(self.connect_timeout, remaining), remaining))
+            except requests.RequestException as e:
+                last_error = e
+            except BaseException:
+                # Anything else still ends the attempt, or a half-open trial would never finish
+                self.breaker.record_failure()
+                raise
+            else:
+                if resp.status_code not in self.RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return resp
+                last_error = UpstreamError(f"{self.name} returned HTTP {resp.status_code}")
+
+            delay = self._fail_attempt(attempt, deadline, last_error)
+            if delay is None:
+                break
+            time.sleep(delay)
+
+        raise self._give_up(last_error)
+
+    def _async_client(self):
+        """One httpx.AsyncClient per running event loop (they cannot be shared)."""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                headers=dict(self.session.headers),
+                limits=httpx.Limits(max_connections=self.async_pool_size, max_keepalive_connections=self.pool_size),
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def aget(self, path, params=None, budget=None):
+        """Non-blocking counterpart of get(), sharing its breaker and counters."""
+        deadline = time.monotonic() + (self.budget if budget is None else budget)
+        client = self._async_client()
+        last_error = None
+
+        for attempt in range(self.retries + 1):
+            remaining = self._start_attempt(attempt, deadline)
+            if remaining is None:
+                break
+            try:
+                timeout = httpx.Timeout(remaining, connect=min(self.connect_timeout, remaining))
+                resp = await asyncio.wait_for(client.get(self._url(path), params=params, timeout=timeout), remaining)
+            except (httpx.HTTPError, asyncio.TimeoutError) as e:
+                last_error = e
+            except BaseException:
+                # Cancellation included: a half-open trial must not stay in flight
+                self.breaker.record_failure()
+                raise
+            else:
+                if resp.status_code not in self.RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return resp
+                last_error = UpstreamError(f"{self.name} returned HTTP {resp.status_code}")
+
+            delay = self._fail_attempt(attempt, deadline, last_error)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+
+        raise self._give_up(last_error)
+
+    def pool_stats(self):
+        pools = []
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle": pool.pool.qsize() if pool.pool is not None else 0,
+                "maxsize": self.pool_size,
+            })
+        return pools
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            "base_url": self.base_url,
+            "counters": counters,
+            "breaker": self.breaker.snapshot(),
+            "pools": self.pool_stats(),
+            "async_clients": len(self._async_clients),
+        }
+
+
+def build_client(name, base_url, headers=None):
+    """Build an UpstreamClient configured from settings.UPSTREAM."""
+    from django.conf import settings
+
+    conf = getattr(settings, "UPSTREAM", {})
+    return UpstreamClient(
+        name,
+        base_url,
+        budget=conf.get("BUDGET", 5.0),
+        connect_timeout=conf.get("CONNECT_TIMEOUT", 2.0),
+        retries=conf.get("RETRIES", 2),
+        backoff=conf.get("BACKOFF", 0.2),
+        pool_size=conf.get("POOL_SIZE", 10),
+        async_pool_size=conf.get("ASYNC_POOL_SIZE", 200),
+        headers=headers,
+        breaker=CircuitBreaker(conf.get("BREAKER_THRESHOLD", 5), conf.get("BREAKER_RESET", 30.0)),
+    )
@@ -1,7 +1,24 @@
 from django.urls import path
-from .views import plan_trip
+from .views import analytics_drivers, analytics_trucks, dispatch_matrix, download_logs_zip, generate_log_pdf, geocode_batch, plan_trip, plan_trip_async, plan_trip_batch, plan_trip_sweep, trip_detail, trip_geometry, trip_list, trip_replan, trips_corridor, trips_near, trips_within, upstream_status
 
 urlpatterns = [
     path('plan-trip/', plan_trip, name='plan-trip'),
-    # path('trip/<int:trip_id>/pdf/<int:day>/', generate_log_pdf, name='generate_log_pdf'),
+    path('plan-trip/batch/', plan_trip_batch, name='plan-trip-batch'),
+    path('plan-trip/sweep/', plan_trip_sweep, name='plan-trip-sweep'),
+    path('plan-trip/async/', plan_trip_async, name='plan-trip-async'),
+    path('dispatch/matrix/', dispatch_matrix, name='dispatch-matrix'),
+    path('trips/', trip_list, name='trip-list'),
+    path('trips/near/', trips_near, name='trips-near'),
+    path('trips/within/', trips_within, name='trips-within'),
+    path('trips/corridor/', trips_corridor, name='trips-corridor'),
+    path('trips/<int:trip_id>/', trip_detail, name='trip-detail'),
+    path('trips/<int:trip_id>/geometry/', trip_geometry, name='trip-geometry'),
+    path('trips/<int:trip_id>/replan/', trip_replan, name='trip-replan'),
+    path('analytics/drivers/', analytics_drivers, name='analytics-drivers'),
+    path('analytics/trucks/', analytics_trucks, name='analytics-trucks'),
+    path('geocode/batch/', geocode_batch, name='geocode-batch'),
+    path('upstream-status/', upstream_status, name='upstream-status'),
+    path('trip/<int:trip_id>/pdf/', generate_log_pdf, name='generate_trip_pdf'),
+    path('trip/<int:trip_id>/pdf/<int:day>/', generate_log_pdf, name='generate_log_pdf'),
+    path('trip/<int:trip_id>/pdf/zip/', download_logs_zip, name='download_logs_zip'),
 ]
@@ -1,385 +1,504 @@
+import hashlib
+import json
+from datetime import date
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from datetime import datetime, timedelta
-from django.utils.timezone import now
-import requests
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
-from reportlab.lib import colors
-from django.http import HttpResponse
-from django.core.exceptions import ObjectDoesNotExist
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.utils.timezone import localdate
+
+from . import rollups, spatial, writebehind
+from .batch import plan_batch
+from .dispatch import dispatch_matrix as build_dispatch_matrix, parse_dispatch_request
+from .idempotency import IdempotencyConflict, idempotent_plan
+from .metrics import span
 from .models import TripPlan
+from .pagination import keyset_page
+from .pdf import RenderFailed, cache_path, document_key, ensure_rendered, stream_zip, trip_documents
+from .serializers import TripPlanSerializer
+from .geometry import SIMPLIFIERS, clip_to_bbox, decode_polyline, encode_polyline, parse_geometry_options
+from .planning import build_plan, finalize_response, iter_plan, parse_plan_request, save_plan, stored_points, waypoints
+from .renderers import dumps
+from .replan import ReplanConflict, parse_replan_request, replan, save_replan
+from .routing import afetch_route, fetch_route, geocode_address, geocode_cache, geocode_many, route_cache  # noqa: F401
+from .sweep import parse_sweep, sweep_route
+from .upstream import UpstreamError, clients as upstream_clients
+from .writebehind import WriteQueueFull
 
 
-# ------------------ HELPERS ------------------
-
-def geocode_address(address: str):
-    """Geocode an address using Nominatim."""
-    url = f"https://nominatim.openstreetmap.org/search?q={address}&format=json&limit=1"
-    headers = {"User-Agent": "TripPlanner/1.0"}
-    resp = requests.get(url, headers=headers, timeout=5)
-    if resp.status_code == 200 and resp.json():
-        result = resp.json()[0]
-        return [float(result["lat"]), float(result["lon"])]
-    return None
-
-
-def fetch_route(coords: list):
-    """Fetch driving route between waypoints using OSRM with intermediate points."""
-    coords_str = ";".join([f"{lon},{lat}" for lat, lon in coords])
-    url = f"http://router.project-osrm.org/route/v1/driving/{coords_str}?overview=full&geometries=geojson&steps=true"
-    resp = requests.get(url, timeout=5)
-    if resp.status_code != 200:
-        raise Exception("Route calculation failed")
-    return resp.json()
-
-
-def build_timeline(start_time, route_data, current_cycle, pickup_coords, dropoff_coords, current_loc, pickup_loc, dropoff_loc):
-    """Simulate HOS-compliant timeline for the route."""
-    total_distance_miles = route_data["routes"][0]["distance"] / 1609.34
-    total_driving_hours = route_data["routes"][0]["duration"] / 3600
-    points = [[lat, lon] for lon, lat in route_data["routes"][0]["geometry"]["coordinates"]]
-
-    timeline = []
-    stops = []
-    current_time = start_time
-    day = 1
-    driving_today = 0
-    on_duty_today = 0
-    cumulative_driving = 0
-    miles_driven = 0
-    window_start = current_time
-    total_on_duty = current_cycle
-    segment_index = 0
-    remaining_hours = total_driving_hours
-
-    # Pickup
-    pickup_end = current_time + timedelta(hours=1)
-    timeline.append({"day": day, "start": current_time, "end": pickup_end, "status": "On Duty Not Driving", "reason": f"Loading at {pickup_loc}"})
-    stops.append({"type": "pickup", "location": pickup_coords, "duration": 1.0, "reason": f"Loading at {pickup_loc}"})
-    current_time = pickup_end
-    on_duty_today += 1
-    total_on_duty += 1
-
-    while remaining_hours > 0:
-        time_in_window = (current_time - window_start).total_seconds() / 3600
-        available_driving = min(11 - driving_today, 14 - time_in_window, remaining_hours)
-
-        if available_driving <= 0 or time_in_window >= 14:
-            # 10-hour rest reset
-            rest_duration = 10
-            rest_end = current_time + timedelta(hours=rest_duration)
-            timeline.append({"day": day, "start": current_time, "end": rest_end, "status": "Off Duty", "reason": "10-hour reset"})
-            rest_index = min(segment_index + len(points) // 4, len(points) - 1)
-            stops.append({"type": "rest", "location": points[rest_index], "duration": rest_duration, "reason": "Daily reset"})
-            current_time = rest_end
-            window_start = rest_end
-            driving_today = 0
-            on_duty_today = 0
-            day += 1
-            continue
-
-        if cumulative_driving >= 8 and available_driving > 0:
-            break_end = current_time + timedelta(minutes=30)
-            timeline.append({"day": day, "start": current_time, "end": break_end, "status": "On Duty Not Driving", "reason": "30-min break"})
-            current_time = break_end
-            on_duty_today += 0.5
-            total_on_duty += 0.5
-            cumulative_driving = 0
-
-        # Fuel stop every 1000 miles
-        segment_miles = (total_distance_miles / len(points)) * (len(points) // total_driving_hours) * available_driving
-        if miles_driven + segment_miles >= 1000:
-            fuel_end = current_time + timedelta(minutes=30)
-            fuel_index = min(segment_index + len(points) // 3, len(points) - 1)
-            timeline.append({"day": day, "start": current_time, "end": fuel_end, "status": "On Duty Not Driving", "reason": "Fuel stop"})
-            stops.append({"type": "fuel", "location": points[fuel_index], "duration": 0.5, "reason": "Fuel stop"})
-            current_time = fuel_end
-            on_duty_today += 0.5
-            total_on_duty += 0.5
-            miles_driven = miles_driven % 1000
-
-        # Driving
-        drive_end = current_time + timedelta(hours=available_driving)
-        timeline.append({"day": day, "start": current_time, "end": drive_end, "status": "Driving"})
-        current_time = drive_end
-        driving_today += available_driving
-        cumulative_driving += available_driving
-        remaining_hours -= available_driving
-        miles_driven += segment_miles
-        segment_index = int(min(segment_index + len(points) // max(1, total_driving_hours // available_driving), len(points) - 1))
-
-        if total_on_duty >= 70:
-            restart_end = current_time + timedelta(hours=34)
-            timeline.append({"day": day, "start": current_time, "end": restart_end, "status": "Off Duty", "reason": "34-hour restart"})
-            stops.append({"type": "restart", "location": points[-1], "duration": 34.0, "reason": "70-hour restart"})
-            current_time = restart_end
-            total_on_duty = 0
-            day += 2
-
-    # Dropoff
-    dropoff_end = current_time + timedelta(hours=1)
-    timeline.append({"day": day, "start": current_time, "end": dropoff_end, "status": "On Duty Not Driving", "reason": f"Unloading at {dropoff_loc}"})
-    stops.append({"type": "dropoff", "location": dropoff_coords, "duration": 1.0, "reason": f"Unloading at {dropoff_loc}"})
-    current_time = dropoff_end
-
-    return timeline, stops, total_distance_miles, total_driving_hours, current_time, points
-
-
-def split_into_logs(timeline, current_loc, pickup_loc, dropoff_loc):
-    """Split timeline into per-day logs."""
-    logs = []
-    by_day = {}
-    for entry in timeline:
-        d = entry["start"].date()
-        by_day.setdefault(d, []).append(entry)
-
-    for i, (log_date, entries) in enumerate(sorted(by_day.items()), start=1):
-        totals = {"driving": 0, "on_duty": 0, "off_duty": 0, "sleeper": 0}
-        blocks = []
-        for seg in entries:
-            hours = (seg["end"] - seg["start"]).total_seconds() / 3600
-            if seg["status"] == "Driving":
-                totals["driving"] += hours
-            elif seg["status"] == "On Duty Not Driving":
-                totals["on_duty"] += hours
-            elif seg["status"] == "Off Duty":
-                totals["off_duty"] += hours
-            elif seg["status"] == "Sleeper":
-                totals["sleeper"] += hours
-            blocks.append({
-                "start": seg["start"].strftime("%H:%M"),
-                "end": seg["end"].strftime("%H:%M"),
-                "status": seg["status"],
-                "reason": seg.get("reason", "")
-            })
-        logs.append({
-            "day": i,
-            "date": str(log_date),
-            "timeBlocks": blocks,
-            "totals": {k: round(v, 2) for k, v in totals.items()},
-            "remarks": f"Trip Day {i}: {current_loc} → {pickup_loc} → {dropoff_loc}"
-        })
-    return logs
-
-
-def build_summary(total_distance_miles, total_driving_hours, current_time):
-    """Build overall trip summary."""
-    return {
-        "total_distance_miles": round(total_distance_miles, 1),
-        "total_driving_hours": round(total_driving_hours, 1),
-        "total_trip_hours": round(total_driving_hours + 2, 1),  # +2 for pickup/dropoff
-        "estimated_arrival": current_time.isoformat()
-    }
-
 @api_view(["POST"])
 def plan_trip(request):
     try:
-        data = request.data
-        current_loc = data.get("current_location", {}).get("address")
-        pickup_loc = data.get("pickup_location", {}).get("address")
-        dropoff_loc = data.get("dropoff_location", {}).get("address")
-        current_cycle = float(data.get("current_cycle_used", 0))
-        start_date = data.get("start_date")
-        start_time = datetime.fromisoformat(start_date) if start_date else datetime(2025, 9, 27, 22, 54)  # 10:54 PM WAT
-
-        # Use provided coordinates directly
-        current_coords = [data["current_location"]["lat"], data["current_location"]["lng"]]
-        pickup_coords = [data["pickup_location"]["lat"], data["pickup_location"]["lng"]]
-        dropoff_coords = [data["dropoff_location"]["lat"], data["dropoff_location"]["lng"]]
-        if not all([current_coords, pickup_coords, dropoff_coords]):
-            return Response({"error": "Invalid locations"}, status=status.HTTP_400_BAD_REQUEST)
+        plan = parse_plan_request(request.data)
+
+        # NDJSON: summary, timeline/logs as produced, geometry chunks, trip id
+        if request.data.get("stream"):
+            route_data = fetch_route(waypoints(plan))
+            return StreamingHttpResponse(_ndjson(iter_plan(plan, route_data)), content_type="application/x-ndjson")
+
+        def compute():
+            # Route
+            with span("fetch_route"):
+                route_data = fetch_route(waypoints(plan))
+
+            response_data = build_plan(plan, route_data)
+            return response_data, save_plan(plan, response_data)
+
+        # Repeats inside the replay window get the saved plan back
+        response_data, trip, replayed = idempotent_plan(plan, compute, request.headers.get("Idempotency-Key"))
+        finalize_response(plan, response_data, trip)
+
+        response = Response(response_data, status=status.HTTP_200_OK)
+        if replayed:
+            response["Idempotent-Replayed"] = "true"
+        return response
+
+    except IdempotencyConflict as e:
+        return Response({"error": str(e)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    except WriteQueueFull as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+    except UpstreamError as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Route
-        route_data = fetch_route([current_coords, pickup_coords, dropoff_coords])
 
-        # Timeline
-        timeline, stops, total_distance, total_driving, end_time, points = build_timeline(
-            start_time, route_data, current_cycle, pickup_coords, dropoff_coords, current_loc, pickup_loc, dropoff_loc
-        )
+def _ndjson(records):
+    """One {"type", "data"} object per line; a failure mid-stream becomes a final error record."""
+    try:
+        for kind, payload in records:
+            yield dumps({"type": kind, "data": payload}) + b"\n"
+    except Exception as e:
+        yield dumps({"type": "error", "error": str(e)}) + b"\n"
 
-        # Logs
-        logs = split_into_logs(timeline, current_loc, pickup_loc, dropoff_loc)
-
-        # Summary
-        summary = build_summary(total_distance, total_driving, end_time)
-        
-        response_data = {
-            "route": {"points": points, "stops": stops},
-            "timeline": [
-                {
-                    "day": seg["day"],
-                    "start": seg["start"].strftime("%H:%M"),
-                    "end": seg["end"].strftime("%H:%M"),
-                    "status": seg["status"],
-                    "reason": seg.get("reason", "")
-                } for seg in timeline
-            ],
-            "logs": logs,
-            "summary": summary
-        }
-
-        TripPlan.objects.create(
-            driver_name=data.get("driver_name"),
-            co_driver_name=data.get("co_driver_name"),
-            truck_number=data.get("truck_number"),
-            trailer_number=data.get("trailer_number"),
-            start_date=start_time,
-            current_cycle_used=current_cycle,
-            plan_data=response_data
+
+@api_view(["POST"])
+def plan_trip_batch(request):
+    """Plan many trips in one call; results and errors are reported per trip."""
+    trips = request.data.get("trips")
+    if not isinstance(trips, list) or not trips:
+        return Response({"error": "trips must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+    max_trips = settings.BATCH_PLANNING.get("MAX_TRIPS", 500)
+    if len(trips) > max_trips:
+        return Response({"error": f"At most {max_trips} trips per batch"}, status=status.HTTP_400_BAD_REQUEST)
+
+    results = plan_batch(trips, detail=bool(request.data.get("detail")))
+    errors = sum(1 for r in results if "error" in r)
+    return Response({"results": results, "planned": len(results) - errors, "failed": errors}, status=status.HTTP_200_OK)
+
+
+@api_view(["POST"])
+def plan_trip_sweep(request):
+    """ETAs over a grid of start times and cycle hours for one route; nothing is saved."""
+    try:
+        plan = parse_plan_request(request.data)
+        start_times, cycles = parse_sweep(request.data, settings.SWEEP.get("MAX_CELLS", 5000))
+
+        # Route (once for the whole grid)
+        route_data = fetch_route(waypoints(plan))
+
+        return Response(sweep_route(route_data, start_times, cycles), status=status.HTTP_200_OK)
+
+    except UpstreamError as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(["POST"])
+def dispatch_matrix(request):
+    """Rank candidate trucks for one or more loads from a single travel-time table; nothing is saved."""
+    try:
+        limits = settings.DISPATCH
+        dispatch = parse_dispatch_request(
+            request.data, limits.get("MAX_TRUCKS", 500), limits.get("MAX_LOADS", 50), limits.get("MAX_PAIRS", 10000)
         )
+        return Response(build_dispatch_matrix(dispatch), status=status.HTTP_200_OK)
+
+    except UpstreamError as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@csrf_exempt
+@require_POST
+async def plan_trip_async(request):
+    """plan_trip for the ASGI application.
+
+    Routing uses the non-blocking client; the timeline/log stages and the
+    TripPlan write run in worker threads so the event loop stays free.
+    """
+    try:
+        plan = parse_plan_request(json.loads(request.body))
+
+        # Route
+        route_data = await afetch_route(waypoints(plan))
+
+        response_data = await sync_to_async(build_plan, thread_sensitive=False)(plan, route_data)
+        trip = await sync_to_async(save_plan)(plan, response_data)
+        await sync_to_async(finalize_response, thread_sensitive=False)(plan, response_data, trip)
+
+        return HttpResponse(dumps(response_data), content_type="application/json", status=status.HTTP_200_OK)
+
+    except WriteQueueFull as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+    except UpstreamError as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+# ------------------ TRIP HISTORY ------------------
+
+LIST_FIELDS = [f for f in TripPlanSerializer.Meta.fields if f != "plan_data"]
+
+
+def _history_fields(request, default):
+    """Serializer fields picked with ?fields=a,b (id is always included)."""
+    raw = request.query_params.get("fields")
+    if not raw:
+        return default
+    fields = [f.strip() for f in raw.split(",") if f.strip()]
+    unknown = set(fields) - set(TripPlanSerializer.Meta.fields)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return ["id"] + [f for f in fields if f != "id"]
+
+
+def _history_queryset(fields):
+    """TripPlans loading only the columns behind ``fields``."""
+    columns = {"id", "created_at", "updated_at"} | {f for f in fields if f != "summary"}
+    queryset = TripPlan.objects.only(*columns)
+    if "summary" in fields:
+        queryset = queryset.annotate(summary=F("plan_data__summary"))
+    return queryset
+
+
+def _conditional(request, trips, fields, extra, build, dated=True):
+    """Answer 304 when the client's ETag/Last-Modified is current, else ``build()``.
+
+    The ETag covers the selected fields and the (id, updated_at) of every
+    trip in the response, so it changes whenever any of them is re-planned
+    or drops out. Lists pass ``dated=False``: deleting a trip leaves the
+    newest updated_at as it was, so they carry no Last-Modified and
+    If-Modified-Since alone never turns them into a 304.
+    """
+    versions = [(t.id, t.updated_at.timestamp()) for t in trips]
+    etag = quote_etag(hashlib.sha1(repr((fields, versions, extra)).encode("utf-8")).hexdigest())
+    last_modified = int(max(v for _, v in versions)) if versions and dated else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = build()
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+@api_view(["GET"])
+def trip_list(request):
+    """Saved trips, newest first, with keyset pagination (?cursor=, ?limit=).
+
+    Filter with ?driver= and ?truck=; ?fields= selects columns (plan_data is
+    left out unless asked for).
+    """
+    conf = settings.TRIP_HISTORY
+    try:
+        fields = _history_fields(request, LIST_FIELDS)
+        limit = int(request.query_params.get("limit", conf.get("PAGE_SIZE", 20)))
+        if not 1 <= limit <= conf.get("MAX_PAGE_SIZE", 100):
+            raise ValueError(f"limit must be between 1 and {conf.get('MAX_PAGE_SIZE', 100)}")
+
+        queryset = _history_queryset(fields)
+        if request.query_params.get("driver"):
+            queryset = queryset.filter(driver_name=request.query_params["driver"])
+        if request.query_params.get("truck"):
+            queryset = queryset.filter(truck_number=request.query_params["truck"])
+        trips, next_cursor = keyset_page(queryset, request.query_params.get("cursor"), limit)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return _conditional(request, trips, fields, next_cursor, lambda: Response({
+        "results": TripPlanSerializer(trips, many=True, fields=fields).data,
+        "next": next_cursor,
+    }), dated=False)
+
+
+@api_view(["GET"])
+def trip_detail(request, trip_id):
+    """One saved trip; ?fields= selects columns as in trip_list."""
+    try:
+        fields = _history_fields(request, TripPlanSerializer.Meta.fields)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        trip = _history_queryset(fields).get(id=trip_id)
+    except TripPlan.DoesNotExist:
+        return Response({"error": "Trip not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    return _conditional(request, [trip], fields, None, lambda: Response(TripPlanSerializer(trip, fields=fields).data))
+
+
+# ------------------ RE-PLANNING ------------------
+
+@api_view(["POST"])
+def trip_replan(request, trip_id):
+    """Re-plan a saved trip from the driver's position and time (and duty state); see trips.replan."""
+    try:
+        trip = TripPlan.objects.get(id=trip_id)
+    except TripPlan.DoesNotExist:
+        if writebehind.writer.get(trip_id) is not None:
+            return Response({"error": "Trip is still being saved; retry"}, status=status.HTTP_409_CONFLICT, headers={"Retry-After": "1"})
+        return Response({"error": "Trip not found"}, status=status.HTTP_404_NOT_FOUND)
 
+    try:
+        response_data, changes = replan(trip, parse_replan_request(request.data))
+        save_replan(trip, changes)
         return Response(response_data, status=status.HTTP_200_OK)
 
+    except ReplanConflict as e:
+        return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+    except UpstreamError as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-# @api_view(['GET'])
-# def generate_log_pdf(request, trip_id, day):
-#     try:
-#         # Fetch TripPlan and validate
-#         trip = TripPlan.objects.get(id=trip_id)
-#         plan_data = trip.plan_data
-#         logs = plan_data.get("logs", [])
-#         day_log = next((log for log in logs if log.get("day") == day), None)
-#         if not day_log:
-#             return Response({"error": "Day log not found"}, status=404)
-
-#         # Prepare response
-#         response = HttpResponse(content_type='application/pdf')
-#         response['Content-Disposition'] = f'attachment; filename="eld_log_day_{day}.pdf"'
-#         doc = SimpleDocTemplate(response, pagesize=letter, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=72)
-#         styles = getSampleStyleSheet()
-#         story = []
-
-#         # Custom styles
-#         title_style = ParagraphStyle(
-#             name='TitleStyle',
-#             parent=styles['Heading1'],
-#             fontSize=18,
-#             spaceAfter=12
-#         )
-#         normal_style = ParagraphStyle(
-#             name='NormalStyle',
-#             parent=styles['Normal'],
-#             fontSize=10
-#         )
-
-#         # Header
-#         story.append(Paragraph(f"DRIVER'S DAILY LOG - DAY {day}", title_style))
-#         story.append(Paragraph(f"Date: {day_log.get('date', 'N/A')}", normal_style))
-#         story.append(Spacer(1, 12))
-#         story.append(Paragraph(f"Driver: {trip.driver_name or 'N/A'}", normal_style))
-#         story.append(Paragraph(f"Co-Driver: {trip.co_driver_name or 'N/A'}", normal_style))
-#         story.append(Paragraph(f"Truck #: {trip.truck_number or 'N/A'}", normal_style))
-#         story.append(Paragraph(f"Trailer #: {trip.trailer_number or 'N/A'}", normal_style))
-#         story.append(Spacer(1, 12))
-
-#         # Status Legend
-#         story.append(Paragraph("DUTY STATUS LEGEND", styles['Heading2']))
-#         legend_data = [
-#             ['Color', 'Status'],
-#             ['#10b981', 'Off Duty'],
-#             ['#8b5cf6', 'Sleeper Berth'],
-#             ['#dc2626', 'Driving'],
-#             ['#f59e0b', 'On Duty (Not Driving)']
-#         ]
-#         legend_table = Table(legend_data, colWidths=[0.5*inch, 2*inch], style=[
-#             ('BACKGROUND', (0, 0), (0, -1), colors.grey),
-#             ('TEXTCOLOR', (0, 0), (0, -1), colors.black),
-#             ('ALIGN', (0, 0), (0, -1), 'CENTER'),
-#             ('BACKGROUND', (1, 1), (1, -1), colors.white),
-#             ('TEXTCOLOR', (1, 1), (1, -1), colors.black),
-#             ('GRID', (0, 0), (-1, -1), 1, colors.black)
-#         ])
-#         story.append(legend_table)
-#         story.append(Spacer(1, 12))
-
-#         # 24-Hour Grid
-#         hours = list(range(24))
-#         grid_data = [['Time'] + [f"{h:02d}" for h in hours]]
-#         statuses = ['Off Duty', 'Sleeper Berth', 'Driving', 'On Duty (Not Driving)']
-#         for status in statuses:
-#             row = [status]
-#             hourly_grid = [status] * 24  # Default to the status
-#             time_blocks = day_log.get("gridData", {}).get("timeBlocks", [])
-#             for block in time_blocks:
-#                 start_parts = block.get("start", "00:00").split(':')
-#                 end_parts = block.get("end", "00:00").split(':')
-#                 start_hour = int(start_parts[0]) + (int(start_parts[1]) / 60 if len(start_parts) > 1 else 0)
-#                 end_hour = int(end_parts[0]) + (int(end_parts[1]) / 60 if len(end_parts) > 1 else 0)
-#                 for h in range(int(start_hour), min(int(end_hour) + 1, 24)):
-#                     if 0 <= h < 24:
-#                         hourly_grid[h] = block.get("status", "Off Duty")
-#             row.extend(hourly_grid)
-#             grid_data.append(row)
-
-#         grid_table = Table(grid_data, colWidths=[0.5*inch] + [0.25*inch] * 24, style=[
-#             ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-#             ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-#             ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-#             ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-#             ('BACKGROUND', (1, 1), (-1, -1), colors.white),
-#         ])
-#         for i, status in enumerate(statuses, 1):
-#             for j in range(1, 25):
-#                 if grid_data[i][j] == status:
-#                     grid_table.setStyle([
-#                         ('BACKGROUND', (j, i), (j, i), status_colors.get(status, colors.white))
-#                     ])
-#         story.append(grid_table)
-#         story.append(Spacer(1, 12))
-
-#         # Summary
-#         totals = day_log.get("totals", {"driving": 0, "on_duty": 0, "off_duty": 0, "sleeper": 0})
-#         summary_data = [
-#             ['Category', 'Hours'],
-#             ['Off Duty', f"{totals.get('off_duty', 0):.2f}"],
-#             ['Sleeper Berth', f"{totals.get('sleeper', 0):.2f}"],
-#             ['Driving', f"{totals.get('driving', 0):.2f}"],
-#             ['On Duty (Not Driving)', f"{totals.get('on_duty', 0):.2f}"]
-#         ]
-#         summary_table = Table(summary_data, colWidths=[1.5*inch, 1*inch], style=[
-#             ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-#             ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-#             ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-#             ('GRID', (0, 0), (-1, -1), 1, colors.black)
-#         ])
-#         story.append(summary_table)
-#         story.append(Spacer(1, 12))
-
-#         # Locations
-#         story.append(Paragraph("Locations", styles['Heading2']))
-#         story.append(Paragraph(f"Starting: {trip.plan_data.get('current_location', {}).get('address', 'N/A')}", normal_style))
-#         story.append(Paragraph(f"Ending: {trip.plan_data.get('dropoff_location', {}).get('address', 'N/A')}", normal_style))
-#         story.append(Spacer(1, 12))
-
-#         # Total Miles
-#         total_miles = trip.plan_data.get("summary", {}).get("total_distance_miles", 0) / len(logs or [1])  # Approx per day
-#         story.append(Paragraph(f"Total Miles: {total_miles:.0f} miles", normal_style))
-#         story.append(Spacer(1, 12))
-
-#         # Remarks
-#         story.append(Paragraph("Remarks", styles['Heading2']))
-#         story.append(Paragraph(day_log.get("remarks", "No remarks"), normal_style))
-
-#         # Build the PDF
-#         doc.build(story)
-#         return response
-
-#     except ObjectDoesNotExist:
-#         return Response({"error": "Trip not found"}, status=404)
-#     except Exception as e:
-#         return Response({"error": f"Error generating PDF: {str(e)}"}, status=500)
-
-# # Define status_colors globally or within the function
-# status_colors = {
-#     'Off Duty': colors.green,
-#     'Sleeper Berth': colors.purple,
-#     'Driving': colors.red,
-#     'On Duty (Not Driving)': colors.yellow
-# }
\ No newline at end of file
+
+# ------------------ SPATIAL ------------------
+
+def _radius(value):
+    limit = settings.SPATIAL_INDEX.get("MAX_RADIUS_MILES", 250)
+    radius = float(value if value is not None else 20)
+    if not 0 < radius <= limit:
+        raise ValueError(f"radius_miles must be between 0 and {limit}")
+    return radius
+
+
+def _spatial_results(request, trip_ids):
+    """Serialized trips (newest first, up to MAX_RESULTS) and the total match count."""
+    fields = _history_fields(request, LIST_FIELDS)
+    limit = settings.SPATIAL_INDEX.get("MAX_RESULTS", 1000)
+    page = sorted(trip_ids, reverse=True)[:limit]
+    trips = _history_queryset(fields).filter(id__in=page).order_by("-id")
+    return Response({
+        "results": TripPlanSerializer(trips, many=True, fields=fields).data,
+        "count": len(trip_ids),
+        "truncated": len(trip_ids) > limit,
+    })
+
+
+@api_view(["GET"])
+def trips_near(request):
+    """Trips whose route passes within ?radius_miles= (default 20) of ?lat=&lng=."""
+    try:
+        lat, lng = float(request.query_params["lat"]), float(request.query_params["lng"])
+        return _spatial_results(request, spatial.near(lat, lng, _radius(request.query_params.get("radius_miles"))))
+    except KeyError as e:
+        return Response({"error": f"{e.args[0]} is required"}, status=status.HTTP_400_BAD_REQUEST)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(["GET"])
+def trips_within(request):
+    """Trips whose route enters ?bbox=min_lat,min_lng,max_lat,max_lng."""
+    try:
+        bbox = [float(v) for v in request.query_params.get("bbox", "").split(",")]
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise ValueError("bbox must be min_lat,min_lng,max_lat,max_lng")
+        return _spatial_results(request, spatial.within(bbox))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(["POST"])
+def trips_corridor(request):
+    """Trips passing within radius_miles (default 20) of a polyline given as
+    "points" ([[lat, lng], ...]) or an encoded "polyline"."""
+    try:
+        if "polyline" in request.data:
+            points = decode_polyline(request.data["polyline"], int(request.data.get("precision", 5)))
+        else:
+            points = [[float(lat), float(lng)] for lat, lng in request.data.get("points") or []]
+        if not points:
+            raise ValueError("points or polyline is required")
+        return _spatial_results(request, spatial.corridor(points, _radius(request.data.get("radius_miles"))))
+    except (TypeError, ValueError) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(["GET"])
+def trip_geometry(request, trip_id):
+    """Route geometry of a saved trip at any resolution, optionally clipped to a bbox.
+
+    Lets the map show the coarse geometry from the plan response first and
+    fetch detail for the current viewport on demand.
+    """
+    try:
+        trip = TripPlan.objects.only("id", "plan_data", "geometry").get(id=trip_id)
+    except TripPlan.DoesNotExist:
+        return Response({"error": "Trip not found"}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        options = parse_geometry_options(request.query_params.dict())
+        bbox = request.query_params.get("bbox")
+        bbox = [float(v) for v in bbox.split(",")] if bbox else None
+        if bbox is not None and len(bbox) != 4:
+            raise ValueError("bbox must be min_lat,min_lng,max_lat,max_lng")
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    points = stored_points(trip)
+    parts = [points]
+    if bbox is not None:
+        parts = clip_to_bbox(points, bbox)
+    if options["simplify"] != "none" and options["tolerance"] > 0:
+        parts = [SIMPLIFIERS[options["simplify"]](part, options["tolerance"]) for part in parts]
+    key = "polyline" if options["encoding"] == "polyline" else "points"
+    return Response({
+        "trip_id": trip.id,
+        "parts": [{key: encode_polyline(part) if key == "polyline" else part} for part in parts],
+        "geometry": {**{k: options[k] for k in ("simplify", "tolerance", "encoding")}, "points": sum(len(p) for p in parts)},
+    })
+
+
+@api_view(["POST"])
+def geocode_batch(request):
+    """Resolve many free-text addresses in one call."""
+    addresses = request.data.get("addresses")
+    if not isinstance(addresses, list) or not all(isinstance(a, str) for a in addresses):
+        return Response({"error": "addresses must be a list of strings"}, status=status.HTTP_400_BAD_REQUEST)
+    max_batch = settings.GEOCODE_CACHE.get("MAX_BATCH", 100)
+    if len(addresses) > max_batch:
+        return Response({"error": f"At most {max_batch} addresses per batch"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        results, stats = geocode_many(addresses)
+    except UpstreamError as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response({"results": results, "stats": stats}, status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+def upstream_status(request):
+    """Connection pool, circuit breaker and route cache state for monitoring."""
+    return Response({
+        "upstreams": {name: client.stats() for name, client in upstream_clients.items()},
+        "route_cache": route_cache.stats(),
+        "geocode_cache": geocode_cache.stats(),
+    })
+
+
+# ------------------ ANALYTICS ------------------
+
+def _report_range(request):
+    """?from=&to= as dates (default: the current month so far)."""
+    today = localdate()
+    start = date.fromisoformat(request.query_params.get("from") or today.replace(day=1).isoformat())
+    end = date.fromisoformat(request.query_params.get("to") or today.isoformat())
+    limit = settings.ANALYTICS.get("MAX_DAYS", 366)
+    if not 0 <= (end - start).days < limit:
+        raise ValueError(f"from must not be after to, and the range at most {limit} days")
+    return start, end
+
+
+@api_view(["GET"])
+def analytics_drivers(request):
+    """Per-driver and fleet HOS totals between ?from= and ?to= (optionally one ?driver=)."""
+    try:
+        start, end = _report_range(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(rollups.driver_report(start, end, request.query_params.get("driver")))
+
+
+@api_view(["GET"])
+def analytics_trucks(request):
+    """Per-truck weekly and total HOS figures for the weeks overlapping ?from=..?to= (optionally one ?truck=)."""
+    try:
+        start, end = _report_range(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(rollups.truck_report(start, end, request.query_params.get("truck")))
+
+
+# ------------------ LOG PDFS ------------------
+
+def _rendering():
+    response = Response({"status": "rendering"}, status=status.HTTP_202_ACCEPTED)
+    response["Retry-After"] = "1"
+    return response
+
+
+def _rendered(documents):
+    """None once ``documents`` are cached, else the 202 (or 500 after a failed render) to answer."""
+    try:
+        return None if ensure_rendered(documents) else _rendering()
+    except RenderFailed as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _trip_pdf_documents(trip_id):
+    trip = TripPlan.objects.only("id", "driver_name", "co_driver_name", "truck_number", "trailer_number", "plan_data").get(id=trip_id)
+    return {name: (document_key(doc), doc) for name, doc in trip_documents(trip).items()}
+
+
+@api_view(["GET"])
+def generate_log_pdf(request, trip_id, day=None):
+    """Daily log PDF for one day, or every day of the trip in one file.
+
+    Answers 202 (Retry-After) while the PDF renders in the background,
+    and 500 if rendering it failed.
+    Files are content-addressed, so the key doubles as a strong ETag.
+    """
+    try:
+        documents = _trip_pdf_documents(trip_id)
+    except TripPlan.DoesNotExist:
+        return Response({"error": "Trip not found"}, status=status.HTTP_404_NOT_FOUND)
+    name = "all" if day is None else day
+    if name not in documents:
+        return Response({"error": "Day log not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    # A day request renders every day: the ZIP and the other days usually follow
+    wanted = [documents["all"]] if day is None else [v for k, v in documents.items() if k != "all"]
+    pending = _rendered(wanted)
+    if pending is not None:
+        return pending
+
+    key = documents[name][0]
+    etag = quote_etag(key)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        filename = f"eld_logs_trip_{trip_id}.pdf" if day is None else f"eld_log_day_{day}.pdf"
+        response = FileResponse(open(cache_path(key), "rb"), content_type="application/pdf", as_attachment=True, filename=filename)
+    response["ETag"] = etag
+    return response
+
+
+@api_view(["GET"])
+def download_logs_zip(request, trip_id):
+    """Every daily log PDF of a trip as a streamed ZIP."""
+    try:
+        documents = _trip_pdf_documents(trip_id)
+    except TripPlan.DoesNotExist:
+        return Response({"error": "Trip not found"}, status=status.HTTP_404_NOT_FOUND)
+    days = sorted((k, v) for k, v in documents.items() if k != "all")
+    if not days:
+        return Response({"error": "Trip has no logs"}, status=status.HTTP_404_NOT_FOUND)
+    pending = _rendered([v for _, v in days])
+    if pending is not None:
+        return pending
+
+    entries = [(f"eld_log_day_{day}.pdf", cache_path(key)) for day, (key, _) in days]
+    response = StreamingHttpResponse(stream_zip(entries), content_type="application/zip")
+    response["Content-Disposition"] = f'attachment; filename="eld_logs_trip_{trip_id}.zip"'
+    return response
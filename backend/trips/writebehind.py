@@ -0,0 +1,259 @@
+"""Write-behind persistence for computed trip plans.
+
+With WRITE_BEHIND["ENABLED"] on (SQLite or PostgreSQL), save_plan
+reserves the TripPlan id up front and hands the unsaved row to a bounded
+in-process queue; a background thread writes whatever has queued up
+with records.save_trips (one transaction and one bulk insert per table
+for the whole batch).
+Requests no longer wait on the database write lock, at the cost of reads
+(trip history, PDFs) lagging the response by one flush.
+
+A full queue blocks the producer for up to ENQUEUE_TIMEOUT seconds and
+then raises WriteQueueFull (the view answers 503). The queue is drained
+at interpreter exit.
+
+A batch that still fails after its retries is written again in halves,
+down to single plans, so one bad row only holds back itself. Plans that
+cannot be written alone are appended to the DEAD_LETTER file as Django
+JSON lines; deserialize them and pass them to records.save_trips to retry.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core import serializers
+from django.db import connection, transaction
+
+from .models import TripPlan
+from .records import save_trips
+
+logger = logging.getLogger(__name__)
+
+
+_settings = getattr(settings, "WRITE_BEHIND", {})
+
+
+# Databases IdAllocator can reserve ids on; elsewhere write-behind stays off
+ID_VENDORS = ("sqlite", "postgresql")
+
+
+def enabled():
+    return getattr(settings, "WRITE_BEHIND", {}).get("ENABLED", False) and connection.vendor in ID_VENDORS
+
+
+class WriteQueueFull(Exception):
+    """The write-behind queue stayed full for ENQUEUE_TIMEOUT seconds."""
+
+
+# ------------------ IDS ------------------
+
+class IdAllocator:
+    """Hands out TripPlan ids reserved from the database in blocks.
+
+    A block is reserved by advancing the table's sequence, so ids never
+    collide with rows inserted by other processes or the normal
+    auto-increment path.
+    """
+
+    def __init__(self, model=TripPlan, block=100):
+        self.model = model
+        self.block = block
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+
+    def next(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._reserve(self.block)
+            value = self._next
+            self._next += 1
+            return value
+
+    def _reserve(self, n):
+        """Reserve ``n`` ids and return (first, end) of the half-open range."""
+        table = self.model._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == "sqlite":
+                # AUTOINCREMENT tables keep their high-water mark in sqlite_sequence
+                cursor.execute("UPDATE sqlite_sequence SET seq = seq + %s WHERE name = %s", [n, table])
+                if cursor.rowcount == 0:
+                    cursor.execute(f'SELECT COALESCE(MAX("id"), 0) FROM "{table}"')
+                    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [table, cursor.fetchone()[0] + n])
+                cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+                end = cursor.fetchone()[0] + 1
+                return end - n, end
+            if connection.vendor == "postgresql":
+                cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)", [table, n])
+                ids = sorted(row[0] for row in cursor.fetchall())
+                # Sequences are not guaranteed contiguous under concurrency; keep the leading run
+                run = next((i for i in range(1, len(ids)) if ids[i] != ids[i - 1] + 1), len(ids))
+                return ids[0], ids[0] + run
+        raise NotImplementedError(f"write-behind id reservation is not supported on {connection.vendor}")
+
+
+# ------------------ QUEUE ------------------
+
+class WriteBehindQueue:
+    """Bounded queue of unsaved TripPlans with a background bulk writer."""
+
+    def __init__(self, maxsize=1000, batch_size=100, enqueue_timeout=2.0, retries=3, dead_letter=None):
+        self.batch_size = batch_size
+        self.enqueue_timeout = enqueue_timeout
+        self.retries = retries
+        self.dead_letter = dead_letter
+        self._queue = queue.Queue(maxsize)
+        self._pending = {}  # id -> TripPlan, until written
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = {"enqueued": 0, "written": 0, "batches": 0, "failed": 0, "rejected": 0}
+
+    def _count(self, event, n=1):
+        with self._lock:
+            self.stats[event] += n
+
+    def put(self, trip):
+        """Queue a TripPlan whose id is already set; blocks while the queue is full."""
+        self._ensure_started()
+        with self._lock:
+            self._pending[trip.id] = trip
+        try:
+            self._queue.put(trip, timeout=self.enqueue_timeout)
+        except queue.Full:
+            with self._lock:
+                self._pending.pop(trip.id, None)
+            self._count("rejected")
+            raise WriteQueueFull("Trip plan write queue is full, try again shortly") from None
+        self._count("enqueued")
+        return trip
+
+    def get(self, trip_id):
+        """The queued, not yet written TripPlan with this id, or None."""
+        with self._lock:
+            return self._pending.get(trip_id)
+
+    def unwritten(self):
+        """Trips queued or being written."""
+        return self._queue.unfinished_tasks
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trip-write-behind", daemon=True)
+                    self._thread.start()
+
+    def _take(self):
+        """Block for one item, then take whatever else is queued, up to batch_size."""
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            self._write(batch)
+            with self._lock:
+                for trip in batch:
+                    self._pending.pop(trip.id, None)
+            for _ in batch:
+                self._queue.task_done()
+            connection.close_if_unusable_or_obsolete()
+
+    def _save(self, batch):
+        save_trips(batch)
+        self._count("written", len(batch))
+        self._count("batches")
+
+    def _write(self, batch):
+        for attempt in range(self.retries + 1):
+            try:
+                self._save(batch)
+                return
+            except Exception:
+                if attempt < self.retries:
+                    time.sleep(0.05 * 2 ** attempt)
+                elif len(batch) == 1:
+                    self._dead_letter(batch[0])
+                else:
+                    logger.warning("write-behind: batch of %d trip plans failed, writing it in halves", len(batch), exc_info=True)
+                    self._bisect(batch)
+
+    def _bisect(self, batch):
+        """Write a failed batch in halves, down to single plans."""
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            try:
+                self._save(half)
+            except Exception:
+                if len(half) == 1:
+                    self._dead_letter(half[0])
+                else:
+                    self._bisect(half)
+
+    def _dead_letter(self, trip):
+        """Keep a plan that cannot be written; called while handling its error."""
+        self._count("failed")
+        if not self.dead_letter:
+            logger.exception("write-behind: dropped trip plan %s", trip.id)
+            return
+        try:
+            # Values as the database would return them (save_plan sets start_date to a datetime),
+            # so the record deserializes
+            for field in trip._meta.concrete_fields:
+                setattr(trip, field.attname, field.to_python(getattr(trip, field.attname)))
+            line = serializers.serialize("jsonl", [trip])
+            directory = os.path.dirname(self.dead_letter)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.dead_letter, "a") as f:
+                f.write(line)
+        except Exception:
+            logger.exception("write-behind: dropped trip plan %s, could not keep it in %s", trip.id, self.dead_letter)
+            return
+        logger.exception("write-behind: trip plan %s not written, kept in %s", trip.id, self.dead_letter)
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is written; True if it was."""
+        if self._thread is None:
+            return self._queue.empty()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+
+if _settings.get("ENABLED") and connection.vendor not in ID_VENDORS:
+    logger.warning("write-behind: ids cannot be reserved on %s, plans are saved inline", connection.vendor)
+
+ids = IdAllocator(block=_settings.get("ID_BLOCK", 100))
+writer = WriteBehindQueue(
+    maxsize=_settings.get("QUEUE_SIZE", 1000),
+    batch_size=_settings.get("BATCH_SIZE", 100),
+    enqueue_timeout=_settings.get("ENQUEUE_TIMEOUT", 2.0),
+    dead_letter=_settings.get("DEAD_LETTER"),
+)
+
+
+def submit(trip):
+    """Give an unsaved TripPlan its id and queue it for the background writer."""
+    trip.id = ids.next()
+    return writer.put(trip)
+
+
+@atexit.register
+def _flush_at_exit():
+    timeout = _settings.get("SHUTDOWN_TIMEOUT", 30.0)
+    if writer.unwritten() and not writer.flush(timeout):
+        logger.error("write-behind: %d trip plans still queued at exit", writer.unwritten())
@@ -3,6 +3,9 @@ import type { DailyLog, Stop, TimeBlock } from '../types';
 import { useInputQueryStore } from '../zustand/inputQueryStore';
 import { useTripQueryStore } from '../zustand/tripQueryStore';
 
+// Status by slot code in DailyLog.grid
+const GRID_STATUSES = ['Off Duty', 'Sleeper', 'Driving', 'On Duty Not Driving'];
+
 interface ELDLogSheetProps {
   dailyLog: DailyLog;
   dayNumber: number;
@@ -27,10 +30,23 @@ const ELDLogSheet: React.FC<ELDLogSheetProps> = ({ dailyLog, dayNumber }) => {
     'On Duty Not Driving': 'On Duty (Not Driving)',
   };
 
-  // Create hourly grid data from timeBlocks
+  // Create hourly grid data from the log's slot grid (timeBlocks for older logs)
   const createHourlyGrid = () => {
     const grid = Array(24).fill('Off Duty'); // Default to Off Duty
-    
+
+    if (dailyLog.grid) {
+      const slots = Uint8Array.from(atob(dailyLog.grid), (c) => c.charCodeAt(0));
+      for (let hour = 0; hour < 24; hour++) {
+        // Last status in the hour, like the last block covering it below
+        for (let slot = hour * 4; slot < hour * 4 + 4; slot++) {
+          if (slots[slot] < GRID_STATUSES.length) {
+            grid[hour] = GRID_STATUSES[slots[slot]];
+          }
+        }
+      }
+      return grid;
+    }
+
     dailyLog.timeBlocks.forEach((block: TimeBlock) => {
       const startParts = block.start.split(':').map(Number);
       const startHour = startParts[0] + startParts[1] / 60;
@@ -16,6 +16,8 @@ const useCreateTrip = () => {
         truck_number: tripInput.truckNumber,
         trailer_number: tripInput.trailerNumber,
         start_date: tripInput.startDate,
+        // Drop vertices within 10 m of the line; the map can't show them anyway.
+        geometry: { simplify: "dp", tolerance: 10 },
       };
 
       const res = await tripServices.post({ data: payload });
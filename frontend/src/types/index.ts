@@ -85,6 +85,7 @@ export interface DailyLog {
   day: number;
   date: string; // "YYYY-MM-DD"
   timeBlocks: TimeBlock[];
+  grid?: string; // base64, 96 bytes: status code per 15 minutes (0 off duty, 1 sleeper, 2 driving, 3 on duty, 255 none)
   totals: DailyTotals;
   remarks: string;
 }